@@ -1,18 +1,20 @@
 from typing import Sequence
 
 from langchain.agents import AgentOutputParser
+from langchain.agents.output_parsers.tools import ToolAgentAction
 from langchain_core.agents import AgentAction, AgentActionMessageLog
 from langchain_core.language_models import BaseLanguageModel
-from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import Runnable, RunnablePassthrough
 from langchain_core.tools import BaseTool
 from langchain_openai import ChatOpenAI
 
 from pybot.agent.executor import PybotAgentExecutor
-from pybot.agent.output_parser import MarkdownOutputParser
-from pybot.agent.prompt import SYSTEM
+from pybot.agent.output_parser import MarkdownOutputParser, ToolCallingOutputParser
+from pybot.agent.prompt import SYSTEM, TOOL_CALLING_SYSTEM
 from pybot.config import settings
+from pybot.jupyter import kernel_manager
 from pybot.memory import memory
 from pybot.tools import CodeSandbox
 
@@ -30,6 +32,31 @@ def construct_scratchpad(
     return steps
 
 
+def construct_tool_scratchpad(
+    intermediate_steps: list[tuple[AgentAction, str]],
+) -> list[BaseMessage]:
+    """Scratchpad of the tool calling agent, tool calls are replayed as they were made, followed by their results."""
+    steps = []
+    for action, observation in intermediate_steps:
+        if not isinstance(action, ToolAgentAction):
+            steps.extend(construct_scratchpad([(action, observation)]))
+            continue
+        steps.append(
+            AIMessage(
+                content=action.log,
+                tool_calls=[
+                    {
+                        "name": action.tool,
+                        "args": action.tool_input,
+                        "id": action.tool_call_id,
+                    }
+                ],
+            )
+        )
+        steps.append(ToolMessage(content=observation, tool_call_id=action.tool_call_id))
+    return steps
+
+
 def create_agent(
     llm: BaseLanguageModel,
     tools: Sequence[BaseTool],
@@ -50,17 +77,42 @@ def create_agent(
     return agent
 
 
+def create_tool_calling_agent(
+    llm: BaseLanguageModel,
+    tools: Sequence[BaseTool],
+    prompt: ChatPromptTemplate,
+    output_parser: AgentOutputParser,
+) -> Runnable:
+    """Agent that calls tools by the OpenAI compatible tools API, instead of parsing them from the generated text.
+    The tools are described by their schemas, so the prompt doesn't need a 'tools' variable."""
+    agent = (
+        RunnablePassthrough.assign(
+            agent_scratchpad=lambda x: construct_tool_scratchpad(
+                x["intermediate_steps"]
+            ),
+        )
+        | prompt
+        | llm.bind_tools(tools)
+        | output_parser
+    )
+    return agent
+
+
 llm = ChatOpenAI(
     openai_api_base=str(settings.llm.url),
     model=settings.llm.model,
     openai_api_key=settings.llm.creds,
-    max_tokens=1024,
+    max_tokens=settings.llm.max_tokens,
     streaming=True,
 )
 
 prompt = ChatPromptTemplate.from_messages(
     [
-        ("system", SYSTEM),
+        (
+            "system",
+            TOOL_CALLING_SYSTEM if settings.agent_mode == "tool_calling" else SYSTEM,
+        ),
+        MessagesPlaceholder(variable_name="summary", optional=True),
         MessagesPlaceholder(variable_name="history"),
         ("user", "{input}"),
         MessagesPlaceholder(variable_name="agent_scratchpad"),
@@ -69,10 +121,31 @@ prompt = ChatPromptTemplate.from_messages(
 tools = [
     CodeSandbox(
         gateway_url=str(settings.jupyter.gateway_url),
+        kernel_manager=kernel_manager,
+        observation_budget=settings.observation_budget,
     )
 ]
-output_parser = MarkdownOutputParser(language_actions={"python": "python"})
-agent = create_agent(llm, tools, prompt, output_parser)
+guided = settings.llm.guided_decoding and settings.agent_mode == "markdown"
+output_parser = MarkdownOutputParser(
+    language_actions={"python": "python"},
+    trusted=guided,
+    multi_action=settings.multi_action,
+)
+if guided:
+    # Outputs are always well-formed, so parsing errors and the retries they cause are gone.
+    agent = create_agent(
+        llm.bind(extra_body={"guided_regex": output_parser.guided_regex()}),
+        tools,
+        prompt,
+        output_parser,
+    )
+elif settings.agent_mode == "tool_calling":
+    # Models may still answer with code blocks, which are executed as usual.
+    agent = create_tool_calling_agent(
+        llm, tools, prompt, ToolCallingOutputParser(fallback=output_parser)
+    )
+else:
+    agent = create_agent(llm, tools, prompt, output_parser)
 agent_executor = PybotAgentExecutor(
     agent=agent, tools=tools, memory=memory, handle_parsing_errors=True
 )
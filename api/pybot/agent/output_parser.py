@@ -1,48 +1,78 @@
 import ast
+import json
 import re
-from typing import Generator
+from functools import partial
+from typing import Any, AsyncIterator, Generator, Optional
 
 from langchain.agents import AgentOutputParser
+from langchain.agents.output_parsers.tools import ToolAgentAction
 from langchain_core.agents import AgentAction, AgentActionMessageLog, AgentFinish
 from langchain_core.exceptions import OutputParserException
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.runnables import RunnableConfig
 from loguru import logger
 
 
-def find_dicts(s: str) -> Generator[tuple[dict, int, int], None, None]:
-    """find dicts in a string
-    Modified from <https://stackoverflow.com/a/51862122/6564721>
+DICT_TOKEN = re.compile(
+    r"""[{}]|"(?:[^"\\\n]|\\.)*(?:"|$)|'(?:[^'\\\n]|\\.)*(?:'|$)""", re.M
+)
+"""Tokens that matter inside a dict: braces, and strings which may contain braces.
+Strings end at the line end if not closed, as neither python nor json strings span lines."""
+
+
+def find_dicts(
+    s: str, key: Optional[str] = None
+) -> Generator[tuple[dict, int, int], None, None]:
+    """find dicts in a string, in linear time of the string.
+
+    Only the outermost dicts are yielded, braces in strings inside them are ignored.
+    Dicts are parsed as json first, which is much faster than parsing them as python literals.
 
     Args:
         s (str): source string
+        key (Optional[str]): if set, skip parsing the {} pairs which don't contain it.
 
     Yields:
         Generator[tuple[dict, int, int], None, None]: generates a tuple of dict, the start index and the end index of the dict
     """
-    stack = []  # a stack to keep track of the brackets
-    buffer = ""  # a buffer to store current tracking string
-    start = 0  # the start index of the current dict
-    for i, ch in enumerate(s):
-        if ch == "{":
-            if start == 0:
-                start = i
-            buffer += ch
-            stack.append(ch)
-        elif ch == "}":
-            stack.pop(-1)
-            buffer += ch
-            if not stack:
-                try:
-                    yield ast.literal_eval(buffer), start, i
-                except ValueError:
-                    # LLM could generate non-dict {} pairs, which is also valid
-                    # So I only set the log level to debug, and continue searching.
-                    logger.debug(f"Failed to parse {buffer} into a dict")
-                # reset start for following search
-                start = 0
-                buffer = ""
-        elif stack:
-            buffer += ch
+    pos = 0
+    while (start := s.find("{", pos)) >= 0:
+        depth = 0
+        for token in DICT_TOKEN.finditer(s, start):
+            if token.group() == "{":
+                depth += 1
+            elif token.group() == "}":
+                depth -= 1
+                if not depth:
+                    end = token.start()
+                    break
+        else:
+            # not closed till the end
+            return
+        pos = end + 1
+        text = s[start : end + 1]
+        # a non-empty dict has at least one ':', for example f-string fields in code don't.
+        if ":" not in text or (key is not None and key not in text):
+            continue
+        try:
+            if isinstance(_dict := _parse_literal(text), dict):
+                yield _dict, start, end
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            # LLM could generate non-dict {} pairs, which is also valid
+            # So I only set the log level to debug, and continue searching.
+            logger.debug(f"Failed to parse {text} into a dict")
+
+
+def _parse_literal(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+CELL_SEPARATOR = "\n# %%\n"
+"""Separator of the code cells of a multi-block action when shown as a single snippet, a cell marker of the 'percent' format."""
 
 
 class ComposedOutputParser(AgentOutputParser):
@@ -65,43 +95,271 @@ class ComposedOutputParser(AgentOutputParser):
         return "composed"
 
 
+class CodeBlockScanner:
+    """Finds the first markdown code block in streaming text, in linear time of the text.
+
+    Only a short tail of the text fed is kept, in case a fence is split across chunks.
+    Positions are relative to the whole text fed.
+    """
+
+    opening_pattern = re.compile(r"`{3}([\w]*)\n")
+    closing_fence = "\n```"
+    max_opening_length = 64
+    """Longest opening fence (including the language) we look for across chunks."""
+
+    def __init__(self):
+        self.language: Optional[str] = None
+        """Language of the code block, None if not opened yet."""
+        self.start: int = -1
+        """Start of the opening fence."""
+        self.code_start: int = -1
+        self.code_end: int = -1
+        """End of the code (start of the closing fence), -1 if not closed yet."""
+        self._tail = ""
+        self._fed = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.code_end >= 0
+
+    def feed(self, text: str) -> bool:
+        """Feed a chunk of text, returns whether the code block is closed."""
+        if self.closed or not text:
+            return self.closed
+        buf = self._tail + text
+        # position of buf in the whole text
+        offset = self._fed - len(self._tail)
+        self._fed += len(text)
+        if self.language is None:
+            if (match := self.opening_pattern.search(buf)) is None:
+                self._tail = buf[-self.max_opening_length :]
+                return False
+            self.language = match.group(1)
+            self.start = offset + match.start()
+            self.code_start = offset + match.end()
+            buf, offset = buf[match.end() :], self.code_start
+        # the code is not empty, the closing fence is at least 1 char after the code starts
+        idx = buf.find(self.closing_fence, max(self.code_start + 1 - offset, 0))
+        if idx >= 0:
+            self.code_end = offset + idx
+            return True
+        self._tail = buf[-(len(self.closing_fence) - 1) :]
+        return False
+
+    @property
+    def end(self) -> int:
+        """End of the closing fence."""
+        return self.code_end + len(self.closing_fence)
+
+
 class MarkdownOutputParser(AgentOutputParser):
-    """Output parser that extracts markdown code blocks and try to parse them into actions."""
+    """Output parser that extracts markdown code blocks and try to parse them into actions.
+
+    When streaming, generation is stopped once the code block of an action is closed,
+    as everything after it is discarded anyway.
+    In `multi_action` mode, consecutive code blocks of the same action are taken as one action instead,
+    with the code joined as cells, and generation is not stopped early.
+    """
 
-    pattern = re.compile(r"([\S\s]*?)`{3}([\w]*)\n([\S\s]+?)\n`{3}([\S\s]*)", re.DOTALL)
     language_actions: dict[str, str] = {}
     """A mapping from language to action key."""
     just_finish: bool = True
     """Whether to just return AgentFinish if no parser can parse the output. Default to True."""
+    trusted: bool = False
+    """Whether the output is constrained to `guided_regex` by the LLM service.
+    If so, the action is taken as the trailing code block, without scanning the output."""
+    multi_action: bool = False
+    """Whether to take the consecutive code blocks of the first action as one action.
+    The action's input is then `{"code": ..., "cells": [...]}` if there's more than one block,
+    where code is the cells joined by `CELL_SEPARATOR`."""
+
+    opening_pattern = re.compile(r"`{3}([\w]*)\n")
+
+    def find_opening_action(self, text: str) -> Optional[str]:
+        """Find the action of the first code block opened in (maybe partial) text.
+        The code block does not need to be closed, so this can be used on streaming outputs.
+        """
+        for match in self.opening_pattern.finditer(text):
+            if (action := self.language_actions.get(match.group(1))) is not None:
+                return action
+        return None
+
+    def guided_regex(self) -> str:
+        """Regex of the outputs this parser expects, for LLM services supporting guided decoding.
+
+        That is, a thought without code fences, optionally followed by a single code block of an action.
+        Inline code is still allowed, but final answers can't have code blocks.
+        """
+        no_fence = r"([^`]|`[^`]|``[^`])"
+        languages = "|".join(re.escape(language) for language in self.language_actions)
+        block = rf"```({languages})\n{no_fence}+\n```"
+        if self.multi_action:
+            return rf"{no_fence}*({block}({no_fence}*{block})*)?"
+        return rf"{no_fence}*({block})?"
 
     def parse(self, text: str) -> AgentAction | AgentFinish:
-        if (match := re.search(self.pattern, text)) is not None:
-            thought = match.group(1).strip()
-            language = match.group(2)
-            tool_input = match.group(3).strip()
-            if (action := self.language_actions.get(language)) is not None:
-                return AgentActionMessageLog(
-                    tool=action,
-                    tool_input=tool_input,
-                    # log is the 'thought' part
-                    log=thought,
-                    # message_log is the content we can add to history
-                    # polishing the content will improve the following iterations
-                    message_log=[
-                        AIMessage(
-                            content=text.removesuffix(match.group(4)).strip(),
-                            additional_kwargs={
-                                "type": "action",
-                                "thought": thought,
-                                "action": {
-                                    "tool": action,
-                                    "tool_input": tool_input,
-                                },
-                            },
-                        )
-                    ],
+        if self.multi_action:
+            return self._parse_blocks(text)
+        if self.trusted:
+            return self._parse_trusted(text)
+        scanner = CodeBlockScanner()
+        if scanner.feed(text):
+            return self._parse_block(
+                text,
+                scanner.language,
+                scanner.start,
+                scanner.code_start,
+                scanner.code_end,
+                scanner.end,
+            )
+        return self._finish(text)
+
+    async def atransform(
+        self,
+        input: AsyncIterator[str | BaseMessage],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[AgentAction | AgentFinish]:
+        scanner = CodeBlockScanner()
+        async for chunk in self._atransform_stream_with_config(
+            self._until_action(input, scanner),
+            partial(self._aparse_stream, scanner=scanner),
+            config,
+            run_type="parser",
+        ):
+            yield chunk
+
+    async def _until_action(
+        self, input: AsyncIterator[str | BaseMessage], scanner: CodeBlockScanner
+    ) -> AsyncIterator[str | BaseMessage]:
+        """Pass the generation through, until the code block of an action is closed."""
+        try:
+            async for chunk in input:
+                yield chunk
+                if self.multi_action:
+                    continue
+                if (
+                    scanner.feed(_text(chunk))
+                    and scanner.language in self.language_actions
+                ):
+                    break
+        finally:
+            # Closing the upstream stops the generation.
+            if hasattr(input, "aclose"):
+                await input.aclose()
+
+    async def _aparse_stream(
+        self, input: AsyncIterator[str | BaseMessage], scanner: CodeBlockScanner
+    ) -> AsyncIterator[AgentAction | AgentFinish]:
+        # The scanner is fed by `_until_action`, which yields the chunk before feeding it.
+        # So the scanner only sees the whole text after the input is exhausted.
+        chunks = [_text(chunk) async for chunk in input]
+        text = "".join(chunks)
+        if self.trusted or self.multi_action:
+            yield self.parse(text)
+            return
+        if not scanner.closed:
+            yield self._finish(text)
+            return
+        yield self._parse_block(
+            text,
+            scanner.language,
+            scanner.start,
+            scanner.code_start,
+            scanner.code_end,
+            scanner.end,
+        )
+
+    def _parse_trusted(self, text: str) -> AgentAction | AgentFinish:
+        """Parse output constrained to `guided_regex`, where the only code block (if any) ends the output."""
+        if not text.endswith("```"):
+            return self._finish(text)
+        start = text.find("```")
+        code_start = text.find("\n", start) + 1
+        return self._parse_block(
+            text,
+            text[start + 3 : code_start - 1],
+            start,
+            code_start,
+            len(text) - 3,
+            len(text),
+        )
+
+    def _parse_block(
+        self,
+        text: str,
+        language: str,
+        start: int,
+        code_start: int,
+        code_end: int,
+        end: int,
+    ) -> AgentAction | AgentFinish:
+        """Parse the first code block of the text, at the given positions."""
+        if (action := self.language_actions.get(language)) is not None:
+            return self._action(
+                text, action, start, text[code_start:code_end].strip(), end
+            )
+        logger.warning(f"Unknown language {language}")
+        return self._finish(text)
+
+    def _parse_blocks(self, text: str) -> AgentAction | AgentFinish:
+        """Parse the consecutive code blocks of the first action into one action.
+        Blocks of the action are joined until a block of another language, anything in between is kept as is in the message.
+        """
+        blocks = _scan_blocks(text)
+        if not (first := next(blocks, None)):
+            return self._finish(text)
+        language, start, code_start, code_end, end = first
+        if (action := self.language_actions.get(language)) is None:
+            return self._parse_block(text, *first)
+        cells = [text[code_start:code_end].strip()]
+        for language, _, code_start, code_end, block_end in blocks:
+            if self.language_actions.get(language) != action:
+                break
+            cells.append(text[code_start:code_end].strip())
+            end = block_end
+        if len(cells) == 1:
+            return self._action(text, action, start, cells[0], end)
+        code = CELL_SEPARATOR.join(cells)
+        return self._action(
+            text, action, start, {"code": code, "cells": cells}, end, display=code
+        )
+
+    def _action(
+        self,
+        text: str,
+        action: str,
+        start: int,
+        tool_input: str | dict,
+        end: int,
+        display: Optional[str] = None,
+    ) -> AgentActionMessageLog:
+        """Build the action, `display` is the tool input shown in the history if it's not a string."""
+        thought = text[:start].strip()
+        return AgentActionMessageLog(
+            tool=action,
+            tool_input=tool_input,
+            # log is the 'thought' part
+            log=thought,
+            # message_log is the content we can add to history
+            # polishing the content will improve the following iterations
+            message_log=[
+                AIMessage(
+                    # everything after the code block is discarded
+                    content=text[:end].strip(),
+                    additional_kwargs={
+                        "type": "action",
+                        "thought": thought,
+                        "action": {
+                            "tool": action,
+                            "tool_input": tool_input if display is None else display,
+                        },
+                    },
                 )
-            logger.warning(f"Unknown language {language}")
+            ],
+        )
+
+    def _finish(self, text: str) -> AgentFinish:
         if self.just_finish:
             return AgentFinish({"output": text}, text)
         raise OutputParserException(f"Could not parse output: {text}")
@@ -111,6 +369,91 @@ class MarkdownOutputParser(AgentOutputParser):
         return "markdown"
 
 
+def _scan_blocks(text: str) -> Generator[tuple[str, int, int, int, int], None, None]:
+    """Find all closed code blocks of the text, in order.
+    Yields the language, start, code start, code end and end of each block, see `CodeBlockScanner`."""
+    offset = 0
+    while True:
+        scanner = CodeBlockScanner()
+        if not scanner.feed(text[offset:]):
+            return
+        yield (
+            scanner.language,
+            offset + scanner.start,
+            offset + scanner.code_start,
+            offset + scanner.code_end,
+            offset + scanner.end,
+        )
+        offset += scanner.end
+
+
+def _text(chunk: str | BaseMessage) -> str:
+    if isinstance(chunk, BaseMessage):
+        return chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+    return chunk
+
+
+class ToolCallingOutputParser(AgentOutputParser):
+    """Output parser that turns the tool calls of the model (by the OpenAI compatible tools API) into actions.
+
+    Only the first tool call is returned, as the agent executes one action at a time.
+    The action's message is rendered as a markdown code block, the same as `MarkdownOutputParser`'s,
+    so that the history and the client don't depend on the agent mode.
+    """
+
+    fallback: Optional[AgentOutputParser] = None
+    """Parser of the content if there's no tool call, as the model may still answer with code blocks."""
+    just_finish: bool = True
+    """Whether to just return AgentFinish if there's no tool call and no fallback. Default to True."""
+
+    def parse_result(
+        self, result: list[Generation], *, partial: bool = False
+    ) -> AgentAction | AgentFinish:
+        message = result[0].message if isinstance(result[0], ChatGeneration) else None
+        if not isinstance(message, AIMessage):
+            return self.parse(result[0].text)
+        if message.invalid_tool_calls:
+            call = message.invalid_tool_calls[0]
+            raise OutputParserException(
+                f"Could not parse tool input of {call['name']}: {call['args']}"
+            )
+        if not message.tool_calls:
+            return self.parse(_text(message))
+        call = message.tool_calls[0]
+        thought = _text(message).strip()
+        args = call["args"]
+        # single argument tools (like the code sandbox) are rendered with the argument as is.
+        code = next(iter(args.values())) if len(args) == 1 else json.dumps(args)
+        return ToolAgentAction(
+            tool=call["name"],
+            tool_input=args,
+            # log is the 'thought' part
+            log=thought,
+            message_log=[
+                AIMessage(
+                    content=f"{thought}\n```{call['name']}\n{code}\n```".strip(),
+                    additional_kwargs={
+                        "type": "action",
+                        "thought": thought,
+                        "action": {"tool": call["name"], "tool_input": code},
+                    },
+                )
+            ],
+            tool_call_id=call["id"] or "",
+        )
+
+    def parse(self, text: str) -> AgentAction | AgentFinish:
+        if self.fallback is not None:
+            return self.fallback.parse(text)
+        if self.just_finish:
+            return AgentFinish({"output": text}, text)
+        raise OutputParserException(f"Could not parse output: {text}")
+
+    @property
+    def _type(self) -> str:
+        return "tool_calling"
+
+
 class DictOutputParser(AgentOutputParser):
     """Output parser that extracts all dicts in the output and try to parse them into actions.
     Only the first valid action will be returned.
@@ -123,7 +466,7 @@ class DictOutputParser(AgentOutputParser):
     """Whether to just return AgentFinish if no parser can parse the output. Default to True."""
 
     def parse(self, text: str) -> AgentAction | AgentFinish:
-        for _dict, s, e in find_dicts(text):
+        for _dict, s, e in find_dicts(text, key=self.tool_name_key):
             if self.tool_name_key in _dict:
                 thought = text[:s].strip()
                 tool_name = _dict.get(self.tool_name_key)
@@ -0,0 +1,70 @@
+from typing import Any, Optional
+from uuid import UUID
+
+from fastapi import WebSocket
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from pybot.schemas import ChatMessage
+
+
+class ToolOutputStreamer(AsyncCallbackHandler):
+    """Forwards the text tools emit while running (for example kernel stdout/stderr) to the websocket.
+
+    The output is sent as 'stream/start', 'stream/text' and 'stream/end' messages, with the id of the tool run.
+    The id is the same as the 'observation' message sent once the tool finishes, which carries the full output.
+    """
+
+    def __init__(self, websocket: WebSocket, conversation: str):
+        self.websocket = websocket
+        self.conversation = conversation
+        self.parent_id: Optional[UUID] = None
+        """Parent id of the streamed messages, should be the same as the action's."""
+        self._tools: dict[UUID, str] = {}
+        """Name of the running tools, by run id."""
+        self._streaming: set[UUID] = set()
+
+    async def on_tool_start(
+        self,
+        serialized: dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        self._tools[run_id] = serialized.get("name", "")
+
+    async def on_text(self, text: str, *, run_id: UUID, **kwargs: Any) -> None:
+        # on_text is also used by some chains for verbose logging, only stream the tools' output.
+        if (tool := self._tools.get(run_id)) is None or not text:
+            return
+        if run_id not in self._streaming:
+            self._streaming.add(run_id)
+            await self._send(run_id, tool, "stream/start", text)
+        else:
+            await self._send(run_id, tool, "stream/text", text)
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        await self._end(run_id)
+
+    async def on_tool_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        await self._end(run_id)
+
+    async def _end(self, run_id: UUID) -> None:
+        tool = self._tools.pop(run_id, None)
+        if run_id in self._streaming:
+            self._streaming.discard(run_id)
+            await self._send(run_id, tool, "stream/end", "")
+
+    async def _send(self, run_id: UUID, tool: str, type: str, content: str) -> None:
+        msg = ChatMessage(
+            parent_id=self.parent_id,
+            id=run_id,
+            conversation=self.conversation,
+            from_="system",
+            content=content,
+            type=type,
+            additional_kwargs={"tool": tool},
+        )
+        await self.websocket.send_text(msg.model_dump_json())
@@ -0,0 +1,58 @@
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_openai import ChatOpenAI
+from loguru import logger
+
+from pybot.config import settings
+from pybot.memory import PybotMemory
+from pybot.memory.history import PybotMessageHistory
+
+instruction = """You are Rei, the ideal assistant dedicated to assisting users effectively.
+You keep a running summary of your conversation with the user, so that you can continue it once the earlier messages are forgotten."""
+
+tmpl = ChatPromptTemplate.from_messages(
+    [
+        ("system", instruction),
+        ("system", "Summary of the conversation so far:\n{summary}"),
+        MessagesPlaceholder(variable_name="messages"),
+        (
+            "system",
+            "Now update the summary with the messages above. Keep the user's goals, the facts and decisions, "
+            "and the files, variables and results that may be needed later. Respond with the summary only.",
+        ),
+    ]
+)
+
+llm = ChatOpenAI(
+    openai_api_base=str(settings.llm.url),
+    model=settings.llm.model,
+    openai_api_key=settings.llm.creds,
+    max_tokens=settings.summary_max_tokens,
+)
+
+rolling_smry_chain = tmpl | llm | StrOutputParser()
+
+
+async def aupdate_summary(memory: PybotMemory, batch: int = 50) -> None:
+    """Fold the messages that fell out of the memory's buffer into the rolling summary.
+
+    At most `batch` messages are summarized at a time, the rest are left for the next update.
+    Nothing happens (not even an LLM call) if no new messages fell out of the buffer.
+    """
+    history = memory.history
+    if not isinstance(history, PybotMessageHistory):
+        return
+    try:
+        start = await memory.awindow_start()
+        summary, until = await history.aget_summary()
+        if start <= until:
+            return
+        stop = min(start, until + batch)
+        messages = await history.arange(until, stop)
+        new_summary: str = await rolling_smry_chain.ainvoke(
+            {"summary": summary or "(empty)", "messages": messages}
+        )
+        if not await history.aset_summary(new_summary.strip(), stop, until):
+            logger.debug("summary updated by someone else, skipping")
+    except Exception as e:
+        logger.error(f"Failed to update summary, err: {str(e)}")
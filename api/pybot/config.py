@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, HttpUrl, RedisDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -9,11 +9,41 @@ class LLMServiceSettings(BaseModel):
     """llm service url"""
     creds: str = "EMPTY"
     model: str = "cognitivecomputations/dolphincoder-starcoder2-15b"
+    context_length: int = 16384
+    """Context length of the model, in tokens."""
+    max_tokens: int = 1024
+    """Maximum tokens to generate."""
+    guided_decoding: bool = False
+    """Whether the LLM service supports guided decoding (`guided_regex` in the request body, like vLLM does).
+    If so, the output of the agent is constrained to the action format, which is then parsed without checks."""
+    prompt_reserve_tokens: int = 4096
+    """Tokens reserved for the system prompt, the summary, the input and the intermediate steps.
+    The rest of the context (besides `max_tokens`) is the budget of the conversation history."""
 
 
 class JupyterSettings(BaseModel):
     gateway_url: HttpUrl = "http://localhost:8888"
     """URL of the Jupyter Enterprise Gateway."""
+    gateway_timeout: float = 10.0
+    """Timeout of requests to the gateway, in seconds."""
+    gateway_retries: int = 3
+    """Number of retries when failing to connect to the gateway."""
+    gateway_max_connections: int = 100
+    """Maximum number of connections to the gateway."""
+    gateway_max_keepalive_connections: int = 20
+    """Maximum number of idle connections to the gateway kept alive."""
+    channel_idle_timeout: float = 600
+    """Seconds before an idle kernel websocket channel is closed."""
+    kernel_pool_size: int = 0
+    """Number of pre-started kernels to keep warm. Set to 0 to disable the pool."""
+    kernel_pool_username: str = "pybot"
+    """'KERNEL_USERNAME' of the pre-started kernels."""
+    kernel_pool_refill_interval: float = 30
+    """Seconds between two checks of the kernel pool size."""
+    kernel_cache_ttl: float = 60
+    """Seconds a kernel is trusted to be alive without asking the gateway."""
+    kernel_reconcile_interval: float = 30
+    """Seconds between two reconciliations of cached kernels against the gateway."""
     kernel_namespace: Optional[str] = None
     """Namespace to start the kernel in. If not set, a new namespace will be created in form of `${KERNEL_USERNAME}-${UUID}.`"""
     shared_volume_mount_path: str = "/mnt/shared"
@@ -24,13 +54,63 @@ class JupyterSettings(BaseModel):
     """Path to the shared volume on the NFS server."""
 
 
+class RedisSettings(BaseModel):
+    max_connections: int = 50
+    """Maximum number of connections of the pool shared by the ORM models and the conversation index."""
+    history_connections: int = 10
+    """Maximum number of connections of the message history's pool, on top of `max_connections`.
+    The history stores binary values, so it can't share the pool of the ORM models, which decodes responses."""
+    pool_timeout: float = 10
+    """Seconds to wait for a free connection when the pool is exhausted."""
+    health_check_interval: int = 30
+    """Seconds a connection may be idle before it is checked with a PING on next use."""
+    socket_timeout: float = 5
+    """Timeout of socket reads and writes, in seconds."""
+    socket_connect_timeout: float = 5
+    """Timeout of connecting to Redis, in seconds."""
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_nested_delimiter="__")
 
     llm: LLMServiceSettings = LLMServiceSettings()
     jupyter: JupyterSettings = JupyterSettings()
     redis_om_url: RedisDsn = "redis://localhost:6379"
+    redis: RedisSettings = RedisSettings()
     user_id_header: str = "X-Forwarded-User"
+    conversations_page_size: int = 50
+    """Default number of conversations in a page."""
+    messages_page_size: int = 50
+    """Default number of messages in a page of conversation history."""
+    agent_mode: Literal["markdown", "tool_calling"] = "markdown"
+    """How the agent takes actions. 'markdown' parses code blocks from the generated text,
+    'tool_calling' uses the tools API of the LLM service, which must support tool calling."""
+    multi_action: bool = False
+    """Whether to execute all consecutive code blocks of a response as one action, instead of only the first one.
+    The blocks are executed one after another in a single round trip to the kernel, and their outputs are returned together."""
+    observation_budget: int = 4000
+    """Maximum characters of a tool output kept in the prompt and history, set to 0 for no limit.
+    Longer outputs are saved to the workspace, and only the head and the tail are kept."""
+    stream_flush_interval: float = 0.05
+    """Maximum seconds streamed LLM output is buffered before being sent to the client."""
+    stream_flush_size: int = 256
+    """Maximum bytes of streamed LLM output buffered before being sent to the client."""
+    history_flush_interval: float = 0.2
+    """Maximum seconds the messages of an agent turn are buffered before being written to the history."""
+    history_codec: Literal["json", "msgpack"] = "msgpack"
+    """Encoding of the messages stored in Redis. Messages in other encodings are still readable,
+    and are rewritten in this encoding on startup."""
+    history_compress_threshold: int = 1024
+    """Minimum bytes of a msgpack encoded message to compress it with zlib, set to 0 to disable compression."""
+    history_archive_path: Optional[str] = None
+    """Directory to offload idle message histories to, which are loaded back to Redis once accessed.
+    Histories are kept in Redis if not set."""
+    history_archive_after: float = 86400
+    """Seconds without new messages before a history is offloaded."""
+    history_archive_interval: float = 600
+    """Seconds between two checks of idle histories."""
+    summary_max_tokens: int = 512
+    """Maximum tokens of the rolling summary of messages out of the memory window."""
     log_level: str = "INFO"
 
 
@@ -1,10 +1,12 @@
-import asyncio
 from contextvars import ContextVar
 from typing import Optional
 from uuid import UUID
 
 from aredis_om import Field, JsonModel
 
+from pybot.db import redis_client
+from pybot.utils import run_sync
+
 session_id = ContextVar("session_id", default=None)  # principal:conv_id
 
 
@@ -17,14 +19,22 @@ class Session(JsonModel):
     kernel_id: Optional[UUID] = None
     """Last activate kernel id of the session.
     When it expires (culled by the gateway), I need to start a new kernel and update this field."""
+    workspace: Optional[str] = None
+    """Path of the workspace of the session, relative to the shared volume.
+    It is bound when the first kernel of the session is provisioned, and every following kernel of the session mounts it."""
+
+    def get_workspace(self) -> str:
+        """Bound workspace of the session, or the default `{user_id}/{conv_id}` if not bound yet."""
+        return self.workspace or f"{self.user_id}/{self.conv_id}"
 
     class Meta:
         global_key_prefix = "pybot"
+        database = redis_client
 
 
 class CurrentSession:
     def get(self) -> Session:
-        return asyncio.run(Session.get(session_id.get()))
+        return run_sync(Session.get(session_id.get()))
 
     async def aget(self) -> Session:
         return await Session.get(session_id.get())
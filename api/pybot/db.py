@@ -0,0 +1,45 @@
+import redis.asyncio as aioredis
+
+from pybot.config import settings
+
+
+def _make_pool(
+    decode_responses: bool, max_connections: int
+) -> aioredis.BlockingConnectionPool:
+    return aioredis.BlockingConnectionPool.from_url(
+        str(settings.redis_om_url),
+        max_connections=max_connections,
+        timeout=settings.redis.pool_timeout,
+        health_check_interval=settings.redis.health_check_interval,
+        socket_timeout=settings.redis.socket_timeout,
+        socket_connect_timeout=settings.redis.socket_connect_timeout,
+        decode_responses=decode_responses,
+    )
+
+
+# aredis_om expects decoded responses
+pool = _make_pool(decode_responses=True, max_connections=settings.redis.max_connections)
+"""Connection pool shared by the ORM models and the conversation index.
+Callers wait for a free connection (up to `pool_timeout` seconds) instead of opening more than `max_connections`."""
+
+redis_client = aioredis.Redis(connection_pool=pool)
+
+binary_pool = _make_pool(
+    decode_responses=False, max_connections=settings.redis.history_connections
+)
+"""Connection pool of the message history, which stores binary encoded messages.
+Decoding is a setting of the connections, so the history can't share the pool above."""
+
+binary_client = aioredis.Redis(connection_pool=binary_pool)
+
+
+def pool_stats(pool: aioredis.ConnectionPool = pool) -> dict[str, int]:
+    """Utilization of a connection pool."""
+    in_use = len(pool._in_use_connections)
+    idle = len(pool._available_connections)
+    return {
+        "max_connections": pool.max_connections,
+        "in_use_connections": in_use,
+        "idle_connections": idle,
+        "created_connections": in_use + idle,
+    }
@@ -0,0 +1,137 @@
+from typing import Optional
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from pybot.models import Conversation as ORMConversation
+from pybot.schemas import Conversation
+
+PINNED_OFFSET = 2**43
+"""Added to the score of pinned conversations, larger than any millisecond timestamp in the next few centuries.
+Scores stay below 2**53, so they are exact in a double."""
+
+
+class InvalidCursorException(ValueError): ...
+
+
+class ConversationIndex:
+    """Per-user conversations sorted by (pinned, last_message_at), kept in a Redis sorted set.
+
+    Listing a page reads only the page from the sorted set, and the page's documents with a single JSON.MGET,
+    instead of loading and sorting all conversations of the user.
+    """
+
+    def __init__(
+        self,
+        key_prefix: str = "pybot:conversations:",
+        indexed_prefix: str = "pybot:conversations-indexed:",
+    ):
+        self.key_prefix = key_prefix
+        self.indexed_prefix = indexed_prefix
+        # owners known to be indexed, the marker is never removed so this saves a round trip.
+        self._indexed: set[str] = set()
+
+    @property
+    def client(self) -> Redis:
+        return ORMConversation.db()
+
+    def key(self, owner: str) -> str:
+        return f"{self.key_prefix}{owner}"
+
+    def indexed_key(self, owner: str) -> str:
+        """Marker of the users whose conversations before the index existed are backfilled."""
+        return f"{self.indexed_prefix}{owner}"
+
+    @staticmethod
+    def score(conv: ORMConversation) -> int:
+        score = int(conv.last_message_at.timestamp() * 1000)
+        return score + PINNED_OFFSET if conv.pinned else score
+
+    async def aadd(self, conv: ORMConversation) -> None:
+        """Add the conversation, or update its position."""
+        # Backfill first, the sorted set existing doesn't mean the older conversations are in it.
+        await self.aensure_indexed(conv.owner)
+        await self.client.zadd(self.key(conv.owner), {conv.pk: self.score(conv)})
+
+    async def aremove(self, owner: str, conv_id: str) -> None:
+        await self.client.zrem(self.key(owner), conv_id)
+
+    async def alist(
+        self, owner: str, cursor: Optional[str] = None, limit: int = 20
+    ) -> tuple[list[Conversation], Optional[str]]:
+        """List a page of the user's conversations, pinned first and then most recent first.
+
+        The cursor is '{score}:{offset}', where offset is the number of conversations of that score already listed,
+        so that conversations sharing a score are neither skipped nor repeated.
+
+        Returns the conversations and the cursor of the next page, None if there's no more.
+        """
+        key = self.key(owner)
+        if cursor is None:
+            await self.aensure_indexed(owner)
+            max_score, offset = "+inf", 0
+        else:
+            max_score, offset = self.parse_cursor(cursor)
+        items = await self.client.zrevrangebyscore(
+            key, max_score, "-inf", start=offset, num=limit, withscores=True
+        )
+        if not items:
+            return [], None
+
+        keys = [ORMConversation.make_primary_key(self._decode(pk)) for pk, _ in items]
+        docs = await self.client.json().mget(keys, ".")
+        convs, missing = [], []
+        for (pk, _), doc in zip(items, docs):
+            if not doc:
+                # deleted without being removed from the index
+                missing.append(pk)
+                continue
+            convs.append(Conversation.model_validate(doc))
+        if missing:
+            logger.warning(f"removing missing conversations {missing} from index")
+            await self.client.zrem(key, *missing)
+
+        if len(items) < limit:
+            return convs, None
+        last_score = int(items[-1][1])
+        same_score = sum(1 for _, score in items if int(score) == last_score)
+        if last_score == max_score:
+            same_score += offset
+        return convs, f"{last_score}:{same_score}"
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> tuple[int, int]:
+        try:
+            _score, _offset = cursor.split(":")
+            score, offset = int(_score), int(_offset)
+        except ValueError as e:
+            raise InvalidCursorException(f"invalid cursor: {cursor}") from e
+        if offset < 0:
+            raise InvalidCursorException(f"invalid cursor: {cursor}")
+        return score, offset
+
+    async def aensure_indexed(self, owner: str) -> None:
+        """Backfill the index of the user once."""
+        if owner in self._indexed:
+            return
+        if not await self.client.exists(self.indexed_key(owner)):
+            # Backfilling is idempotent, concurrent backfills of the same user do no harm.
+            await self.abackfill(owner)
+            await self.client.set(self.indexed_key(owner), 1)
+        self._indexed.add(owner)
+
+    async def abackfill(self, owner: str) -> None:
+        """Build the index of a user from the conversation documents, for users created before the index existed."""
+        convs = await ORMConversation.find(ORMConversation.owner == owner).all()
+        if convs:
+            # nx, not to overwrite the newer positions added meanwhile.
+            await self.client.zadd(
+                self.key(owner), {conv.pk: self.score(conv) for conv in convs}, nx=True
+            )
+
+    @staticmethod
+    def _decode(pk: str | bytes) -> str:
+        return pk.decode() if isinstance(pk, bytes) else pk
+
+
+conversation_index = ConversationIndex()
@@ -1,3 +1,4 @@
+from pybot.config import settings
 from pybot.jupyter.client import GatewayClient
 from pybot.jupyter.kernel import ContextAwareKernelManager
 from pybot.jupyter.schema import (
@@ -14,4 +15,19 @@ __all__ = [
     "ExecutionResponse",
     "GatewayClient",
     "Kernel",
+    "gateway_client",
+    "kernel_manager",
 ]
+
+gateway_client = GatewayClient(
+    host=settings.jupyter.gateway_url,
+    timeout=settings.jupyter.gateway_timeout,
+    retries=settings.jupyter.gateway_retries,
+    max_connections=settings.jupyter.gateway_max_connections,
+    max_keepalive_connections=settings.jupyter.gateway_max_keepalive_connections,
+)
+"""Gateway client shared across the app, so that connections to the gateway are pooled."""
+
+kernel_manager = ContextAwareKernelManager(
+    gateway_host=settings.jupyter.gateway_url, gateway_client=gateway_client
+)
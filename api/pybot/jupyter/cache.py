@@ -0,0 +1,66 @@
+import time
+from typing import Iterable, Optional
+
+from pydantic import BaseModel
+
+from pybot.jupyter.schema import Kernel
+
+
+class CachedKernel(BaseModel):
+    kernel: Kernel
+    session_id: str
+    """Session that owns the kernel."""
+    expires_at: float
+    """Monotonic time after which the kernel's liveness must be checked again."""
+
+
+class KernelCache:
+    """In-process cache of live kernels, so that executions do not need to ask the gateway every time.
+
+    Entries are kept after they expire, until the kernel is known to be gone.
+    This lets the reconciler find out which sessions lost their kernels.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._kernels: dict[str, CachedKernel] = {}
+
+    def get(self, kernel_id: str) -> Optional[Kernel]:
+        """Get the kernel if it was known to be alive in the last `ttl` seconds."""
+        cached = self._kernels.get(kernel_id)
+        if cached is None or cached.expires_at < time.monotonic():
+            return None
+        return cached.kernel
+
+    def put(self, kernel: Kernel, session_id: str) -> None:
+        self._kernels[str(kernel.id)] = CachedKernel(
+            kernel=kernel,
+            session_id=session_id,
+            expires_at=time.monotonic() + self.ttl,
+        )
+
+    def invalidate(self, kernel_id: str) -> None:
+        self._kernels.pop(kernel_id, None)
+
+    def snapshot(self) -> set[str]:
+        """Ids of the cached kernels."""
+        return set(self._kernels)
+
+    def reconcile(
+        self, kernels: Iterable[Kernel], known: Optional[set[str]] = None
+    ) -> dict[str, str]:
+        """Refresh the cache with all kernels alive on the gateway.
+        Only kernels in `known` (all cached kernels if None) can be gone. Pass the `snapshot` taken before listing,
+        as kernels cached after that may not be in the list yet.
+        Returns ids of the gone kernels, by id of their sessions."""
+        alive = {str(kernel.id): kernel for kernel in kernels}
+        expires_at = time.monotonic() + self.ttl
+        gone = {}
+        for kernel_id, cached in list(self._kernels.items()):
+            if (kernel := alive.get(kernel_id)) is not None:
+                cached.kernel = kernel
+                cached.expires_at = expires_at
+            elif known is None or kernel_id in known:
+                gone[cached.session_id] = kernel_id
+                del self._kernels[kernel_id]
+        return gone
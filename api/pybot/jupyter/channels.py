@@ -0,0 +1,239 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+from urllib.parse import urljoin, urlparse, urlunparse
+
+from loguru import logger
+from websockets.client import WebSocketClientProtocol
+from websockets.client import connect as aconnect
+from websockets.exceptions import ConnectionClosed, InvalidStatusCode
+
+from pybot.jupyter.schema import (
+    ExecutionRequest,
+    KernelNotFoundException,
+    parent_msg_id,
+)
+
+
+def get_ws_url(gateway_host: str, kernel_id: str) -> str:
+    base = urlparse(str(gateway_host))
+    ws_scheme = "wss" if base.scheme == "https" else "ws"
+    ws_base = urlunparse(base._replace(scheme=ws_scheme))
+    return urljoin(ws_base, f"/api/kernels/{kernel_id}/channels")
+
+
+class ChannelClosedException(RuntimeError): ...
+
+
+class ExecutionMessages:
+    """Messages of a single execution, routed from the kernel channel."""
+
+    def __init__(self, msg_id: str):
+        self.msg_id = msg_id
+        self._queue: asyncio.Queue[str | Exception] = asyncio.Queue()
+
+    async def recv(self, timeout: Optional[float] = None) -> str:
+        message = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def put(self, message: str | Exception) -> None:
+        self._queue.put_nowait(message)
+
+
+class KernelChannel:
+    """A long-lived websocket connection to `/api/kernels/{kernel_id}/channels`.
+    The connection is shared by all executions on the kernel, and messages are routed to the execution
+    they belong to by `parent_header.msg_id`."""
+
+    def __init__(
+        self,
+        kernel_id: str,
+        ws_url: str,
+        on_lost: Optional[Callable[[str], None]] = None,
+    ):
+        self.kernel_id = kernel_id
+        self.ws_url = ws_url
+        self.on_lost = on_lost
+        """Called with the kernel id when the channel is closed by the other side, or the kernel is not found."""
+        self._closing = False
+        self.last_activity = time.monotonic()
+        self._conn: Optional[WebSocketClientProtocol] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._executions: dict[str, ExecutionMessages] = {}
+
+    @property
+    def closed(self) -> bool:
+        return self._reader is None or self._reader.done()
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._executions)
+
+    async def connect(self) -> None:
+        logger.debug(f"connecting to kernel {self.kernel_id} with url: {self.ws_url}")
+        try:
+            self._conn = await aconnect(self.ws_url)
+        except InvalidStatusCode as e:
+            if e.status_code == 404:
+                self._lost()
+                raise KernelNotFoundException(
+                    f"kernel {self.kernel_id} not found"
+                ) from e
+            raise
+        self._reader = asyncio.create_task(self._read())
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._conn is not None:
+            await self._conn.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def submit(self, request: ExecutionRequest) -> ExecutionMessages:
+        """Send an execution request, and return the messages of it."""
+        msg_id = request.header.msg_id
+        messages = ExecutionMessages(msg_id)
+        self._executions[msg_id] = messages
+        self.last_activity = time.monotonic()
+        try:
+            await self._conn.send(request.model_dump_json())
+        except Exception:
+            self.release(msg_id)
+            raise
+        return messages
+
+    def release(self, msg_id: str) -> None:
+        """Stop routing messages of the execution.
+        Messages received after release (for example a late 'execute_reply') are dropped."""
+        self._executions.pop(msg_id, None)
+        self.last_activity = time.monotonic()
+
+    async def _read(self) -> None:
+        try:
+            async for message in self._conn:
+                logger.trace(f"kernel {self.kernel_id} message: [{message}]")
+                # Only extract the parent msg_id here, decoding is left to the receiver of the message.
+                parent_id = parent_msg_id(message)
+                if (messages := self._executions.get(parent_id)) is None:
+                    logger.debug(
+                        f"Ignoring message of parent id {parent_id} on kernel {self.kernel_id}"
+                    )
+                    continue
+                messages.put(message)
+        except ConnectionClosed as e:
+            logger.info(f"channel of kernel {self.kernel_id} closed: {e}")
+        finally:
+            if not self._closing:
+                # Closed by the other side, the kernel may be culled or restarted.
+                self._lost()
+            err = ChannelClosedException(f"channel of kernel {self.kernel_id} closed")
+            for messages in self._executions.values():
+                messages.put(err)
+            self._executions.clear()
+
+    def _lost(self) -> None:
+        if self.on_lost is not None:
+            self.on_lost(self.kernel_id)
+
+
+class KernelChannelManager:
+    """Keeps one long-lived channel per kernel.
+    Channels are reconnected when broken, and closed after being idle for `idle_timeout` seconds."""
+
+    def __init__(
+        self,
+        gateway_host: str,
+        idle_timeout: float = 600,
+        on_lost: Optional[Callable[[str], None]] = None,
+    ):
+        self.gateway_host = gateway_host
+        self.idle_timeout = idle_timeout
+        self.on_lost = on_lost
+        """Called with the kernel id when a channel error says the kernel is gone."""
+        self._channels: dict[str, KernelChannel] = {}
+        self._locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def get(self, kernel_id: str) -> KernelChannel:
+        channel = self._channels.get(kernel_id)
+        if channel is not None and not channel.closed:
+            return channel
+        async with self._locks[kernel_id]:
+            channel = self._channels.get(kernel_id)
+            if channel is None or channel.closed:
+                if channel is not None:
+                    logger.info(f"reconnecting to kernel {kernel_id}")
+                channel = KernelChannel(
+                    kernel_id,
+                    get_ws_url(self.gateway_host, kernel_id),
+                    on_lost=self.on_lost,
+                )
+                await channel.connect()
+                self._channels[kernel_id] = channel
+        return channel
+
+    @asynccontextmanager
+    async def execute(
+        self, kernel_id: str, request: ExecutionRequest
+    ) -> AsyncIterator[ExecutionMessages]:
+        """Submit an execution request to the kernel and yield its messages."""
+        async with self.execute_many(kernel_id, [request]) as [messages]:
+            yield messages
+
+    @asynccontextmanager
+    async def execute_many(
+        self, kernel_id: str, requests: list[ExecutionRequest]
+    ) -> AsyncIterator[list[ExecutionMessages]]:
+        """Submit several execution requests to the kernel at once and yield their messages, in order.
+
+        The requests are pipelined over the channel, the kernel executes them one after another without
+        waiting for us to read the results in between. By default the kernel aborts the requests queued
+        after a failed one, see `stop_on_error` of <https://jupyter-client.readthedocs.io/en/latest/messaging.html#execute>.
+        """
+        channel = await self.get(kernel_id)
+        submitted: list[ExecutionMessages] = []
+        try:
+            for request in requests:
+                try:
+                    submitted.append(await channel.submit(request))
+                except ConnectionClosed:
+                    if submitted:
+                        # Earlier requests were sent over the broken connection, retrying this one alone breaks the order.
+                        raise
+                    # The connection may be broken since last use, reconnect and retry once.
+                    await channel.close()
+                    channel = await self.get(kernel_id)
+                    submitted.append(await channel.submit(request))
+            yield submitted
+        finally:
+            for messages in submitted:
+                channel.release(messages.msg_id)
+
+    async def close(self, kernel_id: str) -> None:
+        if (channel := self._channels.pop(kernel_id, None)) is not None:
+            await channel.close()
+        self._locks.pop(kernel_id, None)
+
+    async def evict_idle(self) -> None:
+        now = time.monotonic()
+        for kernel_id, channel in list(self._channels.items()):
+            if channel.closed or (
+                not channel.busy and now - channel.last_activity > self.idle_timeout
+            ):
+                logger.debug(f"evicting channel of kernel {kernel_id}")
+                await self.close(kernel_id)
+
+    async def run_eviction(self, interval: float = 60) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Failed to evict idle channels, err: {str(e)}")
+
+    async def aclose(self) -> None:
+        for kernel_id in list(self._channels):
+            await self.close(kernel_id)
@@ -1,20 +1,115 @@
+from typing import Optional
 from urllib.parse import urljoin
 
-import requests
+import httpx
 from loguru import logger
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, PrivateAttr, TypeAdapter
 
 from pybot.jupyter.schema import CreateKernelRequest, Kernel, KernelNotFoundException
 
+kernel_list_adapter = TypeAdapter(list[Kernel])
+
 
 class GatewayClient(BaseModel):
+    """Client of the Jupyter Enterprise Gateway REST API.
+
+    Requests are sent through long-lived httpx clients, so connections to the gateway are pooled and kept alive.
+    The `a`-prefixed methods are the async ones and should be used inside the event loop,
+    the others are a sync facade for non-async code paths.
+    """
+
     host: HttpUrl
+    timeout: float = 10.0
+    """Timeout of gateway requests, in seconds."""
+    retries: int = 3
+    """Number of retries when failing to connect to the gateway."""
+    max_connections: int = 100
+    """Maximum number of connections in the pool."""
+    max_keepalive_connections: int = 20
+    """Maximum number of idle connections kept alive in the pool."""
+
+    _client: Optional[httpx.Client] = PrivateAttr(default=None)
+    _aclient: Optional[httpx.AsyncClient] = PrivateAttr(default=None)
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(
+                transport=httpx.HTTPTransport(
+                    retries=self.retries, limits=self._limits()
+                ),
+                timeout=self.timeout,
+            )
+        return self._client
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(
+                    retries=self.retries, limits=self._limits()
+                ),
+                timeout=self.timeout,
+            )
+        return self._aclient
 
     def create_kernel(self, payload: CreateKernelRequest) -> Kernel:
         _body = payload.model_dump()
         logger.debug(f"Starting kernel with payload {_body}")
-        response = requests.post(urljoin(str(self.host), "/api/kernels"), json=_body)
-        if not response.ok:
+        response = self.client.post(self._url("/api/kernels"), json=_body)
+        return self._handle_create_kernel(response)
+
+    async def acreate_kernel(self, payload: CreateKernelRequest) -> Kernel:
+        _body = payload.model_dump()
+        logger.debug(f"Starting kernel with payload {_body}")
+        response = await self.aclient.post(self._url("/api/kernels"), json=_body)
+        return self._handle_create_kernel(response)
+
+    def get_kernel(self, kernel_id: str) -> Kernel:
+        response = self.client.get(self._url(f"/api/kernels/{kernel_id}"))
+        return self._handle_get_kernel(kernel_id, response)
+
+    async def aget_kernel(self, kernel_id: str) -> Kernel:
+        response = await self.aclient.get(self._url(f"/api/kernels/{kernel_id}"))
+        return self._handle_get_kernel(kernel_id, response)
+
+    def list_kernels(self) -> list[Kernel]:
+        response = self.client.get(self._url("/api/kernels"))
+        return self._handle_list_kernels(response)
+
+    async def alist_kernels(self) -> list[Kernel]:
+        response = await self.aclient.get(self._url("/api/kernels"))
+        return self._handle_list_kernels(response)
+
+    def delete_kernel(self, kernel_id: str) -> None:
+        response = self.client.delete(self._url(f"/api/kernels/{kernel_id}"))
+        self._handle_delete_kernel(kernel_id, response)
+
+    async def adelete_kernel(self, kernel_id: str) -> None:
+        response = await self.aclient.delete(self._url(f"/api/kernels/{kernel_id}"))
+        self._handle_delete_kernel(kernel_id, response)
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    def _url(self, path: str) -> str:
+        return urljoin(str(self.host), path)
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+        )
+
+    def _handle_create_kernel(self, response: httpx.Response) -> Kernel:
+        if not response.is_success:
             raise RuntimeError(
                 f"Error starting kernel: {response.status_code}\n{response.content}"
             )
@@ -22,9 +117,8 @@ class GatewayClient(BaseModel):
         logger.info(f"Started kernel with id {res.id}")
         return res
 
-    def get_kernel(self, kernel_id: str) -> Kernel:
-        response = requests.get(urljoin(str(self.host), f"/api/kernels/{kernel_id}"))
-        if response.ok:
+    def _handle_get_kernel(self, kernel_id: str, response: httpx.Response) -> Kernel:
+        if response.is_success:
             return Kernel.model_validate_json(response.text)
         elif response.status_code == 404:
             raise KernelNotFoundException(f"kernel {kernel_id} not found")
@@ -33,9 +127,15 @@ class GatewayClient(BaseModel):
                 f"Error getting kernel {kernel_id}: {response.status_code}\n{response.content}"
             )
 
-    def delete_kernel(self, kernel_id: str) -> None:
-        response = requests.delete(urljoin(str(self.host), f"/api/kernels/{kernel_id}"))
-        if not response.ok:
+    def _handle_list_kernels(self, response: httpx.Response) -> list[Kernel]:
+        if not response.is_success:
+            raise RuntimeError(
+                f"Error listing kernels: {response.status_code}\n{response.content}"
+            )
+        return kernel_list_adapter.validate_json(response.text)
+
+    def _handle_delete_kernel(self, kernel_id: str, response: httpx.Response) -> None:
+        if not response.is_success:
             if response.status_code == 404:
                 raise KernelNotFoundException(f"kernel {kernel_id} not found")
             else:
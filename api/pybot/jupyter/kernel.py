@@ -1,24 +1,66 @@
 import asyncio
+from collections import Counter
 from contextlib import asynccontextmanager, contextmanager
+from functools import partial
 from pathlib import Path
-from typing import Any
-from urllib.parse import urljoin, urlparse, urlunparse
+from typing import Any, AsyncIterator, Optional
 
 from loguru import logger
-from websockets.client import connect as aconnect
 from websockets.sync.client import connect
 
 from pybot.config import settings
-from pybot.context import CurrentSession
-from pybot.jupyter import GatewayClient
-from pybot.jupyter.schema import CreateKernelRequest, Kernel, KernelNotFoundException
+from pybot.context import CurrentSession, Session
+from pybot.jupyter.cache import KernelCache
+from pybot.jupyter.channels import ExecutionMessages, KernelChannelManager, get_ws_url
+from pybot.jupyter.client import GatewayClient
+from pybot.jupyter.pool import KernelPool
+from pybot.jupyter.schema import (
+    CreateKernelRequest,
+    ExecutionRequest,
+    Kernel,
+    KernelNotFoundException,
+)
+from pybot.utils import run_sync
+
+# Unset the kernel id of the session, only if it is still the gone kernel.
+# The session may have started a new kernel meanwhile, or been deleted.
+# KEYS: session key
+# ARGV: id of the gone kernel
+UNSET_KERNEL_SCRIPT = """
+local raw = redis.call('JSON.GET', KEYS[1], '$.kernel_id')
+if raw and cjson.decode(raw)[1] == ARGV[1] then
+    return redis.call('JSON.SET', KEYS[1], '$.kernel_id', 'null')
+end
+return false
+"""
 
 
 class ContextAwareKernelManager:
-    def __init__(self, gateway_host):
+    def __init__(self, gateway_host, gateway_client: Optional[GatewayClient] = None):
         self.gateway_host = gateway_host
-        self.gateway_client = GatewayClient(host=gateway_host)
+        self.gateway_client = gateway_client or GatewayClient(host=gateway_host)
         self.current_session = CurrentSession()
+        self.cache = KernelCache(ttl=settings.jupyter.kernel_cache_ttl)
+        self.channels = KernelChannelManager(
+            gateway_host,
+            idle_timeout=settings.jupyter.channel_idle_timeout,
+            on_lost=self.cache.invalidate,
+        )
+        self.pool: Optional[KernelPool] = None
+        if settings.jupyter.kernel_pool_size > 0:
+            self.pool = KernelPool(
+                self.gateway_client,
+                env_factory=partial(
+                    self._get_kernel_env, settings.jupyter.kernel_pool_username
+                ),
+                size=settings.jupyter.kernel_pool_size,
+                refill_interval=settings.jupyter.kernel_pool_refill_interval,
+            )
+        self._starting: dict[str, asyncio.Task[Kernel]] = {}
+        self._bind_locks: dict[str, asyncio.Lock] = {}
+        """Locks of binding workspaces, by session id."""
+        self._binding: Counter[str] = Counter()
+        """Number of requests binding (or waiting to bind) the workspace, by session id."""
 
     def start_kernel(self) -> Kernel:
         session = self.current_session.get()
@@ -26,25 +68,197 @@ class ContextAwareKernelManager:
             return self.gateway_client.get_kernel(session.kernel_id)
         except KernelNotFoundException:
             logger.debug(f"kernel {session.kernel_id} not found, creating a new one.")
-            env = self._get_kernel_env(session.user_id, session.conv_id)
+            session.workspace = session.get_workspace()
+            env = self._get_kernel_env(session.user_id, session.workspace)
             request = CreateKernelRequest(env=env)
             res = self.gateway_client.create_kernel(request)
             session.kernel_id = str(res.id)
-            asyncio.run(session.save())
+            run_sync(session.save())
             return res
 
     async def astart_kernel(self) -> Kernel:
         session = await self.current_session.aget()
+        return await self.aensure_kernel(session)
+
+    async def aensure_kernel(self, session: Session) -> Kernel:
+        """Make sure the session has a live kernel, claiming or starting one if not.
+        Concurrent calls of the same session share a single kernel start."""
+        session = await self.abind_workspace(session)
+        # shield the start from cancellation of any single caller
+        return await asyncio.shield(self._start(session))
+
+    async def aprovision(self, session: Session) -> Session:
+        """Speculatively provision a kernel for the session, without waiting for the kernel to start.
+        The session's workspace is bound before returning, returns the up-to-date session."""
+        session = await self.abind_workspace(session)
+        self._start(session)
+        return session
+
+    async def aprovision_quietly(self, session: Session) -> Session:
+        """Best-effort `aprovision`, failures are logged and the kernel is started lazily when code is executed.
+        The session's workspace is bound anyway, returns the up-to-date session."""
         try:
-            return self.gateway_client.get_kernel(session.kernel_id)
+            return await self.aprovision(session)
+        except Exception as e:
+            logger.error(f"Failed to provision kernel, err: {str(e)}")
+        # Bind the default workspace, so that a kernel claimed later doesn't mount another one.
+        try:
+            session = await Session.get(session.pk)
+            if session.workspace is None:
+                session.workspace = session.get_workspace()
+                await session.save()
+        except Exception as e:
+            logger.error(f"Failed to bind workspace, err: {str(e)}")
+        return session
+
+    async def abind_workspace(self, session: Session) -> Session:
+        """Bind the workspace of the session if not bound yet, claiming a pre-started kernel if possible.
+        Returns the up-to-date session."""
+        if session.workspace is not None:
+            return session
+        sid = session.pk
+        lock = self._bind_locks.setdefault(sid, asyncio.Lock())
+        self._binding[sid] += 1
+        try:
+            async with lock:
+                # reload, the workspace may have been bound by another request
+                session = await Session.get(sid)
+                if (
+                    session.workspace is None
+                    and await self.aclaim_kernel(session) is None
+                ):
+                    session.workspace = session.get_workspace()
+                    await session.save()
+        finally:
+            self._binding[sid] -= 1
+            if not self._binding[sid]:
+                del self._binding[sid]
+                del self._bind_locks[sid]
+        return session
+
+    async def aclaim_kernel(self, session: Session) -> Optional[Kernel]:
+        """Claim a pre-started kernel from the pool, and bind the session's workspace to the kernel's.
+        Only sessions that never had a kernel nor a workspace can claim, as the kernel's workspace is fixed.
+        Returns None if the session cannot claim or the pool is empty."""
+        if (
+            self.pool is None
+            or session.kernel_id is not None
+            or session.workspace is not None
+        ):
+            return None
+        if (pooled := await self.pool.aclaim()) is None:
+            return None
+        session.kernel_id = str(pooled.kernel.id)
+        session.workspace = pooled.workspace
+        await session.save()
+        self.cache.put(pooled.kernel, session.pk)
+        return pooled.kernel
+
+    async def adelete_kernel(self, kernel_id: str) -> None:
+        """Close the kernel's channel and delete the kernel."""
+        await self.channels.close(kernel_id)
+        self.cache.invalidate(kernel_id)
+        await self.gateway_client.adelete_kernel(kernel_id)
+
+    async def adelete_session_kernels(self, session: Session) -> None:
+        """Delete the kernel of the session, and the kernel being started for the session if any."""
+        kernel_ids = set()
+        if session.kernel_id is not None:
+            kernel_ids.add(str(session.kernel_id))
+        if (task := self._starting.get(session.pk)) is not None:
+            # Wait for the start instead of cancelling it, the gateway may create the kernel anyway.
+            try:
+                kernel = await asyncio.shield(task)
+                kernel_ids.add(str(kernel.id))
+            except Exception:
+                # already logged when the start failed
+                pass
+        for kernel_id in kernel_ids:
+            try:
+                await self.adelete_kernel(kernel_id)
+                logger.info(f"kernel {kernel_id} deleted")
+            except KernelNotFoundException:
+                logger.info(
+                    f"kernel {kernel_id} does not exists when deleting, maybe already culled by EG"
+                )
+
+    async def areconcile(self) -> list[str]:
+        """Reconcile cached kernels against the gateway with a single list request,
+        and unset `kernel_id` of the sessions whose kernel is gone (for example culled by EG).
+        Returns ids of the affected sessions."""
+        # Kernels started while listing may be missing from the list, leave them alone.
+        known = self.cache.snapshot()
+        kernels = await self.gateway_client.alist_kernels()
+        gone = self.cache.reconcile(kernels, known)
+        if gone:
+            logger.info(f"kernels of sessions {list(gone)} are gone")
+            client = Session.db()
+            unset_kernel = client.register_script(UNSET_KERNEL_SCRIPT)
+            async with client.pipeline(transaction=False) as pipe:
+                for sid, kernel_id in gone.items():
+                    await unset_kernel(
+                        keys=[Session.make_primary_key(sid)],
+                        args=[kernel_id],
+                        client=pipe,
+                    )
+                await pipe.execute()
+        return list(gone)
+
+    async def run_reconciliation(self, interval: float = 30) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.areconcile()
+            except Exception as e:
+                logger.error(f"Failed to reconcile kernels, err: {str(e)}")
+
+    def _start(self, session: Session) -> asyncio.Task[Kernel]:
+        if (task := self._starting.get(session.pk)) is None:
+            task = asyncio.create_task(self._aensure_kernel(session))
+            self._starting[session.pk] = task
+            task.add_done_callback(partial(self._on_started, session.pk))
+        return task
+
+    def _on_started(self, sid: str, task: asyncio.Task[Kernel]) -> None:
+        self._starting.pop(sid, None)
+        if not task.cancelled() and (e := task.exception()) is not None:
+            logger.error(f"Failed to start kernel for session {sid}, err: {str(e)}")
+
+    async def _aensure_kernel(self, session: Session) -> Kernel:
+        if (kernel := await self._alive_kernel(session)) is not None:
+            return kernel
+        # The session may be loaded before a kernel was started for it, for example by a speculative provisioning
+        # that finished after the session was loaded. Reload it not to start a second kernel.
+        latest = await Session.get(session.pk)
+        if latest.kernel_id != session.kernel_id and (
+            kernel := await self._alive_kernel(latest)
+        ):
+            return kernel
+        session = latest
+        logger.debug(f"session {session.pk} has no live kernel, creating a new one.")
+        env = self._get_kernel_env(session.user_id, session.get_workspace())
+        request = CreateKernelRequest(env=env)
+        res = await self.gateway_client.acreate_kernel(request)
+        session.kernel_id = str(res.id)
+        await session.save()
+        self.cache.put(res, session.pk)
+        return res
+
+    async def _alive_kernel(self, session: Session) -> Optional[Kernel]:
+        """The session's kernel if it is alive."""
+        if session.kernel_id is None:
+            return None
+        kernel_id = str(session.kernel_id)
+        if (kernel := self.cache.get(kernel_id)) is not None:
+            return kernel
+        try:
+            kernel = await self.gateway_client.aget_kernel(kernel_id)
+            self.cache.put(kernel, session.pk)
+            return kernel
         except KernelNotFoundException:
-            logger.debug(f"kernel {session.kernel_id} not found, creating a new one.")
-            env = self._get_kernel_env(session.user_id, session.conv_id)
-            request = CreateKernelRequest(env=env)
-            res = self.gateway_client.create_kernel(request)
-            session.kernel_id = str(res.id)
-            await session.save()
-            return res
+            logger.debug(f"kernel {kernel_id} not found.")
+            self.cache.invalidate(kernel_id)
+            return None
 
     @contextmanager
     def upgrade(self, kernel_id: str):
@@ -57,35 +271,32 @@ class ContextAwareKernelManager:
             conn.close()
 
     @asynccontextmanager
-    async def aupgrade(self, kernel_id: str):
-        ws_url = self._get_ws_url(kernel_id)
-        logger.debug(f"connecting to kernel {kernel_id} with url: {ws_url}")
-        try:
-            conn = await aconnect(ws_url)
-            yield conn
-        finally:
-            await conn.close()
+    async def aexecute(
+        self, kernel_id: str, request: ExecutionRequest
+    ) -> AsyncIterator[ExecutionMessages]:
+        """Execute the request on the kernel's long-lived channel, and yield messages of the execution."""
+        async with self.channels.execute(kernel_id, request) as messages:
+            yield messages
+
+    @asynccontextmanager
+    async def aexecute_many(
+        self, kernel_id: str, requests: list[ExecutionRequest]
+    ) -> AsyncIterator[list[ExecutionMessages]]:
+        """Execute the requests on the kernel's long-lived channel in one go, and yield messages of each execution."""
+        async with self.channels.execute_many(kernel_id, requests) as messages:
+            yield messages
 
     def _get_ws_url(self, kernel_id: str) -> str:
-        base = urlparse(str(self.gateway_host))
-        ws_scheme = "wss" if base.scheme == "https" else "ws"
-        ws_base = urlunparse(base._replace(scheme=ws_scheme))
-        return urljoin(ws_base, f"/api/kernels/{kernel_id}/channels")
+        return get_ws_url(self.gateway_host, kernel_id)
 
-    def _get_kernel_env(self, userid: str, conv_id: str) -> dict[str, Any]:
+    def _get_kernel_env(self, userid: str, workspace: str) -> dict[str, Any]:
         # volume was mounted to `settings.shared_volume` in app
-        shared_path = (
-            Path(settings.jupyter.shared_volume_mount_path)
-            .joinpath(userid)
-            .joinpath(conv_id)
+        shared_path = Path(settings.jupyter.shared_volume_mount_path).joinpath(
+            workspace
         )
         logger.debug(f"creating shared path: {shared_path}")
         shared_path.mkdir(exist_ok=True, parents=True)
-        nfs_path = (
-            Path(settings.jupyter.shared_volume_nfs_path)
-            .joinpath(userid)
-            .joinpath(conv_id)
-        )
+        nfs_path = Path(settings.jupyter.shared_volume_nfs_path).joinpath(workspace)
         env = {
             "KERNEL_USERNAME": userid,
             "KERNEL_VOLUME_MOUNTS": [
@@ -0,0 +1,125 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pybot.jupyter.client import GatewayClient
+from pybot.jupyter.schema import CreateKernelRequest, Kernel, KernelNotFoundException
+
+
+class PooledKernel(BaseModel):
+    kernel: Kernel
+    workspace: str
+    """Path of the workspace mounted to the kernel, relative to the shared volume."""
+
+
+class KernelPool:
+    """A pool of pre-started kernels, kept warm in the background.
+
+    Kernel volumes cannot be changed once the kernel is started, so every pooled kernel is started with a
+    fresh workspace of its own. Whoever claims the kernel adopts that workspace instead of the other way around.
+    """
+
+    def __init__(
+        self,
+        gateway_client: GatewayClient,
+        env_factory: Callable[[str], dict[str, Any]],
+        size: int = 2,
+        refill_interval: float = 30,
+        workspace_prefix: str = "_pool",
+    ):
+        self.gateway_client = gateway_client
+        self.env_factory = env_factory
+        """Builds the kernel env from the workspace path."""
+        self.size = size
+        self.refill_interval = refill_interval
+        self.workspace_prefix = workspace_prefix
+        self._kernels: deque[PooledKernel] = deque()
+        self._starting = 0
+        self._refill = asyncio.Event()
+
+    async def aclaim(self) -> Optional[PooledKernel]:
+        """Take a live kernel out of the pool, returns None if the pool is empty."""
+        self._refill.set()
+        while self._kernels:
+            pooled = self._kernels.popleft()
+            try:
+                await self.gateway_client.aget_kernel(str(pooled.kernel.id))
+            except KernelNotFoundException:
+                logger.info(f"pooled kernel {pooled.kernel.id} was culled, discarding")
+                continue
+            logger.debug(f"claimed pooled kernel {pooled.kernel.id}")
+            return pooled
+        return None
+
+    async def arefresh(self) -> None:
+        """Drop the pooled kernels culled by the gateway, with a single list request.
+        Otherwise they count towards `size`, and the pool is never refilled."""
+        if not self._kernels:
+            return
+        # Only kernels pooled before listing can be missing from the list.
+        known = {str(pooled.kernel.id) for pooled in self._kernels}
+        alive = {str(kernel.id) for kernel in await self.gateway_client.alist_kernels()}
+        culled = known - alive
+        if culled:
+            logger.info(f"pooled kernels {culled} were culled, discarding")
+            self._kernels = deque(
+                pooled
+                for pooled in self._kernels
+                if str(pooled.kernel.id) not in culled
+            )
+
+    async def afill(self) -> None:
+        missing = self.size - len(self._kernels) - self._starting
+        if missing <= 0:
+            return
+        self._starting += missing
+        try:
+            results = await asyncio.gather(
+                *[self._astart_kernel() for _ in range(missing)],
+                return_exceptions=True,
+            )
+        finally:
+            self._starting -= missing
+        for res in results:
+            if isinstance(res, BaseException):
+                logger.error(f"Failed to start pooled kernel, err: {str(res)}")
+            else:
+                self._kernels.append(res)
+
+    async def run(self) -> None:
+        """Keep the pool filled with live kernels, until cancelled."""
+        while True:
+            self._refill.clear()
+            try:
+                await self.arefresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh kernel pool, err: {str(e)}")
+            try:
+                await self.afill()
+            except Exception as e:
+                logger.error(f"Failed to fill kernel pool, err: {str(e)}")
+            try:
+                await asyncio.wait_for(
+                    self._refill.wait(), timeout=self.refill_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def adrain(self) -> None:
+        """Delete all pooled kernels."""
+        while self._kernels:
+            pooled = self._kernels.popleft()
+            try:
+                await self.gateway_client.adelete_kernel(str(pooled.kernel.id))
+            except KernelNotFoundException:
+                pass
+
+    async def _astart_kernel(self) -> PooledKernel:
+        workspace = f"{self.workspace_prefix}/{uuid4().hex}"
+        request = CreateKernelRequest(env=self.env_factory(workspace))
+        kernel = await self.gateway_client.acreate_kernel(request)
+        return PooledKernel(kernel=kernel, workspace=workspace)
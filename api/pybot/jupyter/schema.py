@@ -1,6 +1,7 @@
 import json
+import re
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 from uuid import UUID, uuid4
 
 from pydantic import BaseModel, Field, field_validator
@@ -97,10 +98,11 @@ class ExecutionStatusContent(BaseModel):
 
 class ExecutionReplyContent(BaseModel):
     status: str
-    """I see 'ok' and 'error', don't know if there's more."""
-    execution_count: int
-    user_expressions: dict
-    payload: list
+    """I see 'ok' and 'error', and 'aborted' for requests queued after a failed one."""
+    # Following are not available when status == 'aborted'.
+    execution_count: Optional[int] = None
+    user_expressions: dict = {}
+    payload: list = []
     # Following are only available when status == 'error', and seems duplicated. Maybe I should just ignore extra fields.
     traceback: Optional[list[str]] = None
     ename: Optional[str] = None
@@ -135,6 +137,13 @@ class ExecutionResultContent(BaseModel):
     execution_count: int
 
 
+class DisplayDataContent(BaseModel):
+    data: dict[str, Any]
+    """Keyed by MIME type, binary data such as 'image/png' is base64 encoded."""
+    metadata: dict
+    transient: Optional[dict] = None
+
+
 class ExecutionResponse(BaseModel):
     header: ExecutionHeader
     msg_id: str
@@ -155,3 +164,82 @@ class ExecutionResponse(BaseModel):
     buffers: list
     channel: str
     """I see there's 'iopub' and 'shell', don't know if there's more."""
+
+
+class StatusResponse(ExecutionResponse):
+    msg_type: Literal["status"]
+    content: ExecutionStatusContent
+
+
+class ExecutionReplyResponse(ExecutionResponse):
+    msg_type: Literal["execute_reply"]
+    content: ExecutionReplyContent
+
+
+class ExecutionInputResponse(ExecutionResponse):
+    msg_type: Literal["execute_input"]
+    content: ExecutionInputContent
+
+
+class StreamResponse(ExecutionResponse):
+    msg_type: Literal["stream"]
+    content: StreamContent
+
+
+class ErrorResponse(ExecutionResponse):
+    msg_type: Literal["error"]
+    content: ErrorContent
+
+
+class ExecutionResultResponse(ExecutionResponse):
+    msg_type: Literal["execute_result"]
+    content: ExecutionResultContent
+
+
+class DisplayDataResponse(ExecutionResponse):
+    msg_type: Literal["display_data"]
+    content: DisplayDataContent
+
+
+class UnknownResponse(ExecutionResponse):
+    """Messages we don't handle (yet), for example 'update_display_data'."""
+
+    content: dict
+
+
+_RESPONSE_MODELS: dict[str, type[ExecutionResponse]] = {
+    "status": StatusResponse,
+    "execute_reply": ExecutionReplyResponse,
+    "execute_input": ExecutionInputResponse,
+    "stream": StreamResponse,
+    "error": ErrorResponse,
+    "execute_result": ExecutionResultResponse,
+    "display_data": DisplayDataResponse,
+}
+
+# Quotes inside JSON strings are always escaped, so these patterns can only match the real keys.
+# Note that '"header"' does not match '"parent_header"'.
+_MSG_TYPE = re.compile(r'"header"\s*:\s*\{[^{}]*?"msg_type"\s*:\s*"([^"]*)"')
+
+
+def decode_message(message: str | bytes) -> ExecutionResponse:
+    """Decode a kernel message, with content validated against the model of its `msg_type` only.
+    Unlike `ExecutionResponse.model_validate_json`, the content is not tried against every content model in turn."""
+    if isinstance(message, bytes):
+        message = message.decode()
+    msg_type = match.group(1) if (match := _MSG_TYPE.search(message)) else None
+    return _RESPONSE_MODELS.get(msg_type, UnknownResponse).model_validate_json(message)
+
+
+_PARENT_MSG_ID = re.compile(r'"parent_header"\s*:\s*\{[^{}]*?"msg_id"\s*:\s*"([^"]*)"')
+
+
+def parent_msg_id(message: str) -> Optional[str]:
+    """Extract `parent_header.msg_id` of a kernel message without decoding it.
+    Returns None if the message has no parent msg_id."""
+    if (match := _PARENT_MSG_ID.search(message)) is not None:
+        return match.group(1)
+    try:
+        return json.loads(message)["parent_header"].get("msg_id")
+    except (ValueError, KeyError, AttributeError):
+        return None
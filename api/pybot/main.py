@@ -1,5 +1,6 @@
 """Main entrypoint for the app."""
 
+import asyncio
 from contextlib import asynccontextmanager
 from typing import Annotated
 
@@ -12,7 +13,11 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from loguru import logger
 
+from pybot.config import settings
+from pybot.db import binary_pool, pool, pool_stats
 from pybot.dependencies import EmailHeader, UserIdHeader, UsernameHeader
+from pybot.jupyter import gateway_client, kernel_manager
+from pybot.memory import history
 from pybot.routers.chat import router as chat_router
 from pybot.routers.conversations import router as conversation_router
 from pybot.routers.files import router as files_router
@@ -23,7 +28,35 @@ from pybot.schemas import UserProfile
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await Migrator().run()
+    tasks = [
+        asyncio.create_task(kernel_manager.channels.run_eviction()),
+        asyncio.create_task(
+            kernel_manager.run_reconciliation(
+                settings.jupyter.kernel_reconcile_interval
+            )
+        ),
+    ]
+    if kernel_manager.pool is not None:
+        tasks.append(asyncio.create_task(kernel_manager.pool.run()))
+    tasks.append(asyncio.create_task(history.amigrate_all()))
+    tasks.append(
+        asyncio.create_task(
+            history.run_offloading(
+                settings.history_archive_interval, settings.history_archive_after
+            )
+        )
+    )
+    # loading the encoding may download it, don't do it on the first request.
+    await asyncio.to_thread(lambda: history.token_counter.encoding)
     yield
+    for task in tasks:
+        task.cancel()
+    if kernel_manager.pool is not None:
+        await kernel_manager.pool.adrain()
+    await kernel_manager.channels.aclose()
+    await gateway_client.aclose()
+    await pool.disconnect()
+    await binary_pool.disconnect()
 
 
 app = FastAPI(
@@ -44,6 +77,12 @@ def healthz():
     return "OK"
 
 
+@app.get("/api/metrics/redis")
+def redis_metrics() -> dict[str, dict[str, int]]:
+    """Utilization of the Redis connection pools."""
+    return {"default": pool_stats(pool), "binary": pool_stats(binary_pool)}
+
+
 @app.get("/api/userinfo")
 def userinfo(
     userid: Annotated[str | None, UserIdHeader()] = None,
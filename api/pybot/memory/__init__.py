@@ -1,13 +1,22 @@
+import asyncio
 from typing import Any, Optional
 
 from langchain.memory.chat_message_histories.in_memory import ChatMessageHistory
 from langchain.memory.utils import get_prompt_input_key
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.memory import BaseMemory
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+)
 from pydantic.v1 import Field, validator
 
 from pybot.config import settings
+from pybot.db import binary_client
+from pybot.memory.archive import HistoryArchive
+from pybot.memory.codec import JsonCodec, MsgpackCodec
 from pybot.memory.history import PybotMessageHistory
 
 
@@ -19,6 +28,12 @@ class PybotMemory(BaseMemory):
     memory_key: str = "history"  #: :meta private:
     k: int = 5
     """Number of messages to store in buffer."""
+    max_token_limit: Optional[int] = None
+    """Maximum tokens of the messages in buffer. If set, it takes precedence over `k`.
+    Only applies to the async interface of `PybotMessageHistory`, which stores token counts."""
+    summary_key: Optional[str] = None
+    """Variable name of the rolling summary of the messages before the buffer, as a list of messages.
+    Only applies to `PybotMessageHistory`, disabled if not set."""
 
     @validator("k")
     def k_must_be_positive(cls, v: int) -> int:
@@ -38,6 +53,23 @@ class PybotMemory(BaseMemory):
             return self.history.windowed_messages(self.k)
         return self.history.messages[-self.k * 2 :] if self.k > 0 else []
 
+    async def abuffer(self) -> str | list[BaseMessage]:
+        """Async version of `buffer`."""
+        return (
+            await self.abuffer_as_messages()
+            if self.return_messages
+            else self.buffer_as_str
+        )
+
+    async def abuffer_as_messages(self) -> list[BaseMessage]:
+        """Async version of `buffer_as_messages`."""
+        if isinstance(self.history, PybotMessageHistory):
+            if self.max_token_limit is not None:
+                return await self.history.abudgeted_messages(self.max_token_limit)
+            return await self.history.awindowed_messages(self.k)
+        messages = await self.history.aget_messages()
+        return messages[-self.k * 2 :] if self.k > 0 else []
+
     @property
     def buffer_as_str(self) -> str:
         # not going to support this
@@ -49,11 +81,45 @@ class PybotMemory(BaseMemory):
 
         :meta private:
         """
-        return [self.memory_key]
+        if self.summary_key is None:
+            return [self.memory_key]
+        return [self.summary_key, self.memory_key]
 
     def load_memory_variables(self, inputs: dict[str, Any]) -> dict[str, Any]:
         """Return history buffer."""
-        return {self.memory_key: self.buffer}
+        variables = {self.memory_key: self.buffer}
+        if self.summary_key is not None:
+            variables[self.summary_key] = self._summary_messages(
+                self.history.get_summary()
+            )
+        return variables
+
+    async def aload_memory_variables(self, inputs: dict[str, Any]) -> dict[str, Any]:
+        """Return history buffer, without blocking the event loop."""
+        if self.summary_key is None:
+            return {self.memory_key: await self.abuffer()}
+        buffer, (summary, _) = await asyncio.gather(
+            self.abuffer(), self.history.aget_summary()
+        )
+        return {
+            self.memory_key: buffer,
+            self.summary_key: self._summary_messages(summary),
+        }
+
+    async def awindow_start(self) -> int:
+        """Position of the first message in buffer, messages before it are summarized."""
+        if self.max_token_limit is not None:
+            start, _ = await self.history.abudgeted_window(self.max_token_limit)
+            return start
+        return max(await self.history.alen() - self.k * 2, 0)
+
+    @staticmethod
+    def _summary_messages(summary: str) -> list[BaseMessage]:
+        if not summary:
+            return []
+        return [
+            SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+        ]
 
     def save_context(self, inputs: dict[str, Any], outputs: dict[str, str]) -> None:
         """Save context from this conversation to buffer."""
@@ -61,10 +127,21 @@ class PybotMemory(BaseMemory):
         self.history.add_user_message(input_str)
         self.history.add_ai_message(output_str)
 
+    async def asave_context(
+        self, inputs: dict[str, Any], outputs: dict[str, str]
+    ) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        await self.history.aadd_messages(
+            [HumanMessage(content=input_str), AIMessage(content=output_str)]
+        )
+
     def clear(self) -> None:
         """Clear memory contents."""
         self.history.clear()
 
+    async def aclear(self) -> None:
+        await self.history.aclear()
+
     def _get_input_output(
         self, inputs: dict[str, Any], outputs: dict[str, str]
     ) -> tuple[str, str]:
@@ -83,8 +160,19 @@ class PybotMemory(BaseMemory):
 
 history = PybotMessageHistory(
     url=str(settings.redis_om_url),
+    async_client=binary_client,
     key_prefix="chatbot:messages:",
     session_id="sid",  # a fake session id as it is required
+    codec=(
+        MsgpackCodec(compress_threshold=settings.history_compress_threshold)
+        if settings.history_codec == "msgpack"
+        else JsonCodec()
+    ),
+    archive=(
+        HistoryArchive(settings.history_archive_path)
+        if settings.history_archive_path
+        else None
+    ),
 )
 
 memory = PybotMemory(
@@ -92,4 +180,8 @@ memory = PybotMemory(
     input_key="input",
     history=history,
     return_messages=True,
+    summary_key="summary",
+    max_token_limit=settings.llm.context_length
+    - settings.llm.max_tokens
+    - settings.llm.prompt_reserve_tokens,
 )
@@ -0,0 +1,48 @@
+import hashlib
+import zlib
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+import aiofiles
+import aiofiles.os
+import msgpack
+
+
+class HistoryArchive:
+    """Stores offloaded message histories as compressed files under a directory.
+
+    Each history is a zlib compressed msgpack document, named after the hash of its Redis key.
+    """
+
+    def __init__(self, path: str, compress_level: int = 6):
+        self.path = Path(path)
+        self.compress_level = compress_level
+
+    def file_path(self, key: str | bytes) -> Path:
+        if isinstance(key, str):
+            key = key.encode()
+        digest = hashlib.sha256(key).hexdigest()
+        return self.path.joinpath(digest[:2], f"{digest}.bin")
+
+    async def awrite(self, key: str | bytes, doc: dict[str, Any]) -> str:
+        """Write the document atomically, returns the path of the file."""
+        file_path = self.file_path(key)
+        await aiofiles.os.makedirs(file_path.parent, exist_ok=True)
+        content = zlib.compress(msgpack.packb(doc), self.compress_level)
+        tmp_path = file_path.with_name(f".{uuid4().hex}.bin")
+        async with aiofiles.open(tmp_path, "wb") as out_file:
+            await out_file.write(content)
+        await aiofiles.os.replace(tmp_path, file_path)
+        return file_path.as_posix()
+
+    async def aread(self, file_path: str) -> dict[str, Any]:
+        async with aiofiles.open(file_path, "rb") as in_file:
+            content = await in_file.read()
+        return msgpack.unpackb(zlib.decompress(content), strict_map_key=False)
+
+    async def adelete(self, file_path: str) -> None:
+        try:
+            await aiofiles.os.remove(file_path)
+        except FileNotFoundError:
+            pass
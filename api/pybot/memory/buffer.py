@@ -0,0 +1,61 @@
+import asyncio
+import time
+from typing import Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+from loguru import logger
+
+
+class HistoryWriteBuffer:
+    """Buffers the messages of an agent turn, and writes them to the history in batches.
+
+    Each flush is a single `aadd_messages` call, which is one round trip for the redis backed histories.
+    Buffered messages are flushed at most `interval` seconds after being added, so that a crash mid-turn
+    loses only the messages of the last interval. Use it as an async context manager to flush the rest on exit.
+    """
+
+    def __init__(self, history: BaseChatMessageHistory, interval: float = 0.2):
+        self.history = history
+        self.interval = interval
+        self._buffer: list[BaseMessage] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._first_buffered_at = 0.0
+
+    async def __aenter__(self) -> "HistoryWriteBuffer":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aflush()
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        if not self._buffer:
+            self._first_buffered_at = time.monotonic()
+        self._buffer.extend(messages)
+        if time.monotonic() - self._first_buffered_at >= self.interval:
+            await self.aflush()
+        elif self._timer is None or self._timer.done():
+            # The task copies the current context, so the history writes to the same session.
+            self._timer = asyncio.create_task(self._aflush_later())
+
+    async def aflush(self) -> None:
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        async with self._lock:
+            if not self._buffer:
+                return
+            messages, self._buffer = self._buffer, []
+            await self.history.aadd_messages(messages)
+
+    async def _aflush_later(self) -> None:
+        await asyncio.sleep(
+            max(self.interval - (time.monotonic() - self._first_buffered_at), 0)
+        )
+        try:
+            await self.aflush()
+        except Exception as e:
+            logger.error(f"Failed to flush history, err: {str(e)}")
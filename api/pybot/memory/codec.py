@@ -0,0 +1,86 @@
+import json
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any
+
+import msgpack
+
+MSGPACK = b"\x01"
+"""Tag of msgpack encoded messages."""
+MSGPACK_ZLIB = b"\x02"
+"""Tag of zlib compressed, msgpack encoded messages."""
+
+
+class MessageCodec(ABC):
+    """Encodes messages (as returned by `message_to_dict`) to the values stored in Redis, and decodes them back.
+
+    Decoding is the same for all codecs: values are tagged with their format in the first byte,
+    and legacy untagged values are JSON. So switching codecs never makes stored messages unreadable.
+    """
+
+    @abstractmethod
+    def encode(self, message: dict[str, Any]) -> bytes: ...
+
+    def decode(self, data: bytes | str) -> dict[str, Any]:
+        if isinstance(data, str):
+            return json.loads(data)
+        tag, payload = data[:1], data[1:]
+        if tag == MSGPACK:
+            return msgpack.unpackb(payload)
+        if tag == MSGPACK_ZLIB:
+            return msgpack.unpackb(zlib.decompress(payload))
+        return json.loads(data)
+
+    def outdated(self, data: bytes | str) -> bool:
+        """Whether the value should be rewritten by this codec."""
+        return False
+
+
+class JsonCodec(MessageCodec):
+    """The legacy format, `json.dumps(message_to_dict(message))`."""
+
+    def encode(self, message: dict[str, Any]) -> bytes:
+        return json.dumps(message).encode()
+
+
+class MsgpackCodec(MessageCodec):
+    """Encodes messages with msgpack, and compresses them with zlib above a size threshold.
+
+    Fields holding their default value (None, False or empty) are left out, they are restored by `messages_from_dict`.
+    """
+
+    def __init__(self, compress_threshold: int = 1024, compress_level: int = 6):
+        self.compress_threshold = compress_threshold
+        """Minimum bytes of the encoded message to compress it, set to 0 to disable compression."""
+        self.compress_level = compress_level
+
+    def encode(self, message: dict[str, Any]) -> bytes:
+        packed = msgpack.packb(compact(message))
+        if self.compress_threshold and len(packed) >= self.compress_threshold:
+            compressed = zlib.compress(packed, self.compress_level)
+            # incompressible content (for example base64) may grow
+            if len(compressed) < len(packed):
+                return MSGPACK_ZLIB + compressed
+        return MSGPACK + packed
+
+    def outdated(self, data: bytes | str) -> bool:
+        return data[:1] not in (MSGPACK, MSGPACK_ZLIB)
+
+
+def compact(message: dict[str, Any]) -> dict[str, Any]:
+    """Strip the fields holding default values from the message's data.
+    `type` is also stripped from data, it is the same as the message's."""
+    data = {
+        k: v
+        for k, v in message["data"].items()
+        if k == "content" or (k != "type" and not _is_default(v))
+    }
+    return {"type": message["type"], "data": data}
+
+
+def _is_default(value: Any) -> bool:
+    return (
+        value is None
+        or value is False
+        or (isinstance(value, (list, dict)) and not value)
+    )
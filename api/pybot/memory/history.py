@@ -1,56 +1,500 @@
-import json
-from typing import Sequence
-from uuid import uuid4
+import asyncio
+import time
+from typing import Any, Optional, Sequence
+from uuid import UUID, uuid4
 
-from langchain_core.messages import BaseMessage, messages_from_dict
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from loguru import logger
+from redis.exceptions import WatchError
 
 from pybot.context import session_id
+from pybot.memory.archive import HistoryArchive
 from pybot.memory.redis import RedisMessageHistory
+from pybot.memory.tokens import TokenCounter
 from pybot.utils import utcnow
 
+# Append messages to the list, index their positions by id and record their token counts, atomically.
+# The list is also marked active at the given time. Returns -1 without appending if the list is archived.
+# KEYS: list key, index key, token counts key, activity key, archived key
+# ARGV: ttl (0 for no expiration), number of messages n, n messages, n message ids ('' for no id), n token counts,
+#   current timestamp
+APPEND_SCRIPT = """
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    return -1
+end
+local ttl = tonumber(ARGV[1])
+local n = tonumber(ARGV[2])
+local len = redis.call('RPUSH', KEYS[1], unpack(ARGV, 3, 2 + n))
+for i = 1, n do
+    local id = ARGV[2 + n + i]
+    if id ~= '' then
+        redis.call('HSET', KEYS[2], id, len - n + i - 1)
+    end
+end
+redis.call('RPUSH', KEYS[3], unpack(ARGV, 3 + 2 * n, 2 + 3 * n))
+redis.call('ZADD', KEYS[4], ARGV[3 + 3 * n], KEYS[1])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+    redis.call('EXPIRE', KEYS[3], ttl)
+end
+return len
+"""
+
+# Retrieve the latest messages whose token counts sum up to the budget at most.
+# Returns the position of the first message followed by the messages,
+# or false if the token counts are not aligned with the messages.
+# KEYS: list key, token counts key
+# ARGV: token budget
+BUDGETED_SCRIPT = """
+local budget = tonumber(ARGV[1])
+local len = redis.call('LLEN', KEYS[1])
+if redis.call('LLEN', KEYS[2]) ~= len then
+    return false
+end
+local total = 0
+local stop = len
+while stop > 0 do
+    local start = math.max(stop - 64, 0)
+    local counts = redis.call('LRANGE', KEYS[2], start, stop - 1)
+    for i = #counts, 1, -1 do
+        total = total + tonumber(counts[i])
+        if total > budget then
+            local items = redis.call('LRANGE', KEYS[1], start + i, -1)
+            table.insert(items, 1, start + i)
+            return items
+        end
+    end
+    stop = start
+end
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+table.insert(items, 1, 0)
+return items
+"""
+
+
+class MessageNotFoundException(RuntimeError): ...
+
+
+class HistoryArchivedException(RuntimeError): ...
+
 
 class PybotMessageHistory(RedisMessageHistory):
-    """Context aware history which also persists extra information in `additional_kwargs`."""
+    """Context aware history which also persists extra information in `additional_kwargs`.
+
+    Besides the message list, an id -> position hash is kept at `{key}:index`,
+    so that messages can be addressed by id instead of list index.
+    And the token count of each message is kept in a parallel list at `{key}:tokens`,
+    so that the messages fitting in a token budget are selected without tokenizing them again.
+    A rolling summary of the messages before the window is kept at `{key}:summary`.
+
+    If an archive is given, histories not appended to for a while can be offloaded to it,
+    leaving the archived file's path at `{key}:archived`. They are loaded back to Redis once accessed.
+    Last append time of the histories are kept in a sorted set at `{key_prefix}activity`.
+    """
+
+    def __init__(
+        self,
+        *args,
+        token_counter: Optional[TokenCounter] = None,
+        archive: Optional[HistoryArchive] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.token_counter = token_counter or TokenCounter()
+        self.archive = archive
+        self._aappend = self.async_client.register_script(APPEND_SCRIPT)
+        self._abudgeted = self.async_client.register_script(BUDGETED_SCRIPT)
 
     @property
     def key(self) -> str:
         """Construct the record key to use"""
         return self.key_prefix + (session_id.get() or self.session_id)
 
-    def add_message(self, message: BaseMessage) -> None:
-        message.additional_kwargs = (
-            default_additional_info() | message.additional_kwargs
+    @property
+    def index_key(self) -> str:
+        return f"{self.key}:index"
+
+    @property
+    def tokens_key(self) -> str:
+        return f"{self.key}:tokens"
+
+    @property
+    def summary_key(self) -> str:
+        return f"{self.key}:summary"
+
+    @property
+    def activity_key(self) -> str:
+        return f"{self.key_prefix}activity"
+
+    def is_history_key(self, key: str | bytes) -> bool:
+        if isinstance(key, bytes):
+            key = key.decode()
+        return not key.endswith(":tokens")
+
+    async def amigrate(self, key: Optional[str] = None) -> int:
+        migrated = await super().amigrate(key)
+        # histories appended before the activity was tracked, offload them after they are idle from now on.
+        await self.async_client.zadd(
+            self.activity_key, {key or self.key: time.time()}, nx=True
         )
-        super().add_message(message)
+        return migrated
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
 
     def add_messages(self, messages: Sequence[BaseMessage]) -> None:
-        for message in messages:
-            message.additional_kwargs = (
-                default_additional_info() | message.additional_kwargs
-            )
-        super().add_messages(messages)
+        if not messages:
+            return
+        append = self.client.register_script(APPEND_SCRIPT)
+        if append(keys=self._append_keys(), args=self._append_args(messages)) < 0:
+            # loading from the archive is only supported by the async interface
+            raise HistoryArchivedException(f"history {self.key} is archived")
 
     async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
-        for message in messages:
-            message.additional_kwargs = (
-                default_additional_info() | message.additional_kwargs
+        if not messages:
+            return
+        keys, args = self._append_keys(), self._append_args(messages)
+        if await self._aappend(keys=keys, args=args) < 0:
+            await self._arehydrate(self.key)
+            await self._aappend(keys=keys, args=args)
+
+    async def aget_messages(self) -> list[BaseMessage]:
+        messages = await super().aget_messages()
+        if not messages and await self._arehydrate(self.key):
+            messages = await super().aget_messages()
+        return messages
+
+    async def aget_messages_page(
+        self, before: Optional[int] = None, limit: int = 20
+    ) -> tuple[list[BaseMessage], Optional[int]]:
+        messages, cursor = await super().aget_messages_page(before, limit)
+        if before is None and not messages and await self._arehydrate(self.key):
+            messages, cursor = await super().aget_messages_page(before, limit)
+        return messages, cursor
+
+    async def aupdate_message(
+        self, message_id: str, additional_kwargs: dict[str, Any]
+    ) -> None:
+        """Merge `additional_kwargs` into the message's, atomically.
+        Raises `MessageNotFoundException` if there's no such message."""
+        key, index_key = self.key, self.index_key
+        field = normalize_id(message_id)
+        rebuilt = False
+        async with self.async_client.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key, index_key)
+                    pos = await pipe.hget(index_key, field)
+                    if pos is None:
+                        # Messages added before the index existed are not indexed, rebuild it once.
+                        indexed = await pipe.hlen(index_key)
+                        if not rebuilt and indexed < await pipe.llen(key):
+                            await pipe.reset()
+                            await self._abuild_index(key, index_key)
+                            rebuilt = True
+                            continue
+                        if not indexed:
+                            await pipe.reset()
+                            if await self._arehydrate(key):
+                                continue
+                        raise MessageNotFoundException(
+                            f"message {message_id} not found"
+                        )
+                    _msg = await pipe.lindex(key, int(pos))
+                    msg = self.codec.decode(_msg)
+                    msg["data"]["additional_kwargs"] = (
+                        msg["data"].get("additional_kwargs", {}) | additional_kwargs
+                    )
+                    pipe.multi()
+                    pipe.lset(key, int(pos), self.codec.encode(msg))
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    # modified by someone else, retry
+                    continue
+
+    async def _abuild_index(self, key: str, index_key: str) -> None:
+        _items = await self.async_client.lrange(key, 0, -1)
+        mapping = {}
+        for pos, m in enumerate(_items):
+            msg = self.codec.decode(m)
+            if message_id := msg["data"].get("additional_kwargs", {}).get("id"):
+                mapping[normalize_id(message_id)] = pos
+        if not mapping:
+            return
+        async with self.async_client.pipeline() as pipe:
+            pipe.hset(index_key, mapping=mapping)
+            if self.ttl:
+                pipe.expire(index_key, self.ttl)
+            await pipe.execute()
+
+    def clear(self) -> None:
+        self.client.delete(self.key, self.index_key, self.tokens_key, self.summary_key)
+
+    async def aclear(self) -> None:
+        key = self.key
+        archived_key = f"{key}:archived"
+        file_path = await self.async_client.get(archived_key)
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            pipe.delete(
+                key, self.index_key, self.tokens_key, self.summary_key, archived_key
             )
-        await super().aadd_messages(messages)
+            pipe.zrem(self.activity_key, key)
+            await pipe.execute()
+        if file_path is not None and self.archive is not None:
+            await self.archive.adelete(file_path.decode())
+
+    async def auntrack(self, session_id: str) -> None:
+        """Stop tracking the activity of the session's history, so that it is never offloaded.
+        For example when the conversation is deleted."""
+        await self.async_client.zrem(self.activity_key, self.key_prefix + session_id)
 
     def windowed_messages(self, window_size: int = 5) -> list[BaseMessage]:
         """Retrieve the last k pairs of messages from Redis"""
         _items = self.client.lrange(self.key, -window_size * 2, -1)
-        items = [json.loads(m.decode("utf-8")) for m in _items]
+        items = [self.codec.decode(m) for m in _items]
         messages = messages_from_dict(items)
         return messages
 
     async def awindowed_messages(self, window_size: int = 5) -> list[BaseMessage]:
         """Retrieve the last k pairs of messages from Redis"""
         _items = await self.async_client.lrange(self.key, -window_size * 2, -1)
-        items = [json.loads(m.decode("utf-8")) for m in _items]
+        if not _items and await self._arehydrate(self.key):
+            _items = await self.async_client.lrange(self.key, -window_size * 2, -1)
+        items = [self.codec.decode(m) for m in _items]
+        messages = messages_from_dict(items)
+        return messages
+
+    async def abudgeted_messages(self, max_tokens: int) -> list[BaseMessage]:
+        """Retrieve the latest messages from Redis, up to `max_tokens` tokens in total."""
+        _, messages = await self.abudgeted_window(max_tokens)
+        return messages
+
+    async def abudgeted_window(self, max_tokens: int) -> tuple[int, list[BaseMessage]]:
+        """Same as `abudgeted_messages`, but also returns the position of the first message."""
+        key, tokens_key = self.key, self.tokens_key
+        _items = await self._abudgeted(keys=[key, tokens_key], args=[max_tokens])
+        if _items is None:
+            # Messages added before the token counts existed are not counted, count them once.
+            await self._abuild_token_counts(key, tokens_key)
+            _items = await self._abudgeted(keys=[key, tokens_key], args=[max_tokens])
+        if (not _items or len(_items) == 1) and await self._arehydrate(key):
+            return await self.abudgeted_window(max_tokens)
+        if not _items:
+            return 0, []
+        start, *_messages = _items
+        items = [self.codec.decode(m) for m in _messages]
+        messages = messages_from_dict(items)
+        return int(start), messages
+
+    async def arange(self, start: int, stop: int) -> list[BaseMessage]:
+        """Retrieve the messages in [start, stop) from Redis."""
+        if stop <= start:
+            return []
+        _items = await self.async_client.lrange(self.key, start, stop - 1)
+        items = [self.codec.decode(m) for m in _items]
         messages = messages_from_dict(items)
         return messages
 
+    async def alen(self) -> int:
+        return await self.async_client.llen(self.key)
+
+    def get_summary(self) -> str:
+        """Summary of the messages before the window, empty if not summarized yet."""
+        summary = self.client.hget(self.summary_key, "text")
+        return summary.decode() if summary else ""
+
+    async def aget_summary(self) -> tuple[str, int]:
+        """Summary of the messages before the window, and the position of the first message not summarized yet."""
+        summary, until = await self.async_client.hmget(
+            self.summary_key, "text", "until"
+        )
+        return (summary.decode() if summary else ""), int(until or 0)
+
+    async def aset_summary(self, summary: str, until: int, expected_until: int) -> bool:
+        """Save the summary, unless it's updated by someone else since it summarized till `expected_until`.
+        Returns whether the summary is saved."""
+        key = self.summary_key
+        async with self.async_client.pipeline() as pipe:
+            try:
+                await pipe.watch(key)
+                if int(await pipe.hget(key, "until") or 0) != expected_until:
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={"text": summary, "until": until})
+                if self.ttl:
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def _abuild_token_counts(self, key: str, tokens_key: str) -> None:
+        async with self.async_client.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    _items = await pipe.lrange(key, 0, -1)
+                    messages = messages_from_dict(
+                        [self.codec.decode(m) for m in _items]
+                    )
+                    pipe.multi()
+                    pipe.delete(tokens_key)
+                    if messages:
+                        pipe.rpush(
+                            tokens_key,
+                            *[self.token_counter.count(m) for m in messages],
+                        )
+                        if self.ttl:
+                            pipe.expire(tokens_key, self.ttl)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    # modified by someone else, retry
+                    continue
+
+    async def aoffload(self, key: str | bytes, idle_before: float) -> bool:
+        """Offload the history at `key` to the archive, if it's not appended to since `idle_before` (a timestamp).
+        Returns whether it's offloaded."""
+        if self.archive is None:
+            return False
+        key = key.decode() if isinstance(key, bytes) else key
+        index_key, tokens_key, archived_key = (
+            f"{key}:index",
+            f"{key}:tokens",
+            f"{key}:archived",
+        )
+        async with self.async_client.pipeline() as pipe:
+            try:
+                # Appending modifies the list, so watching it is enough to not lose messages.
+                await pipe.watch(key)
+                active_at = await pipe.zscore(self.activity_key, key)
+                if active_at is not None and active_at > idle_before:
+                    return False
+                _items = await pipe.lrange(key, 0, -1)
+                if not _items:
+                    await pipe.reset()
+                    await self.async_client.zrem(self.activity_key, key)
+                    return False
+                tokens = await pipe.lrange(tokens_key, 0, -1)
+                index = await pipe.hgetall(index_key)
+                file_path = await self.archive.awrite(
+                    key,
+                    {
+                        "messages": _items,
+                        "tokens": [int(t) for t in tokens],
+                        "index": {k.decode(): int(v) for k, v in index.items()},
+                    },
+                )
+                pipe.multi()
+                pipe.delete(key, index_key, tokens_key)
+                pipe.set(archived_key, file_path)
+                pipe.zrem(self.activity_key, key)
+                await pipe.execute()
+                return True
+            except WatchError:
+                # appended meanwhile, it's active again.
+                await self.archive.adelete(self.archive.file_path(key).as_posix())
+                return False
+
+    async def aoffload_idle(self, idle: float, limit: int = 1000) -> int:
+        """Offload up to `limit` histories not appended to for `idle` seconds, returns the number offloaded."""
+        idle_before = time.time() - idle
+        keys = await self.async_client.zrangebyscore(
+            self.activity_key, "-inf", idle_before, start=0, num=limit
+        )
+        offloaded = 0
+        for key in keys:
+            if await self.aoffload(key, idle_before):
+                offloaded += 1
+        return offloaded
+
+    async def run_offloading(self, interval: float = 600, idle: float = 86400) -> None:
+        if self.archive is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if offloaded := await self.aoffload_idle(idle):
+                    logger.info(f"offloaded {offloaded} histories")
+            except Exception as e:
+                logger.error(f"Failed to offload histories, err: {str(e)}")
+
+    async def _arehydrate(self, key: str) -> bool:
+        """Load the history at `key` back from the archive, returns whether it was archived."""
+        if self.archive is None:
+            return False
+        index_key, tokens_key, archived_key = (
+            f"{key}:index",
+            f"{key}:tokens",
+            f"{key}:archived",
+        )
+        file_path = await self.async_client.get(archived_key)
+        if file_path is None:
+            return False
+        file_path = file_path.decode()
+        try:
+            doc = await self.archive.aread(file_path)
+        except FileNotFoundError:
+            if not await self.async_client.exists(archived_key):
+                # loaded (and the file deleted) by someone else
+                return True
+            raise
+        async with self.async_client.pipeline() as pipe:
+            try:
+                await pipe.watch(archived_key)
+                if not await pipe.exists(archived_key):
+                    # loaded by someone else
+                    return True
+                pipe.multi()
+                pipe.delete(key, index_key, tokens_key, archived_key)
+                pipe.rpush(key, *doc["messages"])
+                if doc["tokens"]:
+                    pipe.rpush(tokens_key, *doc["tokens"])
+                if doc["index"]:
+                    pipe.hset(index_key, mapping=doc["index"])
+                if self.ttl:
+                    for k in (key, index_key, tokens_key):
+                        pipe.expire(k, self.ttl)
+                pipe.zadd(self.activity_key, {key: time.time()})
+                await pipe.execute()
+            except WatchError:
+                return True
+        await self.archive.adelete(file_path)
+        return True
+
+    def _append_keys(self) -> list[str]:
+        key = self.key
+        return [
+            key,
+            f"{key}:index",
+            f"{key}:tokens",
+            self.activity_key,
+            f"{key}:archived",
+        ]
+
+    def _append_args(self, messages: Sequence[BaseMessage]) -> list[Any]:
+        payload, ids, tokens = [], [], []
+        for message in messages:
+            message.additional_kwargs = (
+                default_additional_info() | message.additional_kwargs
+            )
+            payload.append(self.codec.encode(message_to_dict(message)))
+            ids.append(normalize_id(message.additional_kwargs["id"]))
+            tokens.append(self.token_counter.count(message))
+        return [self.ttl or 0, len(messages), *payload, *ids, *tokens, time.time()]
+
+
+def normalize_id(message_id: Optional[str]) -> str:
+    """Message ids are written both as hex and as hyphenated uuid, normalize them to hex."""
+    if not message_id:
+        return ""
+    try:
+        return UUID(str(message_id)).hex
+    except ValueError:
+        return str(message_id)
+
 
 def default_additional_info() -> dict[str, str]:
     return {
@@ -1,4 +1,3 @@
-import json
 from typing import Optional, Sequence
 
 import redis
@@ -10,6 +9,10 @@ from langchain_core.messages import (
     messages_from_dict,
     messages_to_dict,
 )
+from loguru import logger
+from redis.exceptions import WatchError
+
+from pybot.memory.codec import JsonCodec, MessageCodec
 
 
 class RedisMessageHistory(BaseChatMessageHistory):
@@ -23,14 +26,23 @@ class RedisMessageHistory(BaseChatMessageHistory):
         url: str = "redis://localhost:6379/0",
         key_prefix: str = "message_store:",
         ttl: Optional[int] = None,
+        async_client: Optional[aioredis.Redis] = None,
+        codec: Optional[MessageCodec] = None,
     ):
-        # TODO: I might need to dig deeper into redis pooling.
-        # Another thing is whether I want to keep both sync and async clients.
-        self.client = redis.from_url(url)
-        self.async_client = aioredis.from_url(url)
+        self.url = url
+        self._client: Optional[redis.Redis] = None
+        self.async_client = async_client or aioredis.from_url(url)
         self.session_id = session_id
         self.key_prefix = key_prefix
         self.ttl = ttl
+        self.codec = codec or JsonCodec()
+
+    @property
+    def client(self) -> redis.Redis:
+        """Client of the sync interface of `BaseChatMessageHistory`, created on first use, as the app uses the async one."""
+        if self._client is None:
+            self._client = redis.from_url(self.url)
+        return self._client
 
     @property
     def key(self) -> str:
@@ -41,35 +53,134 @@ class RedisMessageHistory(BaseChatMessageHistory):
     def messages(self) -> list[BaseMessage]:  # type: ignore
         """Retrieve the messages from Redis"""
         _items = self.client.lrange(self.key, 0, -1)
-        items = [json.loads(m.decode("utf-8")) for m in _items]
+        items = [self.codec.decode(m) for m in _items]
         messages = messages_from_dict(items)
         return messages
 
     async def aget_messages(self) -> list[BaseMessage]:
         _items = await self.async_client.lrange(self.key, 0, -1)
-        items = [json.loads(m.decode("utf-8")) for m in _items]
+        items = [self.codec.decode(m) for m in _items]
         messages = messages_from_dict(items)
         return messages
 
+    async def aget_messages_page(
+        self, before: Optional[int] = None, limit: int = 20
+    ) -> tuple[list[BaseMessage], Optional[int]]:
+        """Retrieve a page of messages from Redis, newest first.
+
+        Messages are addressed by their position in the list, which never changes as the list is append only.
+
+        Args:
+            before (Optional[int]): Cursor returned by the previous page, retrieve the latest messages if None.
+            limit (int): Maximum number of messages in the page.
+
+        Returns:
+            tuple[list[BaseMessage], Optional[int]]: Messages in the page (in chronological order),
+                and the cursor of the next (older) page, None if there's no more messages.
+        """
+        if before is None:
+            async with self.async_client.pipeline(transaction=True) as pipe:
+                pipe.llen(self.key)
+                pipe.lrange(self.key, -limit, -1)
+                length, _items = await pipe.execute()
+            start = max(length - limit, 0)
+        else:
+            start = max(before - limit, 0)
+            _items = (
+                await self.async_client.lrange(self.key, start, before - 1)
+                if before > 0
+                else []
+            )
+        items = [self.codec.decode(m) for m in _items]
+        messages = messages_from_dict(items)
+        return messages, (start or None)
+
     def add_message(self, message: BaseMessage) -> None:
         """Append the message to the record in Redis"""
-        self.client.rpush(self.key, json.dumps(message_to_dict(message)))
+        self.client.rpush(self.key, self.codec.encode(message_to_dict(message)))
         if self.ttl:
             self.client.expire(self.key, self.ttl)
 
     def add_messages(self, messages: Sequence[BaseMessage]) -> None:
         message_dicts = messages_to_dict(messages)
-        payload = [json.dumps(m) for m in message_dicts]
+        payload = [self.codec.encode(m) for m in message_dicts]
         self.client.rpush(self.key, *payload)
         if self.ttl:
             self.client.expire(self.key, self.ttl)
 
     async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
         message_dicts = messages_to_dict(messages)
-        payload = [json.dumps(m) for m in message_dicts]
-        await self.async_client.rpush(self.key, *payload)
-        if self.ttl:
-            self.client.expire(self.key, self.ttl)
+        payload = [self.codec.encode(m) for m in message_dicts]
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            pipe.rpush(self.key, *payload)
+            if self.ttl:
+                pipe.expire(self.key, self.ttl)
+            await pipe.execute()
+
+    async def amigrate(self, key: Optional[str] = None) -> int:
+        """Rewrite the messages not encoded by the current codec, returns the number of messages rewritten.
+        Positions of the messages don't change."""
+        key = key or self.key
+        async with self.async_client.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    _items = await pipe.lrange(key, 0, -1)
+                    outdated = [
+                        (pos, m)
+                        for pos, m in enumerate(_items)
+                        if self.codec.outdated(m)
+                    ]
+                    if not outdated:
+                        return 0
+                    pipe.multi()
+                    for pos, m in outdated:
+                        pipe.lset(key, pos, self.codec.encode(self.codec.decode(m)))
+                    await pipe.execute()
+                    return len(outdated)
+                except WatchError:
+                    # appended by someone else, retry
+                    continue
+
+    def is_history_key(self, key: str | bytes) -> bool:
+        """Whether the list at `key` is a message history, subclasses may keep other lists under the prefix."""
+        return True
+
+    @property
+    def migrated_key(self) -> str:
+        """Marker of the migration to the current codec being done."""
+        return f"{self.key_prefix}migrated:{type(self.codec).__name__}"
+
+    async def amigrate_all(self, lock_timeout: int = 3600) -> None:
+        """Rewrite the messages of all sessions not encoded by the current codec.
+
+        This only runs once per codec: it is skipped once a marker is set on completion,
+        and while another instance is migrating (for up to `lock_timeout` seconds, in case it dies midway).
+        """
+        done_key, lock_key = self.migrated_key, f"{self.migrated_key}:lock"
+        try:
+            if await self.async_client.exists(done_key):
+                return
+            if not await self.async_client.set(lock_key, 1, nx=True, ex=lock_timeout):
+                logger.debug("message history is being migrated by another instance")
+                return
+        except Exception as e:
+            logger.error(f"Failed to migrate message history, err: {str(e)}")
+            return
+        migrated = 0
+        try:
+            async for key in self.async_client.scan_iter(
+                match=f"{self.key_prefix}*", _type="LIST"
+            ):
+                if self.is_history_key(key):
+                    migrated += await self.amigrate(key)
+            await self.async_client.set(done_key, 1)
+        except Exception as e:
+            logger.error(f"Failed to migrate message history, err: {str(e)}")
+        finally:
+            await self.async_client.delete(lock_key)
+        if migrated:
+            logger.info(f"migrated {migrated} messages")
 
     def clear(self) -> None:
         """Clear session memory from Redis"""
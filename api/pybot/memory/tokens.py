@@ -0,0 +1,49 @@
+from functools import cached_property
+from typing import Any, Optional
+
+from langchain_core.messages import BaseMessage
+from loguru import logger
+
+
+class TokenCounter:
+    """Counts the tokens of messages.
+
+    tiktoken's encoding is only an approximation of the model's tokenizer, which is good enough for budgeting.
+    If the encoding cannot be loaded (for example it's not cached and we are offline),
+    tokens are estimated by characters.
+    """
+
+    def __init__(
+        self,
+        encoding: str = "cl100k_base",
+        chars_per_token: int = 4,
+        message_overhead: int = 4,
+    ):
+        self.encoding_name = encoding
+        self.chars_per_token = chars_per_token
+        self.message_overhead = message_overhead
+        """Tokens of the chat template around each message."""
+
+    @cached_property
+    def encoding(self) -> Optional[Any]:
+        try:
+            import tiktoken
+
+            return tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            logger.warning(
+                f"Failed to load encoding {self.encoding_name}, estimating tokens by characters, err: {str(e)}"
+            )
+            return None
+
+    def count(self, message: BaseMessage) -> int:
+        content = (
+            message.content
+            if isinstance(message.content, str)
+            else str(message.content)
+        )
+        if self.encoding is None:
+            tokens = -(-len(content) // self.chars_per_token)
+        else:
+            tokens = len(self.encoding.encode(content, disallowed_special=()))
+        return tokens + self.message_overhead
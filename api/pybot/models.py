@@ -2,6 +2,7 @@ from datetime import datetime
 
 from aredis_om import Field, JsonModel
 
+from pybot.db import redis_client
 from pybot.utils import utcnow
 
 
@@ -14,6 +15,7 @@ class Conversation(JsonModel):
 
     class Meta:
         global_key_prefix = "pybot"
+        database = redis_client
 
 
 class File(JsonModel):
@@ -35,3 +37,4 @@ class File(JsonModel):
 
     class Meta:
         global_key_prefix = "pybot"
+        database = redis_client
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import date
 from typing import Annotated
 
@@ -5,13 +6,20 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, WebSocketExceptio
 from langchain_core.agents import AgentAction, AgentActionMessageLog
 from loguru import logger
 
-from pybot.agent import agent_executor
+from pybot.agent import agent_executor, output_parser
+from pybot.callbacks import ToolOutputStreamer
+from pybot.config import settings
+from pybot.chains.rolling_summary import aupdate_summary
 from pybot.chains.summarization import smry_chain
-from pybot.context import session_id
+from pybot.context import Session, session_id
 from pybot.dependencies import UserIdHeader
-from pybot.memory import history
+from pybot.index import conversation_index
+from pybot.jupyter import kernel_manager
+from pybot.memory import history, memory
+from pybot.memory.buffer import HistoryWriteBuffer
 from pybot.models import Conversation
 from pybot.schemas import AIChatMessage, ChatMessage, InfoMessage
+from pybot.streaming import StreamCoalescer
 from pybot.utils import utcnow
 
 router = APIRouter(
@@ -19,6 +27,9 @@ router = APIRouter(
     tags=["chat"],
 )
 
+# Keep references to the background tasks, or they may be garbage collected before done.
+background_tasks: set[asyncio.Task] = set()
+
 
 @router.websocket("")
 @router.websocket("/")
@@ -42,81 +53,157 @@ async def chat(
                 "userid": userid,
             }
             chain_run_id = None
-            async for event in agent_executor.astream_events(
-                input={
-                    "input": message.content,
-                    # create a new date on every message to solve message across days.
-                    "date": date.today(),
-                },
-                include_run_info=True,
-                version="v1",
-                config={"metadata": chain_metadata},
-            ):
-                event_name: str = event["name"]
-                if event_name.startswith("_"):
-                    # langchain's internal event, for example '_Exception'
-                    # skip for mainly 2 reasons:
-                    # 1. we don't want to expose internal event to the user (websocket or history)
-                    # 2. we want to keep the conversation history as short as possible
-                    logger.debug(f"skipping internal event: {event_name}")
-                    continue
-                logger.trace(f"event: {event}")
-                match event["event"]:
-                    case "on_chain_start":
-                        # There could be several chains, the most outer one is: event_name == "PybotAgentExecutor"
-                        chain_run_id = event["run_id"]
-                        if event_name == "PybotAgentExecutor":
-                            await history.aadd_messages([message.to_lc()])
-                    case "on_chain_end":
-                        # There are several chains, the most outer one is name: TableGPTAgentExecutor
-                        # We parse the final answer here.
-                        if event_name == "PybotAgentExecutor":
-                            msg = AIChatMessage(
+            tool_output_streamer = ToolOutputStreamer(websocket, message.conversation)
+            # Run id of the LLM generation currently being streamed.
+            # The streamed message uses it as id, and so does the action or final answer parsed from the generation,
+            # so that the client can replace the streamed message with the parsed one.
+            llm_run_id = None
+            llm_streamed = False
+            coalescer = StreamCoalescer(
+                interval=settings.stream_flush_interval,
+                size=settings.stream_flush_size,
+            )
+
+            async def send_llm_stream(content: str, type: str = "stream/text"):
+                msg = AIChatMessage(
+                    parent_id=chain_run_id,
+                    id=llm_run_id,
+                    conversation=message.conversation,
+                    content=content,
+                    type=type,
+                )
+                await websocket.send_text(msg.model_dump_json())
+
+            # Tail of the streaming LLM output, to find the opening code fence of an action.
+            llm_output_tail = ""
+            provisioned = False
+            # Messages of the turn are written in batches, instead of one round trip per step.
+            async with HistoryWriteBuffer(
+                history, interval=settings.history_flush_interval
+            ) as turn_history:
+                async for event in agent_executor.astream_events(
+                    input={
+                        "input": message.content,
+                        # create a new date on every message to solve message across days.
+                        "date": date.today(),
+                    },
+                    include_run_info=True,
+                    version="v1",
+                    config={
+                        "metadata": chain_metadata,
+                        "callbacks": [tool_output_streamer],
+                    },
+                ):
+                    event_name: str = event["name"]
+                    if event_name.startswith("_"):
+                        # langchain's internal event, for example '_Exception'
+                        # skip for mainly 2 reasons:
+                        # 1. we don't want to expose internal event to the user (websocket or history)
+                        # 2. we want to keep the conversation history as short as possible
+                        logger.debug(f"skipping internal event: {event_name}")
+                        continue
+                    logger.trace(f"event: {event}")
+                    match event["event"]:
+                        case "on_chain_start":
+                            # There could be several chains, the most outer one is: event_name == "PybotAgentExecutor"
+                            chain_run_id = event["run_id"]
+                            if event_name == "PybotAgentExecutor":
+                                await turn_history.aadd_messages([message.to_lc()])
+                        case "on_chain_end":
+                            # There are several chains, the most outer one is name: TableGPTAgentExecutor
+                            # We parse the final answer here.
+                            if event_name == "PybotAgentExecutor":
+                                msg = AIChatMessage(
+                                    parent_id=chain_run_id,
+                                    # If the answer is not parsed from a generation (for example max iterations reached),
+                                    # there's no streamed message to replace.
+                                    id=llm_run_id or event["run_id"],
+                                    content=event["data"]["output"]["output"].strip(),
+                                )
+                                await turn_history.aadd_messages([msg.to_lc()])
+                                await websocket.send_text(msg.model_dump_json())
+                        case "on_parser_end":
+                            if not isinstance(event["data"]["output"], AgentAction):
+                                continue
+                            output = event["data"]["output"]
+                            if not isinstance(output, AgentActionMessageLog):
+                                raise RuntimeError()
+                            # caveats: message_log from output parser lack some information, so we need to add them manually
+                            msgs = output.message_log
+                            for msg in msgs:
+                                msg.additional_kwargs = msg.additional_kwargs | {
+                                    "parent_id": chain_run_id,
+                                    "id": str(llm_run_id or event["run_id"]),
+                                    "type": "action",
+                                }
+                                _msg = ChatMessage.from_lc(msg, message.conversation)
+                                await websocket.send_text(_msg.model_dump_json())
+                            await turn_history.aadd_messages(msgs)
+                            tool_output_streamer.parent_id = chain_run_id
+                            # The generation is consumed by the action.
+                            llm_run_id = None
+                        case "on_tool_end":
+                            msg = ChatMessage(
                                 parent_id=chain_run_id,
                                 id=event["run_id"],
-                                content=event["data"]["output"]["output"].strip(),
+                                conversation=message.conversation,
+                                from_="system",
+                                content=event["data"]["output"],
+                                type="observation",
+                                additional_kwargs={
+                                    "tool": event_name,
+                                },
                             )
-                            await history.aadd_messages([msg.to_lc()])
+                            await turn_history.aadd_messages([msg.to_lc()])
                             await websocket.send_text(msg.model_dump_json())
-                    case "on_parser_end":
-                        if not isinstance(event["data"]["output"], AgentAction):
-                            continue
-                        output = event["data"]["output"]
-                        if not isinstance(output, AgentActionMessageLog):
-                            raise RuntimeError()
-                        # caveats: message_log from output parser lack some information, so we need to add them manually
-                        msgs = output.message_log
-                        for msg in msgs:
-                            msg.additional_kwargs = msg.additional_kwargs | {
-                                "parent_id": chain_run_id,
-                                "id": event["run_id"],
-                                "type": "action",
-                            }
-                            _msg = ChatMessage.from_lc(msg)
-                            await websocket.send_text(_msg.model_dump_json())
-                        await history.aadd_messages(msgs)
-                    case "on_tool_end":
-                        msg = ChatMessage(
-                            parent_id=chain_run_id,
-                            id=event["run_id"],
-                            conversation=message.conversation,
-                            from_="system",
-                            content=event["data"]["output"],
-                            type="observation",
-                            additional_kwargs={
-                                "tool": event_name,
-                            },
-                        )
-                        await history.aadd_messages([msg.to_lc()])
-                        await websocket.send_text(msg.model_dump_json())
-                    # Following are for local development logging.
-                    # For production we may use something like [lunary](https://github.com/lunary-ai/lunary)
-                    case "on_chat_model_end":
-                        logger.debug(f"on_chat_model_end event: {event}")
-                    case "on_llm_end":
-                        logger.debug(f"on_llm_end event: {event}")
+                        case "on_chat_model_start":
+                            llm_run_id = event["run_id"]
+                            llm_streamed = False
+                            coalescer.flush()
+                        case "on_chat_model_stream":
+                            chunk_content = event["data"]["chunk"].content
+                            if content := coalescer.push(chunk_content):
+                                await send_llm_stream(
+                                    content,
+                                    type="stream/text"
+                                    if llm_streamed
+                                    else "stream/start",
+                                )
+                                llm_streamed = True
+                            if provisioned:
+                                continue
+                            llm_output_tail = llm_output_tail[-32:] + chunk_content
+                            if event["data"]["chunk"].tool_call_chunks or (
+                                output_parser.find_opening_action(llm_output_tail)
+                            ):
+                                # Start the kernel while the code block (or the tool call) is still being generated,
+                                # so it is ready by the time the action is executed.
+                                provisioned = True
+                                session = await Session.get(session_id.get())
+                                await kernel_manager.aprovision_quietly(session)
+                        # Following are for local development logging.
+                        # For production we may use something like [lunary](https://github.com/lunary-ai/lunary)
+                        case "on_chat_model_end":
+                            logger.debug(f"on_chat_model_end event: {event}")
+                            if content := coalescer.flush():
+                                await send_llm_stream(
+                                    content,
+                                    type="stream/text"
+                                    if llm_streamed
+                                    else "stream/start",
+                                )
+                                llm_streamed = True
+                            if llm_streamed:
+                                await send_llm_stream("", type="stream/end")
+                        case "on_llm_end":
+                            logger.debug(f"on_llm_end event: {event}")
             conv.last_message_at = utcnow()
             await conv.save()
+            await conversation_index.aadd(conv)
+            # Messages may fall out of the memory window, summarize them without blocking the next message.
+            task = asyncio.create_task(aupdate_summary(memory))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
             # summarize if required
             if message.additional_kwargs and message.additional_kwargs.get(
                 "require_summarization", False
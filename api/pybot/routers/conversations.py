@@ -1,21 +1,20 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from langchain_core.messages import HumanMessage
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
 from loguru import logger
 
 from pybot.chains.summarization import smry_chain
 from pybot.config import settings
 from pybot.context import Session, session_id
 from pybot.dependencies import UserIdHeader
-from pybot.jupyter import ContextAwareKernelManager, GatewayClient
-from pybot.jupyter.schema import KernelNotFoundException
+from pybot.jupyter import kernel_manager
+from pybot.index import InvalidCursorException, conversation_index
 from pybot.memory import history
 from pybot.models import Conversation as ORMConversation
+from pybot.routers.messages import aget_message_page
 from pybot.schemas import (
-    ChatMessage,
-    Conversation,
     ConversationDetail,
+    ConversationPage,
     CreateConversation,
     UpdateConversation,
 )
@@ -24,17 +23,21 @@ router = APIRouter(
     prefix="/api/conversations",
     tags=["conversation"],
 )
-gateway_client = GatewayClient(host=settings.jupyter.gateway_url)
-kernel_manager = ContextAwareKernelManager(gateway_host=settings.jupyter.gateway_url)
 
 
 @router.get("")
 async def get_conversations(
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=500)] = settings.conversations_page_size,
     userid: Annotated[str | None, UserIdHeader()] = None,
-) -> list[Conversation]:
-    convs = await ORMConversation.find(ORMConversation.owner == userid).all()
-    convs.sort(key=lambda x: (x.pinned, x.last_message_at), reverse=True)
-    return [Conversation(**conv.model_dump()) for conv in convs]
+) -> ConversationPage:
+    """Get a page of conversations, pinned first and then most recent first.
+    Pass the `cursor` of a page to get the next page."""
+    try:
+        convs, next_cursor = await conversation_index.alist(userid, cursor, limit)
+    except InvalidCursorException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ConversationPage(conversations=convs, cursor=next_cursor)
 
 
 @router.get("/{conversation_id}")
@@ -46,18 +49,11 @@ async def get_conversation(
     if conv.owner != userid:
         raise HTTPException(status_code=403, detail="authorization error")
     session_id.set(f"{userid}:{conversation_id}")
-    msgs = await history.aget_messages()
+    # Only the latest page, older messages are loaded on demand.
+    page = await aget_message_page(conversation_id, userid)
     return ConversationDetail(
-        messages=[
-            (
-                ChatMessage.from_lc(
-                    lc_message=message, conv_id=conversation_id, from_=userid
-                )
-                if isinstance(message, HumanMessage)
-                else ChatMessage.from_lc(lc_message=message, conv_id=conversation_id)
-            )
-            for message in msgs
-        ],
+        messages=page.messages,
+        cursor=page.cursor,
         **conv.model_dump(),
     )
 
@@ -68,11 +64,11 @@ async def create_conversation(
 ) -> ConversationDetail:
     conv = ORMConversation(title=payload.title, owner=userid)
     await conv.save()
+    await conversation_index.aadd(conv)
     # create session
+    # The kernel is provisioned lazily, many conversations never run any code.
     session = Session(pk=f"{userid}:{conv.pk}", user_id=userid, conv_id=conv.pk)
     await session.save()
-    session_id.set(session.pk)
-    await kernel_manager.astart_kernel()
     return ConversationDetail(**conv.model_dump())
 
 
@@ -89,11 +85,15 @@ async def update_conversation(
     if payload.title is not None:
         conv.title = payload.title
         modified = True
+    reordered = False
     if payload.pinned is not None:
+        reordered = conv.pinned != payload.pinned
         conv.pinned = payload.pinned
         modified = True
     if modified:
         await conv.save()
+    if reordered:
+        await conversation_index.aadd(conv)
     return ConversationDetail(**conv.model_dump())
 
 
@@ -107,20 +107,17 @@ async def delete_conversation(
     if conv.owner != userid:
         raise HTTPException(status_code=403, detail="authorization error")
     await ORMConversation.delete(conversation_id)
+    await conversation_index.aremove(userid, conversation_id)
     background_tasks.add_task(cleanup_conv, f"{userid}:{conversation_id}")
 
 
 async def cleanup_conv(session_id: str):
     sess = await Session.get(session_id)
-    try:
-        gateway_client.delete_kernel(sess.kernel_id)
-        logger.info(f"kernel {sess.kernel_id} deleted")
-    except KernelNotFoundException:
-        logger.info(
-            f"kernel {sess.kernel_id} does not exists when deleting, maybe already culled by EG"
-        )
+    await kernel_manager.adelete_session_kernels(sess)
     await Session.delete(session_id)
     logger.info(f"session {session_id} deleted")
+    # Deleted conversations are not to be archived.
+    await history.auntrack(session_id)
 
 
 @router.post("/{conversation_id}/summarization", status_code=201)
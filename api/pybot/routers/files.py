@@ -4,11 +4,13 @@ from typing import Annotated
 
 import aiofiles
 from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile
+from fastapi.responses import FileResponse
 from langchain_core.chat_history import BaseChatMessageHistory
 
 from pybot.config import settings
-from pybot.context import session_id
+from pybot.context import Session, session_id
 from pybot.dependencies import UserIdHeader
+from pybot.jupyter import kernel_manager
 from pybot.memory import history
 from pybot.models import Conversation as ORMConversation
 from pybot.models import File as ORMFile
@@ -30,8 +32,12 @@ async def upload_files(
     conv = await ORMConversation.get(conversation_id)
     if conv.owner != userid:
         raise HTTPException(status_code=403, detail="authorization error")
+    session = await Session.get(f"{userid}:{conversation_id}")
+    # Uploaded files are almost always analyzed by code, provision the kernel in advance.
+    # This also binds the workspace to write the files into.
+    session = await kernel_manager.aprovision_quietly(session)
     base = Path(settings.jupyter.shared_volume_mount_path)
-    parent_dir = base.joinpath(userid).joinpath(conversation_id)
+    parent_dir = base.joinpath(session.get_workspace())
     # This should never happen, as the 'userid' and 'conversation_id' are controlled by us.
     # But there's a code QL warning about it.
     if base not in parent_dir.absolute().parents:
@@ -93,3 +99,17 @@ async def get_files(
     ).all()
     files.sort(key=lambda x: x.filename)
     return [File.model_validate(file.model_dump()) for file in files]
+
+
+@router.get("/{file_id}")
+async def download_file(
+    conversation_id: str,
+    file_id: str,
+    userid: Annotated[str | None, UserIdHeader()] = None,
+) -> FileResponse:
+    f = await ORMFile.get(file_id)
+    if f.owner != userid:
+        raise HTTPException(status_code=403, detail="authorization error")
+    if f.conversation_id != conversation_id:
+        raise HTTPException(status_code=404, detail="file not found")
+    return FileResponse(f.path, filename=Path(f.filename).name)
@@ -1,13 +1,15 @@
-import json
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from langchain_core.messages import HumanMessage
 
+from pybot.config import settings
 from pybot.context import session_id
 from pybot.dependencies import UserIdHeader
 from pybot.memory import history
-from pybot.memory.history import PybotMessageHistory
+from pybot.memory.history import MessageNotFoundException, PybotMessageHistory
 from pybot.models import Conversation as ORMConversation
+from pybot.schemas import ChatMessage, MessagePage
 
 router = APIRouter(
     prefix="/api/conversations/{conversation_id}/messages",
@@ -15,37 +17,66 @@ router = APIRouter(
 )
 
 
-@router.put("/{message_idx}/thumbup")
-async def thumbup(
+@router.get("")
+async def get_messages(
     conversation_id: str,
-    message_idx: int,
+    before: Optional[int] = None,
+    limit: Annotated[int, Query(ge=1, le=500)] = settings.messages_page_size,
     userid: Annotated[str | None, UserIdHeader()] = None,
-) -> None:
-    """Using message index as the uuid is in the message body which is json dumped into redis,
-    and is impossible to filter on.
-    Also separate thumbup and thumbdown into two endpoints to make it more RESTful."""
+) -> MessagePage:
+    """Get a page of messages, newest first. Pass the `cursor` of a page as `before` to get the older page."""
     conv = await ORMConversation.get(conversation_id)
     if conv.owner != userid:
         raise HTTPException(status_code=403, detail="authorization error")
-    if not isinstance(history, PybotMessageHistory):
-        # should never happen
-        return
     session_id.set(f"{userid}:{conversation_id}")
-    _msg: str = history.redis_client.lindex(history.key, message_idx)
-    msg = json.loads(_msg.decode("utf-8"))
-    msg["data"]["additional_kwargs"]["feedback"] = "thumbup"
-    history.redis_client.lset(history.key, message_idx, json.dumps(msg))
+    return await aget_message_page(conversation_id, userid, before, limit)
 
 
-@router.put("/{message_idx}/thumbdown")
+async def aget_message_page(
+    conversation_id: str,
+    userid: str | None,
+    before: Optional[int] = None,
+    limit: int = settings.messages_page_size,
+) -> MessagePage:
+    msgs, cursor = await history.aget_messages_page(before=before, limit=limit)
+    return MessagePage(
+        messages=[
+            (
+                ChatMessage.from_lc(
+                    lc_message=message, conv_id=conversation_id, from_=userid
+                )
+                if isinstance(message, HumanMessage)
+                else ChatMessage.from_lc(lc_message=message, conv_id=conversation_id)
+            )
+            for message in msgs
+        ],
+        cursor=cursor,
+    )
+
+
+@router.put("/{message_id}/thumbup")
+async def thumbup(
+    conversation_id: str,
+    message_id: str,
+    userid: Annotated[str | None, UserIdHeader()] = None,
+) -> None:
+    """Separate thumbup and thumbdown into two endpoints to make it more RESTful."""
+    await feedback(conversation_id, message_id, userid, "thumbup")
+
+
+@router.put("/{message_id}/thumbdown")
 async def thumbdown(
     conversation_id: str,
-    message_idx: int,
+    message_id: str,
     userid: Annotated[str | None, UserIdHeader()] = None,
 ) -> None:
-    """Using message index as the uuid is in the message body which is json dumped into redis,
-    and is impossible to filter on.
-    Also separate thumbup and thumbdown into two endpoints to make it more RESTful."""
+    """Separate thumbup and thumbdown into two endpoints to make it more RESTful."""
+    await feedback(conversation_id, message_id, userid, "thumbdown")
+
+
+async def feedback(
+    conversation_id: str, message_id: str, userid: str | None, feedback: str
+) -> None:
     conv = await ORMConversation.get(conversation_id)
     if conv.owner != userid:
         raise HTTPException(status_code=403, detail="authorization error")
@@ -53,7 +84,7 @@ async def thumbdown(
         # should never happen
         return
     session_id.set(f"{userid}:{conversation_id}")
-    _msg: str = history.redis_client.lindex(history.key, message_idx)
-    msg = json.loads(_msg.decode("utf-8"))
-    msg["data"]["additional_kwargs"]["feedback"] = "thumbdown"
-    history.redis_client.lset(history.key, message_idx, json.dumps(msg))
+    try:
+        await history.aupdate_message(message_id, {"feedback": feedback})
+    except MessageNotFoundException as e:
+        raise HTTPException(status_code=404, detail=str(e))
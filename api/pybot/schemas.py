@@ -180,10 +180,26 @@ class Conversation(BaseModel):
         return values
 
 
+class ConversationPage(BaseModel):
+    conversations: list[Conversation] = []
+    """Pinned first, and then most recent first."""
+    cursor: Optional[str] = None
+    """Cursor to load the next page, None if there's no more."""
+
+
 class ConversationDetail(Conversation):
-    """Conversation with messages."""
+    """Conversation with the latest page of messages."""
+
+    messages: list[ChatMessage] = []
+    cursor: Optional[int] = None
+    """Cursor to load older messages, None if there's no more."""
+
 
+class MessagePage(BaseModel):
     messages: list[ChatMessage] = []
+    """Messages in chronological order."""
+    cursor: Optional[int] = None
+    """Cursor to load older messages, None if there's no more."""
 
 
 class CreateConversation(BaseModel):
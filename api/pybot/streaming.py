@@ -0,0 +1,35 @@
+import time
+
+
+class StreamCoalescer:
+    """Buffers streamed text, so that we don't send one websocket frame per token.
+
+    The buffer is flushed once it holds `size` bytes, or `interval` seconds passed since the last flush.
+    Flushing only happens when text is pushed, call `flush` at the end of the stream to get the rest.
+    """
+
+    def __init__(self, interval: float = 0.05, size: int = 256):
+        self.interval = interval
+        self.size = size
+        self._buffer: list[str] = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def push(self, text: str) -> str:
+        """Buffer the text, returns the buffered text if it's time to flush, or an empty string if not."""
+        if text:
+            self._buffer.append(text)
+            self._buffered += len(text.encode())
+        if (
+            self._buffered >= self.size
+            or time.monotonic() - self._last_flush >= self.interval
+        ):
+            return self.flush()
+        return ""
+
+    def flush(self) -> str:
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        return text
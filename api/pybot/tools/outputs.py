@@ -0,0 +1,76 @@
+import base64
+import hashlib
+from pathlib import Path
+from typing import Any, Optional
+from uuid import uuid4
+
+import aiofiles
+import aiofiles.os
+from aredis_om import NotFoundError
+
+from pybot.config import settings
+from pybot.context import Session
+from pybot.models import File as ORMFile
+
+OUTPUTS_DIR = "outputs"
+"""Directory of the outputs under the workspace."""
+
+IMAGE_TYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/svg+xml": ".svg",
+}
+"""Image MIME types of 'display_data' we persist, in order of preference."""
+
+
+async def asave_output(session: Session, content: bytes, suffix: str) -> ORMFile:
+    """Save the output to the session's workspace and register it as a file.
+
+    Outputs are content-addressed, saving the same content again returns the file saved before.
+    """
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    filename = f"{OUTPUTS_DIR}/{digest}{suffix}"
+    pk = f"{session.conv_id}:{digest}{suffix}"
+    try:
+        return await ORMFile.get(pk)
+    except NotFoundError:
+        pass
+
+    base = Path(settings.jupyter.shared_volume_mount_path)
+    file_path = base.joinpath(session.get_workspace(), filename)
+    if not await aiofiles.os.path.isfile(file_path):
+        await aiofiles.os.makedirs(file_path.parent, exist_ok=True)
+        # write to a temp file first, so that the kernel never sees a partial file.
+        tmp_path = file_path.with_name(f".{uuid4().hex}{suffix}")
+        async with aiofiles.open(tmp_path, "wb") as out_file:
+            await out_file.write(content)
+        await aiofiles.os.replace(tmp_path, file_path)
+
+    f = ORMFile(
+        pk=pk,
+        filename=filename,
+        path=file_path.absolute().as_posix(),
+        mounted_path=base.joinpath(filename).absolute().as_posix(),
+        size=len(content),
+        owner=session.user_id,
+        conversation_id=session.conv_id,
+    )
+    await f.save()
+    return f
+
+
+async def asave_display_data(
+    session: Session, data: dict[str, Any]
+) -> Optional[ORMFile]:
+    """Save the image in a 'display_data' message, returns None if there's no image."""
+    for mime, suffix in IMAGE_TYPES.items():
+        if (payload := data.get(mime)) is None:
+            continue
+        if mime == "image/svg+xml":
+            # svg is sent as is, and may be split into lines
+            content = "".join(payload).encode()
+        else:
+            content = base64.b64decode(payload)
+        return await asave_output(session, content, suffix)
+    return None
@@ -1,15 +1,46 @@
-import asyncio
-from typing import Any, Optional
+from typing import Annotated, Any, Optional, Type
 
 from langchain_core.callbacks import (
     AsyncCallbackManagerForToolRun,
     CallbackManagerForToolRun,
 )
-from langchain_core.tools import BaseTool
+from langchain_core.tools import BaseTool, InjectedToolArg
 from loguru import logger
-from pydantic.v1 import root_validator
+from pydantic.v1 import BaseModel, root_validator
+
+from pybot.jupyter import ContextAwareKernelManager, ExecutionRequest
+from pybot.jupyter.channels import ExecutionMessages
+from pybot.jupyter.schema import (
+    KernelNotFoundException,
+    decode_message,
+)
+from pybot.models import File as ORMFile
+from pybot.tools.outputs import asave_display_data, asave_output
+from pybot.utils import run_sync
+
+
+def _to_async(
+    run_manager: Optional[CallbackManagerForToolRun],
+) -> Optional[AsyncCallbackManagerForToolRun]:
+    """The async equivalent of a sync run manager, the reverse of `AsyncCallbackManagerForToolRun.get_sync`."""
+    if run_manager is None:
+        return None
+    return AsyncCallbackManagerForToolRun(
+        run_id=run_manager.run_id,
+        handlers=run_manager.handlers,
+        inheritable_handlers=run_manager.inheritable_handlers,
+        parent_run_id=run_manager.parent_run_id,
+        tags=run_manager.tags,
+        inheritable_tags=run_manager.inheritable_tags,
+        metadata=run_manager.metadata,
+        inheritable_metadata=run_manager.inheritable_metadata,
+    )
 
-from pybot.jupyter import ContextAwareKernelManager, ExecutionRequest, ExecutionResponse
+
+class CodeSandboxInput(BaseModel):
+    code: str
+    cells: Annotated[Optional[list[str]], InjectedToolArg] = None
+    """Cells of the code, executed one after another. Set by multi-block actions, hidden from the LLM."""
 
 
 class CodeSandbox(BaseTool):
@@ -17,6 +48,9 @@ class CodeSandbox(BaseTool):
     timeout: int = 60
     """The timeout for the tool in seconds."""
     volume: str = "/mnt/shared"
+    observation_budget: int = 4000
+    """Maximum characters of the output returned to the agent, set to 0 for no limit.
+    Longer outputs are saved to the workspace, and only the head and the tail are returned."""
     description = f"""A Python shell. Use this tool to execute python commands.
   - Action Input: Must be a valid python snippet
   - Reminder:
@@ -31,130 +65,172 @@ class CodeSandbox(BaseTool):
     - matplotlib
     - SQLAlchemy
 """
+    args_schema: Type[BaseModel] = CodeSandboxInput
     gateway_url: str
     kernel_manager: Optional[ContextAwareKernelManager] = None
 
     @root_validator(pre=True)
     def validate_environment(cls, values: dict[str, Any]) -> dict[str, Any]:
-        values["kernel_manager"] = ContextAwareKernelManager(
-            gateway_host=values["gateway_url"]
-        )
+        if values.get("kernel_manager") is None:
+            values["kernel_manager"] = ContextAwareKernelManager(
+                gateway_host=values["gateway_url"]
+            )
         return values
 
     def _run(
-        self, code: str, run_manager: Optional[CallbackManagerForToolRun] = None
+        self,
+        code: str,
+        cells: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
-        """Use the tool."""
-        payload = ExecutionRequest.of_code(code)
-        logger.debug(f"kernel execution payload: {payload.model_dump_json()}")
-        kernel = self.kernel_manager.start_kernel()
-        with self.kernel_manager.upgrade(str(kernel.id)) as websocket:
-            result = ""
-            try:
-                websocket.send(payload.model_dump_json())
-                while message := websocket.recv(timeout=self.timeout):
-                    logger.trace(f"kernel execution message: [{message}]")
-                    response = ExecutionResponse.model_validate_json(message)
-                    if response.parent_header.msg_id != payload.header.msg_id:
-                        # This message does not belong to the current execution
-                        # As we break early once we get the result, this could happen
-                        logger.debug(
-                            f"Ignoring message of parent id {response.parent_header.msg_id} in request {payload.header.msg_id}"
-                        )
-                        continue
-                    match response.msg_type:
-                        case "execute_input":
-                            # Ignore broadcast message
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#code-inputs>
-                            logger.trace("Ignoring broadcast execution input.")
-                        case "execute_reply":
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#execution-results>
-                            # error execution may have extra messages, for example a stream std error
-                            if response.content.status == "error":
-                                result = f"{response.content.ename}: {response.content.evalue}"
-                            # For status != "error" we may want to extract the result from "stream" or "execute_result"
-                        case "execute_result":
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#id6>
-                            result = response.content.data.text_plain
-                        case "display_data":
-                            # TODO: We can persist images here and return the path
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#display-data>
-                            ...
-                        case "stream":
-                            # 'stream' is treated as second-class citizen. If 'execute_result', 'display_data' or 'execute_reply.error' exists,
-                            # We ignore the 'stream' message. If only all other messages has nothing to display, we will use the 'stream' message.
-                            if not result:
-                                result = response.content.text
-                        case "status":
-                            if response.content.execution_state == "idle":
-                                # idle means the kernel has finished executing
-                                # TODO: there will be rare situations that the idle message is received before the execute_result message
-                                # See <https://github.com/jupyter-server/enterprise_gateway/blob/54c8e31d9b17418f35454b49db691d2ce5643c22/enterprise_gateway/client/gateway_client.py#L235C9-L235C9>
-                                break
-                        case _:
-                            # debug because we don't handle many message types like status
-                            logger.debug(f"Unhandled message type: {response.msg_type}")
-            except Exception as e:
-                logger.error(f"Something goes wrong, err: {str(e)}")
-                result = str(e)
-        return result
+        """Use the tool, by running `_arun` on a new event loop.
+        The kernel channels, the sessions and the outputs are all async, this is for sync callers only."""
+        return run_sync(self._arun(code, cells, run_manager=_to_async(run_manager)))
 
     async def _arun(
-        self, code: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+        self,
+        code: str,
+        cells: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
     ) -> str:
-        """Use the tool asynchronously."""
-        payload = ExecutionRequest.of_code(code)
-        logger.debug(f"kernel execution payload: {payload.model_dump_json()}")
+        """Use the tool asynchronously.
+        If cells are given, they are pipelined to the kernel, and their outputs are returned together.
+        """
+        cells = cells or [code]
+        requests = [ExecutionRequest.of_code(cell) for cell in cells]
+        logger.debug(
+            f"kernel execution payloads: {[payload.model_dump_json() for payload in requests]}"
+        )
         kernel = await self.kernel_manager.astart_kernel()
-        async with self.kernel_manager.aupgrade(str(kernel.id)) as websocket:
-            result = ""
+        results = []
+        try:
             try:
-                await websocket.send(payload.model_dump_json())
-                while message := await asyncio.wait_for(
-                    websocket.recv(), timeout=self.timeout
-                ):
-                    logger.trace(f"kernel execution message: [{message}]")
-                    response = ExecutionResponse.model_validate_json(message)
-                    if response.parent_header.msg_id != payload.header.msg_id:
-                        # This message does not belong to the current execution
-                        # As we break early once we get the result, this could happen
-                        logger.debug(
-                            f"Ignoring message of parent id {response.parent_header.msg_id} in request {payload.header.msg_id}"
-                        )
-                        continue
-                    match response.msg_type:
-                        case "execute_input":
-                            # Ignore broadcast message
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#code-inputs>
-                            logger.trace("Ignoring broadcast execution input.")
-                        case "execute_reply":
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#execution-results>
-                            # error execution may have extra messages, for example a stream std error
-                            if response.content.status == "error":
-                                result = f"{response.content.ename}: {response.content.evalue}"
-                            # For status != "error" we may want to extract the result from "stream" or "execute_result"
-                        case "execute_result":
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#id6>
-                            result = response.content.data.text_plain
-                        case "display_data":
-                            # TODO: We can persist images here and return the path
-                            # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#display-data>
-                            ...
-                        case "stream":
-                            # 'stream' is treated as second-class citizen. If 'execute_result', 'display_data' or 'execute_reply.error' exists,
-                            # We ignore the 'stream' message. If only all other messages has nothing to display, we will use the 'stream' message.
-                            if not result:
-                                result = response.content.text
-                        case "status":
-                            if response.content.execution_state == "idle":
-                                # idle means the kernel has finished executing
-                                # TODO: there will be rare situations that the idle message is received before the execute_result message
-                                # See <https://github.com/jupyter-server/enterprise_gateway/blob/54c8e31d9b17418f35454b49db691d2ce5643c22/enterprise_gateway/client/gateway_client.py#L235C9-L235C9>
-                                break
-                        case _:
-                            # debug because we don't handle many message types like status
-                            logger.debug(f"Unhandled message type: {response.msg_type}")
-            except Exception as e:
-                logger.error(f"Something goes wrong, err: {str(e)}")
-                result = str(e)
+                await self._aexecute(str(kernel.id), requests, results, run_manager)
+            except KernelNotFoundException:
+                # The cached kernel may have been culled by the gateway, start a new one and retry once.
+                # Nothing was submitted, as the channel fails to connect.
+                logger.info(f"kernel {kernel.id} not found, retrying with a new one")
+                self.kernel_manager.cache.invalidate(str(kernel.id))
+                kernel = await self.kernel_manager.astart_kernel()
+                await self._aexecute(str(kernel.id), requests, results, run_manager)
+        except Exception as e:
+            logger.error(f"Something goes wrong, err: {str(e)}")
+            results.append(str(e))
+        if len(cells) == 1:
+            result = results[0]
+        else:
+            result = "\n".join(
+                f"# %% [{i}]\n{result.rstrip()}"
+                for i, result in enumerate(results, start=1)
+            )
+        if self._exceeds_budget(result):
+            session = await self.kernel_manager.current_session.aget()
+            file = await asave_output(session, result.encode(), ".txt")
+            result = self._truncate(result, file)
         return result
+
+    async def _aexecute(
+        self,
+        kernel_id: str,
+        requests: list[ExecutionRequest],
+        results: list[str],
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> None:
+        """Pipeline the requests to the kernel, and collect their outputs to `results` in order.
+        Outputs are collected as they come, so that they are kept if a later execution fails."""
+        async with self.kernel_manager.aexecute_many(kernel_id, requests) as executions:
+            failed = False
+            for messages in executions:
+                if failed:
+                    # The kernel aborts requests queued after a failed one.
+                    results.append("Not executed, as a previous cell failed.")
+                    continue
+                result, failed = await self._acollect(messages, run_manager)
+                results.append(result)
+
+    async def _acollect(
+        self,
+        messages: ExecutionMessages,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> tuple[str, bool]:
+        """Collect the output of an execution, returns the output and whether the execution failed."""
+        result, failed = "", False
+        files = []
+        # Messages are routed by parent msg_id, so all messages here belong to the current execution.
+        while message := await messages.recv(timeout=self.timeout):
+            logger.trace(f"kernel execution message: [{message}]")
+            response = decode_message(message)
+            match response.msg_type:
+                case "execute_input":
+                    # Ignore broadcast message
+                    # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#code-inputs>
+                    logger.trace("Ignoring broadcast execution input.")
+                case "execute_reply":
+                    # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#execution-results>
+                    # error execution may have extra messages, for example a stream std error
+                    if response.content.status == "error":
+                        failed = True
+                        result = f"{response.content.ename}: {response.content.evalue}"
+                    # For status != "error" we may want to extract the result from "stream" or "execute_result"
+                case "execute_result":
+                    # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#id6>
+                    result = response.content.data.text_plain
+                case "display_data":
+                    # See <https://jupyter-client.readthedocs.io/en/latest/messaging.html#display-data>
+                    # Images are saved to the workspace, only the path goes to the LLM and the history.
+                    session = await self.kernel_manager.current_session.aget()
+                    file = await asave_display_data(session, response.content.data)
+                    if file is not None:
+                        files.append(file)
+                case "error":
+                    # Published before 'idle', while the 'execute_reply' may come after it.
+                    failed = True
+                    result = f"{response.content.ename}: {response.content.evalue}"
+                case "stream":
+                    # 'stream' is treated as second-class citizen. If 'execute_result', 'display_data' or 'execute_reply.error' exists,
+                    # We ignore the 'stream' message. If only all other messages has nothing to display, we will use the 'stream' message.
+                    if not result and not files:
+                        result = response.content.text
+                    if run_manager is not None:
+                        # Forward the output as it comes, long running code can take a while to finish.
+                        await run_manager.on_text(response.content.text)
+                case "status":
+                    if response.content.execution_state == "idle":
+                        # idle means the kernel has finished executing
+                        # TODO: there will be rare situations that the idle message is received before the execute_result message
+                        # See <https://github.com/jupyter-server/enterprise_gateway/blob/54c8e31d9b17418f35454b49db691d2ce5643c22/enterprise_gateway/client/gateway_client.py#L235C9-L235C9>
+                        break
+                case _:
+                    # debug because we don't handle many message types like status
+                    logger.debug(f"Unhandled message type: {response.msg_type}")
+        return self._append_files(result, files), failed
+
+    @staticmethod
+    def _append_files(result: str, files: list[ORMFile]) -> str:
+        """Append references of the files to the output, after the text which may come later than the files."""
+        # The kernel path is kept as the alt text for the LLM, the UI loads the image from the files router.
+        refs = [
+            f"![{file.mounted_path}](/api/conversations/{file.conversation_id}/files/{file.pk})"
+            for file in files
+        ]
+        return "\n".join([result, *refs] if result else refs)
+
+    def _exceeds_budget(self, result: str) -> bool:
+        return 0 < self.observation_budget < len(result)
+
+    def _truncate(self, result: str, file: ORMFile) -> str:
+        """Keep the head and the tail of the output, with a pointer to the full output in between."""
+        # keep at least a char on each side, `result[-0:]` would be the whole output
+        half = max(self.observation_budget // 2, 1)
+        head, tail = result[:half], result[-half:]
+        # cut at line breaks if possible, a half line is hardly useful.
+        if (pos := head.rfind("\n")) > half // 2:
+            head = head[:pos]
+        if 0 <= (pos := tail.find("\n")) < half // 2:
+            tail = tail[pos + 1 :]
+        omitted = len(result) - len(head) - len(tail)
+        return (
+            f"{head}\n"
+            f"... {omitted} characters omitted. Full output saved to '{file.mounted_path}', read it with python if needed ...\n"
+            f"{tail}"
+        )
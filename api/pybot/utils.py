@@ -1,4 +1,13 @@
+import asyncio
+import contextvars
+import threading
 from datetime import datetime, timezone
+from typing import Any, Coroutine, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
 
 
 def utcnow():
@@ -6,3 +15,34 @@ def utcnow():
     datetime.datetime.utcnow() does not contain timezone information.
     """
     return datetime.now(timezone.utc)
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """Run the coroutine from sync code, and wait for its result.
+
+    Connections of the pools (Redis, the gateway's http client, the kernel channels) are bound to the event loop
+    they are opened in, so coroutines of sync callers all run on a single background event loop, instead of a new
+    loop per call like `asyncio.run`. Context variables of the caller are visible to the coroutine.
+    """
+    global _loop
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from a running event loop")
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="run-sync", daemon=True
+            ).start()
+    ctx = contextvars.copy_context()
+
+    async def _run() -> T:
+        for var, value in ctx.items():
+            var.set(value)
+        return await coro
+
+    return asyncio.run_coroutine_threadsafe(_run(), _loop).result()
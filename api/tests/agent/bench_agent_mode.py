@@ -0,0 +1,97 @@
+"""Benchmark of the agent modes against the configured LLM service, in tokens per turn and miss rate.
+
+Each task is sent to the first step of the agent in both modes, a miss is counted when the model doesn't take the
+action the task requires, either by answering right away or by an action that can't be parsed.
+The markdown parser never raises, so its parse failures show up as answers, hence both are counted as misses.
+
+Run with `python -m tests.agent.bench_agent_mode [rounds]`, the LLM service must support tool calling.
+"""
+
+import asyncio
+import sys
+from datetime import date
+
+from langchain_core.agents import AgentAction
+from langchain_core.exceptions import OutputParserException
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_openai import ChatOpenAI
+from loguru import logger
+
+from pybot.agent import tools
+from pybot.agent.output_parser import MarkdownOutputParser, ToolCallingOutputParser
+from pybot.agent.prompt import SYSTEM, TOOL_CALLING_SYSTEM
+from pybot.config import settings
+
+TASKS = [
+    "What's 2 to the power of 100?",
+    "Generate 10 random numbers between 1 and 100, and print their mean and standard deviation.",
+    "List the files under '/mnt/shared'.",
+    "Plot y = sin(x) for x from 0 to 2*pi and save it to '/mnt/shared/sin.png'.",
+    "Create a dataframe of the first 20 fibonacci numbers and print its describe().",
+]
+
+
+def make_prompt(system: str) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("user", "{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ]
+    )
+
+
+async def run(mode: str, llm: ChatOpenAI, rounds: int) -> None:
+    markdown_parser = MarkdownOutputParser(language_actions={"python": "python"})
+    if mode == "tool_calling":
+        chain = make_prompt(TOOL_CALLING_SYSTEM) | llm.bind_tools(tools)
+        parser = ToolCallingOutputParser(fallback=markdown_parser)
+    else:
+        tool_descs = "\n".join([f"- {tool.name}: {tool.description}" for tool in tools])
+        chain = make_prompt(SYSTEM).partial(tools=tool_descs) | llm
+        parser = markdown_parser
+
+    turns = misses = prompt_tokens = completion_tokens = 0
+    for _ in range(rounds):
+        for task in TASKS:
+            message = await chain.ainvoke(
+                {
+                    "date": date.today().isoformat(),
+                    "input": task,
+                    "agent_scratchpad": [],
+                }
+            )
+            turns += 1
+            if usage := message.usage_metadata:
+                prompt_tokens += usage["input_tokens"]
+                completion_tokens += usage["output_tokens"]
+            try:
+                parsed = parser.invoke(message)
+            except OutputParserException:
+                parsed = None
+            if not isinstance(parsed, AgentAction):
+                misses += 1
+
+    print(
+        f"[{mode}] {turns} turns, "
+        f"{prompt_tokens / turns:.1f} prompt + {completion_tokens / turns:.1f} completion tokens per turn, "
+        f"miss rate {misses / turns:.1%}"
+    )
+
+
+async def main(rounds: int) -> None:
+    llm = ChatOpenAI(
+        openai_api_base=str(settings.llm.url),
+        model=settings.llm.model,
+        openai_api_key=settings.llm.creds,
+        max_tokens=settings.llm.max_tokens,
+        streaming=True,
+        stream_usage=True,
+    )
+    for mode in ("markdown", "tool_calling"):
+        await run(mode, llm, rounds)
+
+
+if __name__ == "__main__":
+    logger.remove()
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
@@ -0,0 +1,85 @@
+"""Microbenchmark of the output parsers, over realistic and pathological LLM outputs.
+
+Run with `python -m tests.agent.bench_output_parser`.
+"""
+
+import ast
+import json
+from functools import partial
+
+from loguru import logger
+
+from pybot.agent.output_parser import DictOutputParser, MarkdownOutputParser, find_dicts
+from tests.bench import bench
+
+CODE = """import pandas as pd
+
+df = pd.read_csv('/mnt/shared/results.csv')
+stats = {team: {"wins": 0, "losses": 0} for team in df["home_team"].unique()}
+for _, row in df.iterrows():
+    print(f"{row['home_team']} vs {row['away_team']}: {row['home_score']}-{row['away_score']}")
+"""
+
+ACTION = json.dumps({"tool_name": "python", "tool_input": CODE}, indent=4)
+
+OUTPUTS = {
+    "short action": f"Let's read the file first:\n\n```json\n{ACTION}\n```",
+    "long code then action": f"Here's the code:\n\n```python\n{CODE * 50}```\n\n"
+    f"Now let's execute it:\n\n```json\n{ACTION}\n```",
+    "nested dicts": "Config: "
+    + json.dumps(
+        {"level": {"level": {"level": {"level": {"values": list(range(50))}}}}}
+    )
+    * 50
+    + f"\n{ACTION}",
+    "unbalanced braces": "Sets use { and dicts use {, " * 200 + f"\n{ACTION}",
+    "braces only": "{}" * 5000,
+}
+
+
+def find_dicts_before(s: str):
+    """`find_dicts` before it was rewritten, for comparison."""
+    stack = []
+    buffer = ""
+    start = 0
+    for i, ch in enumerate(s):
+        if ch == "{":
+            if start == 0:
+                start = i
+            buffer += ch
+            stack.append(ch)
+        elif ch == "}":
+            stack.pop(-1)
+            buffer += ch
+            if not stack:
+                try:
+                    yield ast.literal_eval(buffer), start, i
+                except ValueError:
+                    pass
+                start = 0
+                buffer = ""
+        elif stack:
+            buffer += ch
+
+
+def drain(gen) -> None:
+    try:
+        for _ in gen:
+            pass
+    except Exception:
+        # the previous implementation fails on some inputs
+        pass
+
+
+if __name__ == "__main__":
+    logger.remove()
+    bench = partial(bench, number=20, unit="ms", per="output")
+    dict_parser = DictOutputParser()
+    markdown_parser = MarkdownOutputParser(language_actions={"python": "python"})
+    for name, output in OUTPUTS.items():
+        print(f"[{name}] {len(output)} chars")
+        bench("find_dicts (before)", lambda: drain(find_dicts_before(output)))
+        bench("find_dicts", lambda: drain(find_dicts(output)))
+        bench("find_dicts (key)", lambda: drain(find_dicts(output, key="tool_name")))
+        bench("DictOutputParser.parse", lambda: dict_parser.parse(output))
+        bench("MarkdownOutputParser.parse", lambda: markdown_parser.parse(output))
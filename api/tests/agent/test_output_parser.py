@@ -1,6 +1,18 @@
+import re
 import unittest
 
-from pybot.agent.output_parser import DictOutputParser, MarkdownOutputParser, find_dicts
+from langchain_core.agents import AgentFinish
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration
+
+from pybot.agent.output_parser import (
+    CodeBlockScanner,
+    DictOutputParser,
+    MarkdownOutputParser,
+    ToolCallingOutputParser,
+    find_dicts,
+)
 
 
 class TestDictOutputParser(unittest.TestCase):
@@ -11,6 +23,23 @@ class TestDictOutputParser(unittest.TestCase):
         self.assertEqual(output[:start], "I need to do sth")
         self.assertEqual(output[end + 1 :], " and then I need to do sth else")
 
+    def test_braces_in_strings(self):
+        output = 'Run {"tool_name": "python", "tool_input": "print(f\\"{x}\\")"} now'
+        result, start, end = list(find_dicts(output))[0]
+        self.assertEqual(result["tool_input"], 'print(f"{x}")')
+        self.assertEqual(output[end + 1 :], " now")
+
+    def test_unbalanced_braces(self):
+        output = "close } first, then {'foo': 'bar'} and {not closed"
+        self.assertEqual([d for d, _, _ in find_dicts(output)], [{"foo": "bar"}])
+
+    def test_key(self):
+        output = '{"foo": "bar"} and {"tool_name": "python"}'
+        self.assertEqual(
+            [d for d, _, _ in find_dicts(output, key="tool_name")],
+            [{"tool_name": "python"}],
+        )
+
     def test_parse_until_valid(self):
         parser = DictOutputParser()
         output = """Alright, let\'s use the python tool to analyze the dataset and find the team with the highest number of victories.\n\nFirst, we need to read the dataset into a pandas DataFrame. Here\'s the code to do that:\n\n```python\nimport pandas as pd\n\n# read the file\ndf = pd.read_csv(\'/mnt/shared/results.csv\')\n```\n\nNext, we need to group the DataFrame by the \'home_team\' and \'away_team\' columns, and then count the number of victories for each team. Here\'s the code to do that:\n\n```python\n# group by home_team and away_team, and count the number of victories for each team\nteam_victories = df.groupby([\'home_team\', \'away_team\']).size().unstack(fill_value=0)\nteam_victories.loc[team_victories.index.levels[0], \'victories\'] = team_victories.sum(axis=1)\n```\n\nFinally, we can find the team with the highest number of victories by using the `idxmax` function:\n\n```python\n# find the team with the highest number of victories\nwinner = team_victories[\'victories\'].idxmax()\n\n# print the winner\nprint(f"The team with the highest number of victories is {winner}.")\n```\n\nSo, the complete code to find the team with the highest number of victories is:\n\n```python\nimport pandas as pd\n\n# read the file\ndf = pd.read_csv(\'/mnt/shared/results.csv\')\n\n# group by home_team and away_team, and count the number of victories for each team\nteam_victories = df.groupby([\'home_team\', \'away_team\']).size().unstack(fill_value=0)\nteam_victories.loc[team_victories.index.levels[0], \'victories\'] = team_victories.sum(axis=1)\n\n# find the team with the highest number of victories\nwinner = team_victories[\'victories\'].idxmax()\n\n# print the winner\nprint(f"The team with the highest number of victories is {winner}.")\n```\n\nNow, let\'s execute this code using the python tool:\n\n```json\n{\n    "tool_name": "python",\n    "tool_input": "import pandas as pd\\n\\n# read the file\\ndf = pd.read_csv(\'/mnt/shared/results.csv\')\\n\\n# group by home_team and away_team, and count the number of victories for each team\\nteam_victories = df.groupby([\'home_team\', \'away_team\']).size().unstack(fill_value=0)\\nteam_victories.loc[team_victories.index.levels[0], \'victories\'] = team_victories.sum(axis=1)\\n\\n# find the team with the highest number of victories\\nwinner = team_victories[\'victories\'].idxmax()\\n\\n# print the winner\\nprint(f\\"The team with the highest number of victories is {winner}.\\")"\n}\n```\n\nThis should give you the team with the highest number of victories in the dataset."""
@@ -39,6 +68,220 @@ class TestMarkdownOutputParser(unittest.TestCase):
         self.assertEqual(parsed.tool_input, "print('foo')")
         self.assertEqual(parsed.log, "I need to do sth")
 
+    def test_find_opening_action(self):
+        parser = MarkdownOutputParser(language_actions={"python": "python"})
+        self.assertIsNone(parser.find_opening_action("I need to do sth\n```pyth"))
+        self.assertIsNone(parser.find_opening_action("I need to do sth\n```bash\nls"))
+        self.assertEqual(
+            parser.find_opening_action("I need to do sth\n```python\nprint("),
+            "python",
+        )
+
+
+class TestGuidedMarkdownOutputParser(unittest.TestCase):
+    def test_guided_regex(self):
+        parser = MarkdownOutputParser(language_actions={"python": "python"})
+        regex = re.compile(parser.guided_regex())
+        self.assertIsNotNone(regex.fullmatch("The answer is `42`."))
+        self.assertIsNotNone(
+            regex.fullmatch("I need to do sth\n```python\nprint('foo')\n```")
+        )
+        self.assertIsNone(
+            regex.fullmatch("I need to do sth\n```python\nprint('foo')\n``` and then")
+        )
+        self.assertIsNone(regex.fullmatch("I need to do sth\n```bash\nls\n```"))
+
+    def test_trusted(self):
+        parser = MarkdownOutputParser(language_actions={"python": "python"})
+        trusted = MarkdownOutputParser(
+            language_actions={"python": "python"}, trusted=True
+        )
+        for output in [
+            "The answer is `42`.",
+            "I need to do sth\n```python\nprint('foo')\n```",
+            "```python\nprint('foo')\n```",
+        ]:
+            self.assertEqual(trusted.parse(output), parser.parse(output))
+
+
+class TestMultiActionMarkdownOutputParser(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.parser = MarkdownOutputParser(
+            language_actions={"python": "python"}, multi_action=True
+        )
+
+    def test_parse(self):
+        output = (
+            "I need to do sth\n```python\na = 1\n```\nand then\n```python\nprint(a)\n```\n"
+            "```bash\nls\n```\n```python\nprint('foo')\n```"
+        )
+        parsed = self.parser.parse(output)
+        self.assertEqual(
+            parsed.tool_input,
+            {"code": "a = 1\n# %%\nprint(a)", "cells": ["a = 1", "print(a)"]},
+        )
+        self.assertEqual(
+            parsed.message_log[0].additional_kwargs["action"]["tool_input"],
+            "a = 1\n# %%\nprint(a)",
+        )
+        self.assertEqual(parsed.log, "I need to do sth")
+        self.assertEqual(
+            parsed.message_log[0].content,
+            "I need to do sth\n```python\na = 1\n```\nand then\n```python\nprint(a)\n```",
+        )
+
+    def test_single_block(self):
+        output = "I need to do sth\n```python\nprint('foo')\n``` and then I need to do sth else"
+        single = MarkdownOutputParser(language_actions={"python": "python"})
+        self.assertEqual(self.parser.parse(output), single.parse(output))
+
+    def test_guided_regex(self):
+        regex = re.compile(self.parser.guided_regex())
+        self.assertIsNotNone(
+            regex.fullmatch("a\n```python\na = 1\n```\nb\n```python\nprint(a)\n```")
+        )
+        self.assertIsNone(regex.fullmatch("a\n```python\na = 1\n```\nb"))
+
+    async def test_stream_all_blocks(self):
+        chunks = ["```python\na = 1\n```", "\n```python\nprint(a)\n```", " done"]
+        consumed = []
+
+        async def generate():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        outputs = [output async for output in self.parser.atransform(generate())]
+        self.assertEqual(consumed, chunks)
+        self.assertEqual(outputs[0].tool_input["cells"], ["a = 1", "print(a)"])
+
+
+class TestCodeBlockScanner(unittest.TestCase):
+    def test_split_fences(self):
+        text = "I need to do sth\n```python\nprint('foo')\n``` and then I need to do sth else"
+        scanner = CodeBlockScanner()
+        closed_at = None
+        for i in range(0, len(text), 3):
+            if scanner.feed(text[i : i + 3]) and closed_at is None:
+                closed_at = i
+        self.assertTrue(scanner.closed)
+        self.assertEqual(scanner.language, "python")
+        self.assertEqual(text[scanner.start : scanner.code_start], "```python\n")
+        self.assertEqual(text[scanner.code_start : scanner.code_end], "print('foo')")
+        self.assertEqual(text[: scanner.end], text[: text.index(" and")])
+        self.assertLess(closed_at, text.index(" and"))
+
+    def test_not_closed(self):
+        scanner = CodeBlockScanner()
+        self.assertFalse(scanner.feed("I need to do sth\n```python\n"))
+        self.assertFalse(scanner.feed("\n```"))
+        self.assertEqual(scanner.language, "python")
+
+
+class TestMarkdownOutputParserStreaming(unittest.IsolatedAsyncioTestCase):
+    async def test_stop_at_closing_fence(self):
+        parser = MarkdownOutputParser(language_actions={"python": "python"})
+        chunks = [
+            "I need to do sth\n``",
+            "`python\nprint('foo')\n`",
+            "``",
+            " and then",
+            " sth else",
+        ]
+        consumed = []
+
+        async def generate():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        outputs = [output async for output in parser.atransform(generate())]
+        self.assertEqual(consumed, chunks[:3])
+        self.assertEqual(outputs, [parser.parse("".join(chunks))])
+
+    async def test_finish(self):
+        parser = MarkdownOutputParser(language_actions={"python": "python"})
+        chunks = ["I need to do sth\n```bash\nls\n```", " and then", " sth else"]
+
+        async def generate():
+            for chunk in chunks:
+                yield chunk
+
+        outputs = [output async for output in parser.atransform(generate())]
+        self.assertEqual(outputs, [parser.parse("".join(chunks))])
+        self.assertEqual(outputs[0].return_values["output"], "".join(chunks))
+
+
+class TestToolCallingOutputParser(unittest.IsolatedAsyncioTestCase):
+    def test_parse_tool_call(self):
+        parser = ToolCallingOutputParser()
+        message = AIMessage(
+            content="I need to do sth",
+            tool_calls=[
+                {"name": "python", "args": {"code": "print('foo')"}, "id": "call_0"}
+            ],
+        )
+        parsed = parser.parse_result([ChatGeneration(message=message)])
+        self.assertEqual(parsed.tool, "python")
+        self.assertEqual(parsed.tool_input, {"code": "print('foo')"})
+        self.assertEqual(parsed.tool_call_id, "call_0")
+        self.assertEqual(parsed.log, "I need to do sth")
+        # rendered the same as a markdown action, without tool calls.
+        rendered = parsed.message_log[0]
+        self.assertEqual(
+            rendered.content, "I need to do sth\n```python\nprint('foo')\n```"
+        )
+        self.assertEqual(rendered.tool_calls, [])
+
+    def test_invalid_tool_call(self):
+        parser = ToolCallingOutputParser()
+        message = AIMessage(
+            content="",
+            invalid_tool_calls=[
+                {"name": "python", "args": '{"code": ', "id": "call_0", "error": None}
+            ],
+        )
+        with self.assertRaises(OutputParserException):
+            parser.parse_result([ChatGeneration(message=message)])
+
+    def test_fallback(self):
+        parser = ToolCallingOutputParser(
+            fallback=MarkdownOutputParser(language_actions={"python": "python"})
+        )
+        output = "I need to do sth\n```python\nprint('foo')\n```"
+        parsed = parser.parse_result(
+            [ChatGeneration(message=AIMessage(content=output))]
+        )
+        self.assertEqual(parsed.tool_input, "print('foo')")
+        parsed = ToolCallingOutputParser().parse_result(
+            [ChatGeneration(message=AIMessage(content=output))]
+        )
+        self.assertIsInstance(parsed, AgentFinish)
+
+    async def test_streamed_tool_call(self):
+        parser = ToolCallingOutputParser()
+        chunks = [
+            AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": "python", "args": '{"code": ', "id": "call_0", "index": 0}
+                ],
+            ),
+            AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": None, "args": '"1 + 1"}', "id": None, "index": 0}
+                ],
+            ),
+        ]
+
+        async def generate():
+            for chunk in chunks:
+                yield chunk
+
+        outputs = [output async for output in parser.atransform(generate())]
+        self.assertEqual(outputs[-1].tool_input, {"code": "1 + 1"})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,11 @@
+"""Helpers shared by the microbenchmarks."""
+
+import timeit
+
+UNITS = {"s": 1, "ms": 1e3, "us": 1e6}
+
+
+def bench(name: str, func, number: int, unit: str = "us", per: str = "op") -> None:
+    """Print the best time of a call to `func` over 5 repeats of `number` calls."""
+    cost = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{name:<48}{cost * UNITS[unit]:>10.3f} {unit}/{per}")
@@ -0,0 +1,69 @@
+"""Microbenchmark of decoding kernel messages.
+
+Run with `python -m tests.jupyter.bench_schema`.
+"""
+
+import json
+from functools import partial
+
+from pybot.jupyter.schema import ExecutionResponse, decode_message, parent_msg_id
+from tests.bench import bench
+
+HEADER = {
+    "msg_id": "2fc2cb39-d47ba9dceb48e194d7d2a90c_9_16",
+    "username": "username",
+    "session": "2fc2cb39-d47ba9dceb48e194d7d2a90c",
+    "date": "2023-11-11T04:31:41.994060Z",
+    "version": "5.3",
+}
+PARENT_HEADER = {
+    "msg_id": "asadfd",
+    "msg_type": "execute_request",
+    "date": "2023-11-11T04:31:41.989268Z",
+    "version": "5.0",
+}
+CONTENTS = {
+    "status": {"execution_state": "idle"},
+    "execute_input": {"code": "print(1)", "execution_count": 1},
+    "stream": {"name": "stdout", "text": "1\n" * 20},
+    "execute_result": {
+        "data": {"text/plain": "1"},
+        "metadata": {},
+        "execution_count": 1,
+    },
+    "execute_reply": {
+        "status": "ok",
+        "execution_count": 1,
+        "user_expressions": {},
+        "payload": [],
+    },
+}
+
+
+def message(msg_type: str) -> str:
+    return json.dumps(
+        {
+            "header": HEADER | {"msg_type": msg_type},
+            "msg_id": HEADER["msg_id"],
+            "msg_type": msg_type,
+            "parent_header": PARENT_HEADER,
+            "metadata": {},
+            "content": CONTENTS[msg_type],
+            "buffers": [],
+            "channel": "iopub",
+        }
+    )
+
+
+if __name__ == "__main__":
+    bench = partial(bench, number=20000, unit="us", per="msg")
+    for msg_type in CONTENTS:
+        msg = message(msg_type)
+        print(f"[{msg_type}]")
+        bench(
+            "ExecutionResponse.model_validate_json",
+            lambda: ExecutionResponse.model_validate_json(msg),
+        )
+        bench("decode_message", lambda: decode_message(msg))
+        bench("json.loads (parent msg_id, before)", lambda: json.loads(msg))
+        bench("parent_msg_id", lambda: parent_msg_id(msg))
@@ -0,0 +1,39 @@
+import unittest
+
+from pybot.jupyter.cache import KernelCache
+from pybot.jupyter.schema import Kernel
+
+
+def make_kernel(n: int) -> Kernel:
+    return Kernel(
+        id=f"00000000-0000-0000-0000-00000000000{n}",
+        name="python3",
+        last_activity="2024-01-01T00:00:00Z",
+        execution_state="idle",
+        connections=0,
+    )
+
+
+class TestKernelCache(unittest.TestCase):
+    def test_reconcile(self):
+        cache = KernelCache()
+        alive, culled = make_kernel(1), make_kernel(2)
+        cache.put(alive, "session-1")
+        cache.put(culled, "session-2")
+        self.assertEqual(cache.reconcile([alive]), {"session-2": str(culled.id)})
+        self.assertIsNotNone(cache.get(str(alive.id)))
+        self.assertIsNone(cache.get(str(culled.id)))
+
+    def test_reconcile_known(self):
+        cache = KernelCache()
+        culled, started = make_kernel(1), make_kernel(2)
+        cache.put(culled, "session-1")
+        known = cache.snapshot()
+        # started while listing, so not in the list
+        cache.put(started, "session-2")
+        self.assertEqual(cache.reconcile([], known), {"session-1": str(culled.id)})
+        self.assertIsNotNone(cache.get(str(started.id)))
+
+
+if __name__ == "__main__":
+    unittest.main()
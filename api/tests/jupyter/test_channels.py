@@ -0,0 +1,155 @@
+import asyncio
+import json
+import unittest
+from http import HTTPStatus
+
+from websockets.server import serve
+
+from pybot.jupyter.channels import ChannelClosedException, KernelChannelManager
+from pybot.jupyter.schema import ExecutionRequest, KernelNotFoundException
+
+KERNEL_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def _message(parent_id: str, msg_type: str, content: dict) -> str:
+    return json.dumps(
+        {
+            "header": {"msg_id": f"{parent_id}-{msg_type}", "msg_type": msg_type},
+            "msg_id": f"{parent_id}-{msg_type}",
+            "msg_type": msg_type,
+            "parent_header": {"msg_id": parent_id},
+            "metadata": {},
+            "content": content,
+            "buffers": [],
+            "channel": "iopub",
+        }
+    )
+
+
+class FakeKernel:
+    """A kernel's websocket channel which prints the code of each request.
+    Replies once `batch` requests are received, in reverse order and interleaved, to exercise the routing."""
+
+    def __init__(self, batch: int = 1):
+        self.batch = batch
+        self.connections = []
+        self._pending = []
+
+    def process_request(self, path, headers):
+        if path != f"/api/kernels/{KERNEL_ID}/channels":
+            return HTTPStatus.NOT_FOUND, [], b""
+
+    async def handle(self, websocket):
+        self.connections.append(websocket)
+        async for raw in websocket:
+            request = json.loads(raw)
+            self._pending.append((request["header"]["msg_id"], request["content"]))
+            if len(self._pending) < self.batch:
+                continue
+            pending, self._pending = self._pending[::-1], []
+            # not a reply to any request
+            await websocket.send(
+                _message("unknown", "status", {"execution_state": "busy"})
+            )
+            for msg_id, content in pending:
+                text = content["code"]
+                await websocket.send(
+                    _message(msg_id, "stream", {"name": "stdout", "text": text})
+                )
+            for msg_id, _ in pending:
+                await websocket.send(
+                    _message(msg_id, "status", {"execution_state": "idle"})
+                )
+
+
+async def collect(messages) -> str:
+    text = ""
+    while message := await messages.recv(timeout=5):
+        message = json.loads(message)
+        if message["msg_type"] == "stream":
+            text += message["content"]["text"]
+        elif message["content"].get("execution_state") == "idle":
+            return text
+
+
+class TestKernelChannelManager(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.kernel = FakeKernel()
+        self.server = await serve(
+            self.kernel.handle,
+            "127.0.0.1",
+            0,
+            process_request=self.kernel.process_request,
+        )
+        port = self.server.sockets[0].getsockname()[1]
+        self.lost = []
+        self.channels = KernelChannelManager(
+            f"http://127.0.0.1:{port}", on_lost=self.lost.append
+        )
+
+    async def asyncTearDown(self):
+        await self.channels.aclose()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_route_by_parent(self):
+        self.kernel.batch = 2
+        requests = [ExecutionRequest.of_code("foo"), ExecutionRequest.of_code("bar")]
+        async with self.channels.execute_many(KERNEL_ID, requests) as executions:
+            outputs = [await collect(messages) for messages in executions]
+        self.assertEqual(outputs, ["foo", "bar"])
+
+    async def test_shared_connection(self):
+        for code in ("foo", "bar"):
+            async with self.channels.execute(
+                KERNEL_ID, ExecutionRequest.of_code(code)
+            ) as messages:
+                self.assertEqual(await collect(messages), code)
+        self.assertEqual(len(self.kernel.connections), 1)
+
+    async def test_reconnect(self):
+        async with self.channels.execute(
+            KERNEL_ID, ExecutionRequest.of_code("foo")
+        ) as messages:
+            await collect(messages)
+        # closed by the gateway, for example restarted
+        await self.kernel.connections[0].close()
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.lost, [KERNEL_ID])
+        async with self.channels.execute(
+            KERNEL_ID, ExecutionRequest.of_code("bar")
+        ) as messages:
+            self.assertEqual(await collect(messages), "bar")
+        self.assertEqual(len(self.kernel.connections), 2)
+
+    async def test_closed_while_executing(self):
+        # never replies
+        self.kernel.batch = 2
+        async with self.channels.execute(
+            KERNEL_ID, ExecutionRequest.of_code("foo")
+        ) as messages:
+            await asyncio.sleep(0.1)
+            await self.kernel.connections[0].close()
+            with self.assertRaises(ChannelClosedException):
+                await collect(messages)
+
+    async def test_kernel_not_found(self):
+        kernel_id = "00000000-0000-0000-0000-000000000002"
+        with self.assertRaises(KernelNotFoundException):
+            async with self.channels.execute(
+                kernel_id, ExecutionRequest.of_code("foo")
+            ):
+                pass
+        self.assertEqual(self.lost, [kernel_id])
+
+    async def test_evict_idle(self):
+        self.channels.idle_timeout = 0
+        self.kernel.batch = 2
+        async with self.channels.execute(KERNEL_ID, ExecutionRequest.of_code("foo")):
+            # busy channels are kept
+            await self.channels.evict_idle()
+            self.assertIn(KERNEL_ID, self.channels._channels)
+        await self.channels.evict_idle()
+        self.assertNotIn(KERNEL_ID, self.channels._channels)
+        # closed by us, the kernel is not lost
+        self.assertEqual(self.lost, [])
@@ -0,0 +1,164 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+
+from pybot.context import Session
+from pybot.jupyter import ContextAwareKernelManager
+from pybot.jupyter.schema import Kernel, KernelNotFoundException
+
+
+def make_kernel(n: int) -> Kernel:
+    return Kernel(
+        id=f"00000000-0000-0000-0000-{n:012}",
+        name="python3",
+        last_activity="2024-01-01T00:00:00Z",
+        execution_state="idle",
+        connections=0,
+    )
+
+
+class FakeGatewayClient:
+    def __init__(self):
+        self.kernels: dict[str, Kernel] = {}
+        self.created = 0
+
+    async def acreate_kernel(self, request) -> Kernel:
+        self.created += 1
+        kernel = make_kernel(self.created)
+        self.kernels[str(kernel.id)] = kernel
+        return kernel
+
+    async def aget_kernel(self, kernel_id: str) -> Kernel:
+        if (kernel := self.kernels.get(kernel_id)) is None:
+            raise KernelNotFoundException(kernel_id)
+        return kernel
+
+    async def alist_kernels(self) -> list[Kernel]:
+        return list(self.kernels.values())
+
+    async def adelete_kernel(self, kernel_id: str) -> None:
+        if self.kernels.pop(kernel_id, None) is None:
+            raise KernelNotFoundException(kernel_id)
+
+
+class KernelManagerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        patcher = patch.object(Session, "db", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.gateway = FakeGatewayClient()
+        self.manager = ContextAwareKernelManager(
+            "localhost:8888", gateway_client=self.gateway
+        )
+        # kernels are started with the volume mounted, which is not the case here
+        env_patcher = patch.object(self.manager, "_get_kernel_env", return_value={})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def create_session(self, conv_id: str = "bar") -> Session:
+        session = Session(pk=f"foo:{conv_id}", user_id="foo", conv_id=conv_id)
+        await session.save()
+        return session
+
+
+class TestReconcile(KernelManagerTestCase):
+    async def test_unset_gone_kernel(self):
+        session = await self.create_session()
+        kernel = await self.manager.aensure_kernel(session)
+        del self.gateway.kernels[str(kernel.id)]
+        self.assertEqual(await self.manager.areconcile(), [session.pk])
+        self.assertIsNone((await Session.get(session.pk)).kernel_id)
+
+    async def test_keep_new_kernel(self):
+        session = await self.create_session()
+        kernel = await self.manager.aensure_kernel(session)
+        del self.gateway.kernels[str(kernel.id)]
+        # another replica starts a new kernel for the session meanwhile
+        new_kernel = make_kernel(100)
+        self.gateway.kernels[str(new_kernel.id)] = new_kernel
+        session = await Session.get(session.pk)
+        session.kernel_id = str(new_kernel.id)
+        await session.save()
+        self.assertEqual(await self.manager.areconcile(), [session.pk])
+        self.assertEqual(
+            str((await Session.get(session.pk)).kernel_id), str(new_kernel.id)
+        )
+
+    async def test_deleted_session(self):
+        session = await self.create_session()
+        kernel = await self.manager.aensure_kernel(session)
+        del self.gateway.kernels[str(kernel.id)]
+        await Session.delete(session.pk)
+        await self.manager.areconcile()
+        self.assertFalse(await self.client.exists(session.key()))
+
+
+class TestDeleteSessionKernels(KernelManagerTestCase):
+    async def test_no_kernel(self):
+        session = await self.create_session()
+        with patch.object(self.gateway, "adelete_kernel") as delete:
+            await self.manager.adelete_session_kernels(session)
+        delete.assert_not_called()
+
+    async def test_pending_start(self):
+        session = await self.create_session()
+        session = await self.manager.aprovision(session)
+        # the start is still pending
+        self.assertEqual(self.gateway.kernels, {})
+        await self.manager.adelete_session_kernels(session)
+        self.assertEqual(self.gateway.kernels, {})
+
+
+class TestEnsureKernel(KernelManagerTestCase):
+    async def test_concurrent_starts(self):
+        session = await self.create_session()
+        kernels = await asyncio.gather(
+            self.manager.aensure_kernel(session),
+            self.manager.aensure_kernel(session),
+        )
+        self.assertEqual(len(self.gateway.kernels), 1)
+        self.assertEqual(kernels[0], kernels[1])
+
+    async def test_stale_session(self):
+        stale = await self.create_session()
+        # sessions with a bound workspace are not reloaded to bind it
+        stale.workspace = stale.get_workspace()
+        await stale.save()
+        # provisioned and started after the session was loaded
+        await self.manager.aensure_kernel(await Session.get(stale.pk))
+        self.assertIsNone(stale.kernel_id)
+        kernel = await self.manager.aensure_kernel(stale)
+        self.assertEqual(list(self.gateway.kernels), [str(kernel.id)])
+
+    async def test_restart_gone_kernel(self):
+        session = await self.create_session()
+        kernel = await self.manager.aensure_kernel(session)
+        del self.gateway.kernels[str(kernel.id)]
+        self.manager.cache.invalidate(str(kernel.id))
+        new_kernel = await self.manager.aensure_kernel(await Session.get(session.pk))
+        self.assertNotEqual(new_kernel.id, kernel.id)
+        self.assertEqual(
+            str((await Session.get(session.pk)).kernel_id), str(new_kernel.id)
+        )
+
+
+class TestProvision(KernelManagerTestCase):
+    async def test_provision(self):
+        session = await self.manager.aprovision_quietly(await self.create_session())
+        self.assertEqual(session.workspace, "foo/bar")
+        kernel = await self.manager.aensure_kernel(session)
+        self.assertEqual(list(self.gateway.kernels), [str(kernel.id)])
+
+    async def test_provision_failure(self):
+        session = await self.create_session()
+        with patch.object(self.manager, "aprovision", side_effect=RuntimeError):
+            session = await self.manager.aprovision_quietly(session)
+        # the default workspace is bound anyway
+        self.assertEqual(session.workspace, "foo/bar")
+        self.assertEqual((await Session.get(session.pk)).workspace, "foo/bar")
@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+
+from pybot.context import Session
+from pybot.jupyter.pool import KernelPool
+from tests.jupyter.test_kernel import FakeGatewayClient, KernelManagerTestCase
+
+
+class TestKernelPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gateway = FakeGatewayClient()
+        self.workspaces = []
+        self.pool = KernelPool(self.gateway, env_factory=self.env, size=2)
+
+    def env(self, workspace: str) -> dict:
+        self.workspaces.append(workspace)
+        return {}
+
+    async def test_fill(self):
+        await self.pool.afill()
+        self.assertEqual(len(self.gateway.kernels), 2)
+        self.assertEqual(len(set(self.workspaces)), 2)
+        self.assertTrue(all(ws.startswith("_pool/") for ws in self.workspaces))
+        # filled already
+        await self.pool.afill()
+        self.assertEqual(len(self.gateway.kernels), 2)
+
+    async def test_claim(self):
+        await self.pool.afill()
+        claimed = [await self.pool.aclaim(), await self.pool.aclaim()]
+        self.assertEqual(
+            {str(pooled.kernel.id) for pooled in claimed}, set(self.gateway.kernels)
+        )
+        self.assertEqual({pooled.workspace for pooled in claimed}, set(self.workspaces))
+        self.assertIsNone(await self.pool.aclaim())
+
+    async def test_claim_culled(self):
+        await self.pool.afill()
+        culled = next(iter(self.gateway.kernels))
+        del self.gateway.kernels[culled]
+        pooled = await self.pool.aclaim()
+        self.assertNotEqual(str(pooled.kernel.id), culled)
+        self.assertIsNone(await self.pool.aclaim())
+
+    async def test_refresh(self):
+        await self.pool.afill()
+        culled = next(iter(self.gateway.kernels))
+        del self.gateway.kernels[culled]
+        await self.pool.arefresh()
+        await self.pool.afill()
+        self.assertEqual(len(self.gateway.kernels), 2)
+        self.assertNotIn(culled, {str(p.kernel.id) for p in self.pool._kernels})
+
+    async def test_fill_failure(self):
+        calls = 0
+
+        def env(workspace: str) -> dict:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("gateway unavailable")
+            return {}
+
+        self.pool.env_factory = env
+        await self.pool.afill()
+        self.assertEqual(len(self.pool._kernels), 1)
+        await self.pool.afill()
+        self.assertEqual(len(self.pool._kernels), 2)
+
+    async def test_drain(self):
+        await self.pool.afill()
+        await self.pool.adrain()
+        self.assertEqual(self.gateway.kernels, {})
+        self.assertIsNone(await self.pool.aclaim())
+
+
+class TestClaim(KernelManagerTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.manager.pool = KernelPool(
+            self.gateway, env_factory=lambda workspace: {}, size=2
+        )
+        await self.manager.pool.afill()
+
+    async def test_claim(self):
+        session = await self.create_session()
+        kernel = await self.manager.aensure_kernel(session)
+        session = await Session.get(session.pk)
+        self.assertEqual(str(session.kernel_id), str(kernel.id))
+        # the session adopts the kernel's workspace
+        self.assertTrue(session.workspace.startswith("_pool/"))
+        self.assertEqual(len(self.gateway.kernels), 2)
+        self.assertEqual(len(self.manager.pool._kernels), 1)
+
+    async def test_concurrent_binds(self):
+        session = await self.create_session()
+        sessions = await asyncio.gather(
+            *[self.manager.abind_workspace(session) for _ in range(3)]
+        )
+        self.assertEqual(len({s.workspace for s in sessions}), 1)
+        self.assertEqual(len(self.manager.pool._kernels), 1)
+        # locks are dropped once nobody is binding
+        self.assertEqual(self.manager._bind_locks, {})
+
+    async def test_bound_workspace(self):
+        session = await self.create_session()
+        session.workspace = session.get_workspace()
+        await session.save()
+        # the workspace of a pooled kernel can't be changed, a new kernel is started
+        await self.manager.aensure_kernel(session)
+        self.assertEqual(len(self.gateway.kernels), 3)
+        self.assertEqual(len(self.manager.pool._kernels), 2)
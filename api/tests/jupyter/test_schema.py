@@ -1,7 +1,17 @@
+import json
 import unittest
 
 from pybot.jupyter import ExecutionRequest, ExecutionResponse
-from pybot.jupyter.schema import ExecutionContent, ExecutionHeader
+from pybot.jupyter.schema import (
+    DisplayDataResponse,
+    ExecutionContent,
+    ExecutionHeader,
+    ExecutionReplyResponse,
+    StreamResponse,
+    UnknownResponse,
+    decode_message,
+    parent_msg_id,
+)
 
 
 class TestEGRequestSchema(unittest.TestCase):
@@ -260,5 +270,81 @@ class TestEGResponseSchema(unittest.TestCase):
         ExecutionResponse.model_validate(data)
 
 
+class TestDecodeMessage(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "header": {
+                "msg_id": "2fc2cb39-d47ba9dceb48e194d7d2a90c_9_16",
+                "msg_type": "stream",
+                "username": "username",
+                "session": "2fc2cb39-d47ba9dceb48e194d7d2a90c",
+                "date": "2023-11-11T04:31:41.994060Z",
+                "version": "5.3",
+            },
+            "msg_id": "2fc2cb39-d47ba9dceb48e194d7d2a90c_9_16",
+            "msg_type": "stream",
+            "parent_header": {
+                "msg_id": "asadfd",
+                "msg_type": "execute_request",
+                "date": "2023-11-11T04:31:41.989268Z",
+                "version": "5.0",
+            },
+            "metadata": {},
+            "content": {"name": "stdout", "text": "1\n"},
+            "buffers": [],
+            "channel": "iopub",
+        }
+
+    def test_decode_by_msg_type(self):
+        res = decode_message(json.dumps(self.data))
+        self.assertIsInstance(res, StreamResponse)
+        self.assertIsInstance(res, ExecutionResponse)
+        self.assertEqual(res.content.text, "1\n")
+
+    def test_decode_display_data(self):
+        self.data["header"]["msg_type"] = "display_data"
+        self.data["msg_type"] = "display_data"
+        self.data["content"] = {
+            "data": {"text/plain": "<Figure>", "image/png": "iVBORw0KGgo="},
+            "metadata": {},
+            "transient": {},
+        }
+        res = decode_message(json.dumps(self.data))
+        self.assertIsInstance(res, DisplayDataResponse)
+        self.assertEqual(res.content.data["image/png"], "iVBORw0KGgo=")
+
+    def test_decode_aborted_reply(self):
+        self.data["header"]["msg_type"] = "execute_reply"
+        self.data["msg_type"] = "execute_reply"
+        self.data["channel"] = "shell"
+        self.data["content"] = {"status": "aborted"}
+        res = decode_message(json.dumps(self.data))
+        self.assertIsInstance(res, ExecutionReplyResponse)
+        self.assertEqual(res.content.status, "aborted")
+
+    def test_decode_unknown_msg_type(self):
+        self.data["header"]["msg_type"] = "comm_msg"
+        self.data["msg_type"] = "comm_msg"
+        self.data["content"] = {"comm_id": "foo", "data": {}}
+        res = decode_message(json.dumps(self.data))
+        self.assertIsInstance(res, UnknownResponse)
+        self.assertEqual(res.content["comm_id"], "foo")
+
+    def test_parent_msg_id(self):
+        self.assertEqual(parent_msg_id(json.dumps(self.data)), "asadfd")
+
+    def test_parent_msg_id_in_content(self):
+        # content comes first and looks like a parent header
+        content = {"name": "stdout", "text": '"parent_header": {"msg_id": "foo"}'}
+        self.data = {"content": content} | {
+            k: v for k, v in self.data.items() if k != "content"
+        }
+        self.assertEqual(parent_msg_id(json.dumps(self.data)), "asadfd")
+
+    def test_empty_parent_header(self):
+        self.data["parent_header"] = {}
+        self.assertIsNone(parent_msg_id(json.dumps(self.data)))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,36 @@
+import asyncio
+import unittest
+
+from langchain.memory.chat_message_histories.in_memory import ChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from pybot.memory.buffer import HistoryWriteBuffer
+
+
+class CountingHistory(ChatMessageHistory):
+    writes: int = 0
+
+    async def aadd_messages(self, messages):
+        self.writes += 1
+        await super().aadd_messages(messages)
+
+
+class TestHistoryWriteBuffer(unittest.IsolatedAsyncioTestCase):
+    async def test_flush_on_exit(self):
+        history = CountingHistory()
+        async with HistoryWriteBuffer(history, interval=60) as buffer:
+            await buffer.aadd_messages([HumanMessage(content="foo")])
+            await buffer.aadd_messages([AIMessage(content="bar")])
+            self.assertEqual(history.messages, [])
+        self.assertEqual(history.writes, 1)
+        self.assertEqual([msg.content for msg in history.messages], ["foo", "bar"])
+
+    async def test_flush_after_interval(self):
+        history = CountingHistory()
+        async with HistoryWriteBuffer(history, interval=0.01) as buffer:
+            await buffer.aadd_messages([HumanMessage(content="foo")])
+            await asyncio.sleep(0.05)
+            self.assertEqual([msg.content for msg in history.messages], ["foo"])
+            await buffer.aadd_messages([AIMessage(content="bar")])
+        self.assertEqual(history.writes, 2)
+        self.assertEqual([msg.content for msg in history.messages], ["foo", "bar"])
@@ -0,0 +1,51 @@
+import json
+import unittest
+
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+
+from pybot.memory.codec import MSGPACK, MSGPACK_ZLIB, JsonCodec, MsgpackCodec
+
+
+class TestMsgpackCodec(unittest.TestCase):
+    def setUp(self):
+        self.codec = MsgpackCodec(compress_threshold=256)
+
+    def roundtrip(self, message):
+        data = self.codec.encode(message_to_dict(message))
+        return data, messages_from_dict([self.codec.decode(data)])[0]
+
+    def test_roundtrip(self):
+        message = HumanMessage(content="foo", additional_kwargs={"id": "bar"})
+        data, decoded = self.roundtrip(message)
+        self.assertEqual(data[:1], MSGPACK)
+        self.assertEqual(decoded, message)
+
+    def test_roundtrip_empty_content(self):
+        message = AIMessage(content="")
+        _, decoded = self.roundtrip(message)
+        self.assertEqual(decoded, message)
+
+    def test_compress(self):
+        message = AIMessage(content="foo\n" * 1024)
+        data, decoded = self.roundtrip(message)
+        self.assertEqual(data[:1], MSGPACK_ZLIB)
+        self.assertLess(len(data), 256)
+        self.assertEqual(decoded, message)
+
+    def test_decode_legacy(self):
+        message = HumanMessage(content="foo", additional_kwargs={"id": "bar"})
+        legacy = json.dumps(message_to_dict(message))
+        for data in (legacy, legacy.encode()):
+            self.assertTrue(self.codec.outdated(data))
+            self.assertEqual(messages_from_dict([self.codec.decode(data)])[0], message)
+
+    def test_json_codec_reads_msgpack(self):
+        message = HumanMessage(content="foo")
+        data = self.codec.encode(message_to_dict(message))
+        self.assertFalse(JsonCodec().outdated(data))
+        self.assertEqual(messages_from_dict([JsonCodec().decode(data)])[0], message)
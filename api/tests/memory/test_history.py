@@ -0,0 +1,260 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+import fakeredis
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    message_to_dict,
+)
+
+from pybot.memory.archive import HistoryArchive
+from pybot.memory.buffer import HistoryWriteBuffer
+from pybot.memory.codec import MsgpackCodec
+from pybot.memory.history import MessageNotFoundException, PybotMessageHistory
+from pybot.memory.tokens import TokenCounter
+
+
+class ContentLength(TokenCounter):
+    """Counts a token per character, so that the budgets in the tests are easy to follow."""
+
+    def count(self, message: BaseMessage) -> int:
+        return len(message.content)
+
+
+def make_message(content: str, human: bool = True) -> BaseMessage:
+    cls = HumanMessage if human else AIMessage
+    return cls(content=content, additional_kwargs={"id": uuid4().hex})
+
+
+class HistoryTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = fakeredis.FakeAsyncRedis()
+        self.history = self.make_history()
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    def make_history(self, **kwargs) -> PybotMessageHistory:
+        return PybotMessageHistory(
+            session_id="foo",
+            key_prefix="test:messages:",
+            async_client=self.client,
+            codec=MsgpackCodec(),
+            token_counter=ContentLength(),
+            **kwargs,
+        )
+
+    async def push_legacy(self, messages: list[BaseMessage]) -> None:
+        """Push messages the way they were before the index and the token counts existed."""
+        await self.client.rpush(
+            self.history.key,
+            *[self.history.codec.encode(message_to_dict(m)) for m in messages],
+        )
+
+    async def contents(self) -> list[str]:
+        return [m.content for m in await self.history.aget_messages()]
+
+
+class TestUpdateMessage(HistoryTestCase):
+    async def test_update(self):
+        messages = [make_message("foo"), make_message("bar", human=False)]
+        await self.history.aadd_messages(messages)
+        await self.history.aupdate_message(
+            messages[1].additional_kwargs["id"], {"feedback": "like"}
+        )
+        foo, bar = await self.history.aget_messages()
+        self.assertNotIn("feedback", foo.additional_kwargs)
+        self.assertEqual(bar.additional_kwargs["feedback"], "like")
+        # merged into the existing ones
+        self.assertEqual(
+            bar.additional_kwargs["id"], messages[1].additional_kwargs["id"]
+        )
+
+    async def test_hyphenated_id(self):
+        message = make_message("foo")
+        await self.history.aadd_messages([message])
+        hyphenated = str(UUID(message.additional_kwargs["id"]))
+        await self.history.aupdate_message(hyphenated, {"feedback": "dislike"})
+        [foo] = await self.history.aget_messages()
+        self.assertEqual(foo.additional_kwargs["feedback"], "dislike")
+
+    async def test_not_found(self):
+        await self.history.aadd_messages([make_message("foo")])
+        with self.assertRaises(MessageNotFoundException):
+            await self.history.aupdate_message(uuid4().hex, {"feedback": "like"})
+
+    async def test_legacy_index(self):
+        messages = [make_message("foo"), make_message("bar", human=False)]
+        await self.push_legacy(messages)
+        await self.history.aupdate_message(
+            messages[1].additional_kwargs["id"], {"feedback": "like"}
+        )
+        # the index is rebuilt for all messages, and kept up to date after
+        self.assertEqual(await self.client.hlen(self.history.index_key), 2)
+        baz = make_message("baz")
+        await self.history.aadd_messages([baz])
+        await self.history.aupdate_message(
+            baz.additional_kwargs["id"], {"feedback": "like"}
+        )
+        messages = await self.history.aget_messages()
+        self.assertEqual(
+            [m.additional_kwargs.get("feedback") for m in messages],
+            [None, "like", "like"],
+        )
+
+
+class TestAppend(HistoryTestCase):
+    async def test_batch(self):
+        first = [make_message("foo"), make_message("bar", human=False)]
+        second = [make_message("baz"), make_message("qux", human=False)]
+        await self.history.aadd_messages(first)
+        await self.history.aadd_messages(second)
+        self.assertEqual(await self.contents(), ["foo", "bar", "baz", "qux"])
+        # messages are indexed by their positions, and their token counts kept aside in order
+        index = await self.client.hgetall(self.history.index_key)
+        self.assertEqual(
+            {k.decode(): int(v) for k, v in index.items()},
+            {m.additional_kwargs["id"]: i for i, m in enumerate(first + second)},
+        )
+        tokens = await self.client.lrange(self.history.tokens_key, 0, -1)
+        self.assertEqual([int(t) for t in tokens], [3, 3, 3, 3])
+        # the history is marked active
+        self.assertIsNotNone(
+            await self.client.zscore(self.history.activity_key, self.history.key)
+        )
+
+    async def test_ttl(self):
+        history = self.make_history(ttl=60)
+        await history.aadd_messages([make_message("foo")])
+        for key in (history.key, history.index_key, history.tokens_key):
+            self.assertGreater(await self.client.ttl(key), 0)
+
+    async def test_write_buffer(self):
+        async with HistoryWriteBuffer(self.history, interval=60) as buffer:
+            await buffer.aadd_messages([make_message("foo")])
+            await buffer.aadd_messages([make_message("bar", human=False)])
+            self.assertEqual(await self.contents(), [])
+        self.assertEqual(await self.contents(), ["foo", "bar"])
+        self.assertEqual(await self.client.llen(self.history.tokens_key), 2)
+
+
+class TestBudgetedWindow(HistoryTestCase):
+    async def test_budget(self):
+        contents = ["a" * 10, "b" * 20, "c" * 30, "d" * 40]
+        await self.history.aadd_messages([make_message(c) for c in contents])
+        start, messages = await self.history.abudgeted_window(70)
+        self.assertEqual(start, 2)
+        self.assertEqual([m.content for m in messages], contents[2:])
+        # the budget is inclusive
+        start, messages = await self.history.abudgeted_window(90)
+        self.assertEqual(start, 1)
+        self.assertEqual([m.content for m in messages], contents[1:])
+
+    async def test_all_fit(self):
+        await self.history.aadd_messages([make_message("foo"), make_message("bar")])
+        start, messages = await self.history.abudgeted_window(1000)
+        self.assertEqual(start, 0)
+        self.assertEqual(len(messages), 2)
+
+    async def test_none_fit(self):
+        await self.history.aadd_messages([make_message("foo")])
+        start, messages = await self.history.abudgeted_window(1)
+        self.assertEqual((start, messages), (1, []))
+
+    async def test_empty(self):
+        self.assertEqual(await self.history.abudgeted_window(1000), (0, []))
+
+    async def test_many(self):
+        # the script reads the token counts in chunks of 64
+        await self.history.aadd_messages([make_message("a" * 10) for _ in range(200)])
+        start, messages = await self.history.abudgeted_window(1000)
+        self.assertEqual(start, 100)
+        self.assertEqual(len(messages), 100)
+
+    async def test_legacy_token_counts(self):
+        await self.push_legacy([make_message("a" * 10), make_message("b" * 10)])
+        # the token counts are built once, and kept aligned by later appends
+        await self.history.aadd_messages([make_message("c" * 10)])
+        start, messages = await self.history.abudgeted_window(20)
+        self.assertEqual(start, 1)
+        self.assertEqual([m.content for m in messages], ["b" * 10, "c" * 10])
+        tokens = await self.client.lrange(self.history.tokens_key, 0, -1)
+        self.assertEqual([int(t) for t in tokens], [10, 10, 10])
+
+
+class TestOffload(HistoryTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.archive = HistoryArchive(tmp.name)
+        self.history = self.make_history(archive=self.archive)
+        self.messages = [make_message("foo"), make_message("bar", human=False)]
+        await self.history.aadd_messages(self.messages)
+
+    async def offload(self) -> str:
+        self.assertEqual(await self.history.aoffload_idle(idle=0), 1)
+        return (await self.client.get(f"{self.history.key}:archived")).decode()
+
+    async def test_offload(self):
+        file_path = await self.offload()
+        self.assertTrue(os.path.isfile(file_path))
+        for key in (
+            self.history.key,
+            self.history.index_key,
+            self.history.tokens_key,
+        ):
+            self.assertFalse(await self.client.exists(key))
+        self.assertIsNone(
+            await self.client.zscore(self.history.activity_key, self.history.key)
+        )
+
+    async def test_active(self):
+        self.assertEqual(await self.history.aoffload_idle(idle=3600), 0)
+        self.assertEqual(await self.contents(), ["foo", "bar"])
+
+    async def test_rehydrate(self):
+        file_path = await self.offload()
+        self.assertEqual(await self.contents(), ["foo", "bar"])
+        self.assertFalse(os.path.exists(file_path))
+        self.assertFalse(await self.client.exists(f"{self.history.key}:archived"))
+        # the index and the token counts are loaded back too
+        await self.history.aupdate_message(
+            self.messages[0].additional_kwargs["id"], {"feedback": "like"}
+        )
+        start, messages = await self.history.abudgeted_window(3)
+        self.assertEqual((start, [m.content for m in messages]), (1, ["bar"]))
+
+    async def test_append_after_offload(self):
+        await self.offload()
+        await self.history.aadd_messages([make_message("baz")])
+        self.assertEqual(await self.contents(), ["foo", "bar", "baz"])
+        self.assertEqual(await self.client.llen(self.history.tokens_key), 3)
+
+    async def test_budgeted_window_after_offload(self):
+        await self.offload()
+        start, messages = await self.history.abudgeted_window(1000)
+        self.assertEqual((start, [m.content for m in messages]), (0, ["foo", "bar"]))
+
+    async def test_rehydrated_concurrently(self):
+        await self.offload()
+        archived_key = f"{self.history.key}:archived"
+
+        async def aread(file_path):
+            # loaded, and the file deleted, by another replica meanwhile
+            await self.client.delete(archived_key)
+            raise FileNotFoundError(file_path)
+
+        with patch.object(self.archive, "aread", side_effect=aread):
+            self.assertTrue(await self.history._arehydrate(self.history.key))
+
+    async def test_clear(self):
+        file_path = await self.offload()
+        await self.history.aclear()
+        self.assertFalse(os.path.exists(file_path))
+        self.assertEqual(await self.contents(), [])
@@ -0,0 +1,23 @@
+import unittest
+
+from langchain.memory.chat_message_histories.in_memory import ChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from pybot.memory import PybotMemory
+
+
+class TestPybotMemory(unittest.IsolatedAsyncioTestCase):
+    async def test_aload_memory_variables(self):
+        history = ChatMessageHistory()
+        await history.aadd_messages(
+            [
+                HumanMessage(content="foo"),
+                AIMessage(content="bar"),
+                HumanMessage(content="baz"),
+                AIMessage(content="qux"),
+            ]
+        )
+        memory = PybotMemory(history=history, k=1)
+        variables = await memory.aload_memory_variables({"input": "quux"})
+        self.assertEqual([msg.content for msg in variables["history"]], ["baz", "qux"])
+        self.assertEqual(variables, memory.load_memory_variables({"input": "quux"}))
@@ -0,0 +1,15 @@
+import unittest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from pybot.memory.tokens import TokenCounter
+
+
+class TestTokenCounter(unittest.TestCase):
+    def test_estimate_by_characters(self):
+        counter = TokenCounter(chars_per_token=4, message_overhead=4)
+        # as if the encoding cannot be loaded
+        counter.encoding = None
+        self.assertEqual(counter.count(HumanMessage(content="")), 4)
+        self.assertEqual(counter.count(HumanMessage(content="foo")), 5)
+        self.assertEqual(counter.count(AIMessage(content="foo bar baz")), 7)
@@ -0,0 +1,82 @@
+import json
+import unittest
+from uuid import uuid4
+
+from langchain_core.callbacks import AsyncCallbackManager
+
+from pybot.callbacks import ToolOutputStreamer
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data: str) -> None:
+        self.sent.append(json.loads(data))
+
+
+class TestToolOutputStreamer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.websocket = FakeWebSocket()
+        self.streamer = ToolOutputStreamer(self.websocket, "foo")
+        self.streamer.parent_id = uuid4()
+        self.manager = AsyncCallbackManager(handlers=[self.streamer])
+
+    async def start_tool(self, name: str = "python"):
+        return await self.manager.on_tool_start({"name": name}, "print('foo')")
+
+    def sent(self) -> list[tuple[str, str]]:
+        return [(msg["type"], msg["content"]) for msg in self.websocket.sent]
+
+    async def test_stream(self):
+        run_manager = await self.start_tool()
+        await run_manager.on_text("foo")
+        await run_manager.on_text("bar")
+        await run_manager.on_tool_end("foobar")
+        self.assertEqual(
+            self.sent(),
+            [("stream/start", "foo"), ("stream/text", "bar"), ("stream/end", "")],
+        )
+        for msg in self.websocket.sent:
+            # the same id as the observation sent once the tool finishes
+            self.assertEqual(msg["id"], str(run_manager.run_id))
+            self.assertEqual(msg["parent_id"], str(self.streamer.parent_id))
+            self.assertEqual(msg["conversation"], "foo")
+            self.assertEqual(msg["from"], "system")
+            self.assertEqual(msg["additional_kwargs"], {"tool": "python"})
+
+    async def test_error(self):
+        run_manager = await self.start_tool()
+        await run_manager.on_text("foo")
+        await run_manager.on_tool_error(RuntimeError("bar"))
+        self.assertEqual(self.sent(), [("stream/start", "foo"), ("stream/end", "")])
+
+    async def test_no_output(self):
+        run_manager = await self.start_tool()
+        await run_manager.on_text("")
+        await run_manager.on_tool_end("")
+        self.assertEqual(self.websocket.sent, [])
+
+    async def test_not_a_tool(self):
+        # chains log their verbose output with on_text too
+        run_manager = await self.manager.on_chain_start({"name": "agent"}, {})
+        await run_manager.on_text("foo")
+        self.assertEqual(self.websocket.sent, [])
+
+    async def test_concurrent_tools(self):
+        foo, bar = await self.start_tool("foo"), await self.start_tool("bar")
+        await foo.on_text("foo")
+        await bar.on_text("bar")
+        await foo.on_tool_end("foo")
+        await bar.on_text("baz")
+        await bar.on_tool_end("barbaz")
+        self.assertEqual(
+            [(msg["id"], msg["type"], msg["content"]) for msg in self.websocket.sent],
+            [
+                (str(foo.run_id), "stream/start", "foo"),
+                (str(bar.run_id), "stream/start", "bar"),
+                (str(foo.run_id), "stream/end", ""),
+                (str(bar.run_id), "stream/text", "baz"),
+                (str(bar.run_id), "stream/end", ""),
+            ],
+        )
@@ -0,0 +1,91 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import fakeredis
+
+from pybot.index import ConversationIndex, InvalidCursorException
+from pybot.models import Conversation as ORMConversation
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeQuery:
+    def __init__(self, convs):
+        self.convs = convs
+
+    async def all(self):
+        return self.convs
+
+
+class TestConversationIndex(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        patcher = patch.object(ORMConversation, "db", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = ConversationIndex()
+        self.convs = []
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def create(self, title: str, minutes: int, pinned: bool = False):
+        at = EPOCH + timedelta(minutes=minutes)
+        conv = ORMConversation(
+            title=title, owner="foo", pinned=pinned, created_at=at, last_message_at=at
+        )
+        await conv.save()
+        self.convs.append(conv)
+        return conv
+
+    def find(self):
+        """`find` needs RediSearch, query the conversations created so far instead."""
+        return patch.object(
+            ORMConversation, "find", side_effect=lambda *_: FakeQuery(self.convs)
+        )
+
+    async def list_all(self, limit: int) -> list[str]:
+        titles, cursor = [], None
+        while True:
+            convs, cursor = await self.index.alist("foo", cursor, limit)
+            titles.extend(conv.title for conv in convs)
+            if cursor is None:
+                return titles
+
+    async def test_pagination(self):
+        with self.find():
+            for i in range(5):
+                await self.index.aadd(await self.create(f"conv {i}", minutes=i))
+            # conversations sharing a score are neither skipped nor repeated
+            for title in ("same 0", "same 1", "same 2"):
+                await self.index.aadd(await self.create(title, minutes=10))
+            await self.index.aadd(await self.create("pinned", minutes=-1, pinned=True))
+            titles = await self.list_all(limit=2)
+        self.assertEqual(titles[0], "pinned")
+        self.assertEqual(sorted(titles[1:4]), ["same 0", "same 1", "same 2"])
+        self.assertEqual(titles[4:], [f"conv {i}" for i in range(4, -1, -1)])
+
+    async def test_backfill_before_add(self):
+        # conversations created before the index existed
+        for i in range(3):
+            await self.create(f"old {i}", minutes=i)
+        with self.find():
+            # the user chats before listing the conversations
+            await self.index.aadd(await self.create("new", minutes=10))
+            titles = await self.list_all(limit=10)
+        self.assertEqual(titles, ["new", "old 2", "old 1", "old 0"])
+
+    async def test_backfill_once(self):
+        await self.create("old", minutes=0)
+        with self.find() as find:
+            await self.index.alist("foo")
+            await self.index.aadd(await self.create("new", minutes=10))
+            # another replica, without the in-process cache
+            await ConversationIndex().alist("foo")
+        self.assertEqual(find.call_count, 1)
+
+    async def test_invalid_cursor(self):
+        for cursor in ("foo", "1:2:3", "1:foo", "1:-1"):
+            with self.assertRaises(InvalidCursorException):
+                await self.index.alist("foo", cursor)
@@ -0,0 +1,23 @@
+import unittest
+
+from pybot.streaming import StreamCoalescer
+
+
+class TestStreamCoalescer(unittest.TestCase):
+    def test_flush_by_size(self):
+        coalescer = StreamCoalescer(interval=60, size=8)
+        self.assertEqual(coalescer.push("foo"), "")
+        self.assertEqual(coalescer.push("bar"), "")
+        self.assertEqual(coalescer.push("baz"), "foobarbaz")
+        self.assertEqual(coalescer.flush(), "")
+
+    def test_flush_by_interval(self):
+        coalescer = StreamCoalescer(interval=0, size=1024)
+        self.assertEqual(coalescer.push("foo"), "foo")
+        self.assertEqual(coalescer.push("bar"), "bar")
+
+    def test_flush_rest(self):
+        coalescer = StreamCoalescer(interval=60, size=1024)
+        coalescer.push("foo")
+        coalescer.push("bar")
+        self.assertEqual(coalescer.flush(), "foobar")
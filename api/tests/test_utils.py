@@ -0,0 +1,30 @@
+import asyncio
+import unittest
+from contextvars import ContextVar
+
+from pybot.utils import run_sync
+
+var = ContextVar("var", default=None)
+
+
+class TestRunSync(unittest.TestCase):
+    def test_same_loop(self):
+        # pooled connections are bound to the loop they are opened in
+        async def loop():
+            return asyncio.get_running_loop()
+
+        self.assertIs(run_sync(loop()), run_sync(loop()))
+
+    def test_context(self):
+        async def get():
+            return var.get()
+
+        var.set("foo")
+        self.assertEqual(run_sync(get()), "foo")
+
+    def test_running_loop(self):
+        async def nested():
+            return run_sync(asyncio.sleep(0))
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(nested())
@@ -0,0 +1,189 @@
+import json
+import unittest
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+from pybot.jupyter import ContextAwareKernelManager, Kernel
+from pybot.jupyter.schema import KernelNotFoundException
+from pybot.models import File
+from pybot.tools import CodeSandbox
+
+
+class TestObservationBudget(unittest.TestCase):
+    def setUp(self):
+        self.tool = CodeSandbox(
+            gateway_url="http://localhost:8888", observation_budget=40
+        )
+        self.file = File(
+            filename="outputs/foo.txt",
+            path="/mnt/shared/some-user/some-conversation/outputs/foo.txt",
+            mounted_path="/mnt/shared/outputs/foo.txt",
+            size=0,
+            owner="some-user",
+            conversation_id="some-conversation",
+        )
+
+    def test_exceeds_budget(self):
+        self.assertFalse(self.tool._exceeds_budget("a" * 40))
+        self.assertTrue(self.tool._exceeds_budget("a" * 41))
+        self.tool.observation_budget = 0
+        self.assertFalse(self.tool._exceeds_budget("a" * 1000))
+
+    def test_truncate(self):
+        output = "\n".join(f"line {i}" for i in range(100))
+        truncated = self.tool._truncate(output, self.file)
+        self.assertTrue(truncated.startswith("line 0\nline 1\n"))
+        self.assertTrue(truncated.endswith("line 98\nline 99"))
+        self.assertIn("/mnt/shared/outputs/foo.txt", truncated)
+        # cut at line breaks
+        for line in truncated.splitlines():
+            self.assertTrue(line.startswith("line ") or line.startswith("..."))
+
+    def test_append_files(self):
+        ref = self.tool._append_files("", [self.file])
+        self.assertEqual(
+            ref,
+            f"![/mnt/shared/outputs/foo.txt](/api/conversations/some-conversation/files/{self.file.pk})",
+        )
+        self.assertEqual(self.tool._append_files("foo", [self.file]), f"foo\n{ref}")
+        self.assertEqual(self.tool._append_files("foo", []), "foo")
+
+    def test_truncate_tiny_budget(self):
+        self.tool.observation_budget = 1
+        output = "a" * 100 + "b" * 100
+        truncated = self.tool._truncate(output, self.file)
+        self.assertTrue(truncated.startswith("a\n"))
+        self.assertTrue(truncated.endswith("\nb"))
+        self.assertIn("198 characters omitted", truncated)
+
+
+def _message(msg_type: str, content: dict) -> str:
+    header = {"msg_id": "foo", "msg_type": msg_type}
+    return json.dumps(
+        {
+            "header": header,
+            "msg_id": "foo",
+            "msg_type": msg_type,
+            "parent_header": {"msg_id": "bar"},
+            "metadata": {},
+            "content": content,
+            "buffers": [],
+            "channel": "iopub",
+        }
+    )
+
+
+class FakeMessages:
+    def __init__(self, text: str):
+        self.messages = [
+            _message("stream", {"name": "stdout", "text": text}),
+            _message("status", {"execution_state": "idle"}),
+        ]
+
+    async def recv(self, timeout=None) -> str:
+        return self.messages.pop(0)
+
+
+class FakeKernelManager(ContextAwareKernelManager):
+    """Kernel manager whose first kernel is culled by the gateway."""
+
+    def __init__(self, gateway_host: str):
+        super().__init__(gateway_host)
+        self.started: list[str] = []
+
+    async def astart_kernel(self) -> Kernel:
+        kernel_id = f"00000000-0000-0000-0000-00000000000{len(self.started)}"
+        self.started.append(kernel_id)
+        return Kernel(
+            id=kernel_id,
+            name="python3",
+            last_activity="2024-01-01T00:00:00Z",
+            execution_state="idle",
+            connections=0,
+        )
+
+    @asynccontextmanager
+    async def aexecute_many(self, kernel_id, requests):
+        if kernel_id == self.started[0]:
+            raise KernelNotFoundException(f"kernel {kernel_id} not found")
+        yield [FakeMessages(f"ran on {kernel_id}") for _ in requests]
+
+
+class TestCollect(unittest.IsolatedAsyncioTestCase):
+    async def test_display_data_then_execute_result(self):
+        tool = CodeSandbox(gateway_url="http://localhost:8888")
+        image = File(
+            filename="outputs/foo.png",
+            path="/mnt/shared/some-user/some-conversation/outputs/foo.png",
+            mounted_path="/mnt/shared/outputs/foo.png",
+            size=0,
+            owner="some-user",
+            conversation_id="some-conversation",
+        )
+        messages = FakeMessages("")
+        messages.messages = [
+            _message("stream", {"name": "stdout", "text": "plotting"}),
+            _message("display_data", {"data": {"image/png": ""}, "metadata": {}}),
+            _message(
+                "execute_result",
+                {"data": {"text/plain": "42"}, "metadata": {}, "execution_count": 1},
+            ),
+            _message("status", {"execution_state": "idle"}),
+        ]
+        with (
+            patch.object(tool.kernel_manager.current_session, "aget"),
+            patch("pybot.tools.python.asave_display_data", return_value=image),
+        ):
+            result, failed = await tool._acollect(messages)
+        self.assertFalse(failed)
+        self.assertEqual(result, tool._append_files("42", [image]))
+
+
+class TestKernelGone(unittest.IsolatedAsyncioTestCase):
+    async def test_retry_with_new_kernel(self):
+        kernel_manager = FakeKernelManager(gateway_host="http://localhost:8888")
+        tool = CodeSandbox(
+            gateway_url="http://localhost:8888", kernel_manager=kernel_manager
+        )
+        result = await tool._arun("print(1)")
+        self.assertEqual(len(kernel_manager.started), 2)
+        self.assertEqual(result, f"ran on {kernel_manager.started[1]}")
+
+
+class TestCells(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.kernel_manager = FakeKernelManager(gateway_host="http://localhost:8888")
+        # skip the culled kernel
+        self.kernel_manager.started.append("culled")
+        self.tool = CodeSandbox(
+            gateway_url="http://localhost:8888", kernel_manager=self.kernel_manager
+        )
+
+    async def test_cell_marker_in_code(self):
+        result = await self.tool.arun("a = 1\n# %%\nprint(a)")
+        self.assertEqual(result, f"ran on {self.kernel_manager.started[1]}")
+
+    async def test_cells(self):
+        result = await self.tool.arun(
+            {"code": "a = 1\n# %%\nprint(a)", "cells": ["a = 1", "print(a)"]}
+        )
+        kernel_id = self.kernel_manager.started[1]
+        self.assertEqual(
+            result, f"# %% [1]\nran on {kernel_id}\n# %% [2]\nran on {kernel_id}"
+        )
+
+    def test_cells_hidden_from_llm(self):
+        self.assertEqual(list(self.tool.tool_call_schema.__fields__), ["code"])
+
+
+class TestSync(unittest.TestCase):
+    def test_run(self):
+        kernel_manager = FakeKernelManager(gateway_host="http://localhost:8888")
+        # skip the culled kernel
+        kernel_manager.started.append("culled")
+        tool = CodeSandbox(
+            gateway_url="http://localhost:8888", kernel_manager=kernel_manager
+        )
+        for _ in range(2):
+            result = tool.run("print(1)")
+            self.assertEqual(result, f"ran on {kernel_manager.started[-1]}")
@@ -1,4 +1,4 @@
-import { createContext, useEffect, useReducer } from "react";
+import { createContext, useCallback, useEffect, useReducer, useState } from "react";
 
 
 /**
@@ -7,6 +7,8 @@ import { createContext, useEffect, useReducer } from "react";
 export const ConversationContext = createContext({
     groupedConvs: {},
     dispatch: () => { },
+    hasMore: false,
+    loadMore: () => { },
 });
 
 const flatConvs = (groupedConvs) => {
@@ -69,26 +71,43 @@ export const ConversationProvider = ({ children }) => {
         {},
     );
 
+    // cursor of the next page of conversations, null if there's no more
+    const [cursor, setCursor] = useState(null);
+
     useEffect(() => {
         const init = async () => {
-            const convs = await fetch("/api/conversations", {
+            const page = await fetch("/api/conversations", {
             }).then((res) => res.json());
 
             // This assumes that the convs are already sorted by the server.
             // Otherwise, I need to call `sortConvs` first.
-            const groupedConvs = groupConvs(convs);
+            const groupedConvs = groupConvs(page.conversations);
 
             dispatch({
                 type: "replaceAll",
                 groupedConvs
             });
+            setCursor(page.cursor ?? null);
         };
 
         init();
     }, []);
 
+    const loadMore = useCallback(async () => {
+        if (cursor === null) {
+            return;
+        }
+        const page = await fetch(`/api/conversations?cursor=${encodeURIComponent(cursor)}`, {
+        }).then((res) => res.json());
+        dispatch({
+            type: "appended",
+            convs: page.conversations,
+        });
+        setCursor(page.cursor ?? null);
+    }, [cursor]);
+
     return (
-        <ConversationContext.Provider value={{ groupedConvs, dispatch }}>
+        <ConversationContext.Provider value={{ groupedConvs, dispatch, hasMore: cursor !== null, loadMore }}>
             {children}
         </ConversationContext.Provider>
     );
@@ -108,6 +127,12 @@ export const conversationReducer = (groupedConvs, action) => {
             }
             return {Today: [action.conv], ...groupedConvs};
         }
+        case "appended": {
+            // action.convs: next page of conversations, already sorted by the server
+            const convs = flatConvs(groupedConvs);
+            const ids = new Set(convs.map((conv) => conv.id));
+            return groupConvs([...convs, ...action.convs.filter((conv) => !ids.has(conv.id))]);
+        }
         case "deleted": {
             const convs = flatConvs(groupedConvs);
             return groupConvs(convs.filter((conv) => conv.id !== action.convId));
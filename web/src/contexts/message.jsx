@@ -25,21 +25,24 @@ export const MessageProvider = ({ children }) => {
 
 const mergeObservationIntoAction = (messages) => {
     const mergedMessages = [];
-    const actionMessages = new Map();
+    // parent_id -> index of the action message in mergedMessages
+    const actionIndexes = new Map();
 
     for (const message of messages) {
-        if (message.type !== "action" && message.type !== "observation") {
+        if (message.type === "action") {
+            actionIndexes.set(message.parent_id, mergedMessages.length);
             mergedMessages.push(message);
-        } else if (message.type === "action") {
-            actionMessages.set(message.parent_id, message);
         } else if (message.type === "observation") {
-            const actionMessage = actionMessages.get(message.parent_id);
-            if (actionMessage) {
-                mergedMessages.push({ ...actionMessage, additional_kwargs: { ...actionMessage.additional_kwargs, observation: message.content } });
-                actionMessages.delete(message.parent_id);
+            const idx = actionIndexes.get(message.parent_id);
+            if (idx !== undefined) {
+                const actionMessage = mergedMessages[idx];
+                mergedMessages[idx] = { ...actionMessage, additional_kwargs: { ...actionMessage.additional_kwargs, observation: message.content } };
+                actionIndexes.delete(message.parent_id);
             } else {
                 mergedMessages.push(message);
             }
+        } else {
+            mergedMessages.push(message);
         }
     }
     return mergedMessages;
@@ -51,8 +54,9 @@ export const messagessReducer = (messages, action) => {
             // find reversly could potentially be faster as the full message usually is the last one (streamed).
             const match = messages.findLastIndex(message => message.id === action.message.id);
             if (match !== -1) {
-                // message already exists, ignore it
-                return messages;
+                // message already exists, for example streamed before the full message arrives.
+                // replace it with the full one.
+                return [...messages.slice(0, match), { ...messages[match], ...action.message }, ...messages.slice(match + 1)];
             }
             return [...messages, { ...action.message }];
         }
@@ -72,12 +76,27 @@ export const messagessReducer = (messages, action) => {
             }
             return [...messages.slice(0, match), { ...messages[match], additional_kwargs: { ...messages[match].additional_kwargs, observation: action.message.content } }, ...messages.slice(match + 1)];
         }
+        case "observation-streamed": {
+            const match = messages.findLastIndex(message => message.type === "action" && message.parent_id === action.message.parent_id);
+            if (match === -1) {
+                return messages;
+            }
+            const output = (messages[match].additional_kwargs?.output || "") + action.message.content;
+            return [...messages.slice(0, match), { ...messages[match], additional_kwargs: { ...messages[match].additional_kwargs, output: output } }, ...messages.slice(match + 1)];
+        }
         case "feedback": {
-            // action: { idx, feedback }
-            // action.idx: message index
+            // action: { id, feedback }
+            // action.id: message id
             // action.feedback: feedback object, thumbup / thumbdown
-            const msg = messages[action.idx];
-            return [...messages.slice(0, action.idx), { ...msg, feedback: action.feedback }, ...messages.slice(action.idx + 1)];
+            const match = messages.findLastIndex(message => message.id === action.id);
+            if (match === -1) {
+                return messages;
+            }
+            return [...messages.slice(0, match), { ...messages[match], feedback: action.feedback }, ...messages.slice(match + 1)];
+        }
+        case "prepended": {
+            // older messages loaded, the first observations we have may belong to actions in them.
+            return mergeObservationIntoAction([...action.messages, ...messages]);
         }
         case "replaceAll": {
             return mergeObservationIntoAction(action.messages);
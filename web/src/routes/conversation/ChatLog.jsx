@@ -2,10 +2,14 @@ import { useEffect, useRef } from "react";
 
 /**
  * ChatLog is a container for ChatMessage that will automatically scroll to bottom when window size changes.
+ * It only scrolls if the bottom was in view, so that loading older messages does not jump to the bottom.
  * @param {Array} children
+ * @param {Function} onReachTop called when the top of the log comes into view
  */
-const ChatLog = ({ children, className }) => {
+const ChatLog = ({ children, className, onReachTop }) => {
+  const messagesStartRef = useRef(null);
   const messagesEndRef = useRef(null);
+  const atBottom = useRef(true);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -15,7 +19,9 @@ const ChatLog = ({ children, className }) => {
     if (window.ResizeObserver) {
       const chatLogElem = document.getElementById("chat-log");
       const resizeObserver = new ResizeObserver(() => {
-        scrollToBottom();
+        if (atBottom.current) {
+          scrollToBottom();
+        }
       });
       resizeObserver.observe(chatLogElem);
 
@@ -25,8 +31,26 @@ const ChatLog = ({ children, className }) => {
     }
   }, []);
 
+  useEffect(() => {
+    const observer = new IntersectionObserver((entries) => {
+      entries.forEach((entry) => {
+        if (entry.target === messagesEndRef.current) {
+          atBottom.current = entry.isIntersecting;
+        } else if (entry.isIntersecting) {
+          onReachTop?.();
+        }
+      });
+    });
+    observer.observe(messagesStartRef.current);
+    observer.observe(messagesEndRef.current);
+    return () => {
+      observer.disconnect();
+    };
+  }, [onReachTop]);
+
   return (
     <div id="chat-log" className={className}>
+      <div ref={messagesStartRef} />
       {children}
       <div ref={messagesEndRef} />
     </div>
@@ -2,7 +2,12 @@ import "./index.css";
 
 import MarkdownContent from "../MarkdownContent";
 
+// Images saved by the code sandbox, served by the files router.
+const IMAGE_REF = /!\[[^\]]*\]\(\/api\/conversations\/[^)]+\)/g;
+
 const ActionMessage = ({ className, message }) => {
+    const observation = message.additional_kwargs?.observation;
+    const images = observation?.match(IMAGE_REF) || [];
 
     return (
         <div className={className}>
@@ -15,13 +20,24 @@ const ActionMessage = ({ className, message }) => {
                             text={`\`\`\`${message.additional_kwargs.action.tool}\n${message.additional_kwargs.action.tool_input}\n\`\`\``}
                         />
                     }
+                    {/* live output while the action is still running, replaced by the observation once finished */}
+                    {message.additional_kwargs?.observation === undefined && message.additional_kwargs?.output &&
+                        <MarkdownContent
+                            title="output"
+                            text={`\`\`\`pycon\n${message.additional_kwargs.output}\n\`\`\``}
+                        />
+                    }
                     {/* TODO: I simply render observation as a markdown console snippet for now */}
-                    {message.additional_kwargs?.observation &&
+                    {observation &&
                         <MarkdownContent
                             title="result"
-                            text={`\`\`\`pycon\n${message.additional_kwargs.observation}\n\`\`\``}
+                            text={`\`\`\`pycon\n${observation.replace(IMAGE_REF, "").trim()}\n\`\`\``}
                         />
                     }
+                    {/* images can't be rendered inside the code block */}
+                    {images.length > 0 &&
+                        <MarkdownContent text={images.join("\n\n")} />
+                    }
                 </details>
             }
         </div>
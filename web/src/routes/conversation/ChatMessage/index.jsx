@@ -24,6 +24,8 @@ const Message = ({ className, message }) => {
     case "file":
       return <FileMessage className={className} message={message} />;
     case "text":
+    case "stream/start":
+      // streamed messages are replaced by the full message once finished
       return <TextMessage className={className} text={message.content} />;
     case "action":
       return <ActionMessage className={className} message={message} />;
@@ -35,13 +37,12 @@ const Message = ({ className, message }) => {
 
 /**
  * @param {string} convId
- * @param {integer} idx
  * @param {object} message
  * @param {string} message.from
  * @param {string} message.content
  * @returns
  */
-const ChatMessage = ({ convId, idx, message }) => {
+const ChatMessage = ({ convId, message }) => {
   const { username } = useContext(UserContext);
   const { dispatch } = useContext(MessageContext);
   const [copyTooltipTitle, setCopyTooltipTitle] = useState("copy content");
@@ -56,27 +57,25 @@ const ChatMessage = ({ convId, idx, message }) => {
     }, "3000");
   };
   const onThumbUpClick = () => {
-    fetch(`/api/conversations/${convId}/messages/${idx}/thumbup`, {
+    fetch(`/api/conversations/${convId}/messages/${message.id}/thumbup`, {
       method: "PUT",
     }).then(() => {
       setThumbUpTooltipTitle("thanks!");
       dispatch({
         type: "feedback",
-        id: convId,
-        idx: idx,
+        id: message.id,
         feedback: "thumbup",
       });
     });
   };
   const onThumbDownClick = () => {
-    fetch(`/api/conversations/${convId}/messages/${idx}/thumbdown`, {
+    fetch(`/api/conversations/${convId}/messages/${message.id}/thumbdown`, {
       method: "PUT",
     }).then(() => {
       setThumbDownTooltipTitle("thanks!");
       dispatch({
         type: "feedback",
-        id: convId,
-        idx: idx,
+        id: message.id,
         feedback: "thumbdown",
       });
     });
@@ -1,6 +1,6 @@
 import "./index.css";
 
-import { useContext, useEffect } from "react";
+import { useCallback, useContext, useEffect, useRef, useState } from "react";
 import { useLoaderData, redirect, useNavigation } from "react-router-dom";
 
 import ChatboxHeader from "components/ChatboxHeader";
@@ -47,6 +47,9 @@ const Conversation = () => {
     const [ready, send] = useContext(WebsocketContext);
     const { messages, dispatch } = useContext(MessageContext);
     const navigation = useNavigation();
+    // cursor to load older messages, null if there's no more
+    const [cursor, setCursor] = useState(null);
+    const loadingOlder = useRef(false);
 
     useEffect(() => {
         if (conversation?.messages) {
@@ -54,6 +57,7 @@ const Conversation = () => {
                 type: "replaceAll",
                 messages: conversation.messages,
             });
+            setCursor(conversation.cursor ?? null);
             const initMsg = sessionStorage.getItem(`init-msg:${conversation.id}`);
             if (initMsg === undefined || initMsg === null) {
                 return;
@@ -71,6 +75,28 @@ const Conversation = () => {
         }
     }, [conversation]);
 
+    const loadOlderMessages = useCallback(async () => {
+        if (cursor === null || loadingOlder.current) {
+            return;
+        }
+        loadingOlder.current = true;
+        try {
+            const resp = await fetch(`/api/conversations/${conversation.id}/messages?before=${cursor}`, {});
+            if (!resp.ok) {
+                console.error(resp);
+                return;
+            }
+            const page = await resp.json();
+            dispatch({
+                type: "prepended",
+                messages: page.messages,
+            });
+            setCursor(page.cursor ?? null);
+        } finally {
+            loadingOlder.current = false;
+        }
+    }, [conversation, cursor]);
+
     const handleDrop = async (files) => {
         // TODO: add file size limit
         const response = await uploadFiles(conversation.id, files);
@@ -99,9 +125,9 @@ const Conversation = () => {
         // TODO: this loading state will render the delete dialog
         <FileUploader className={`chatbox ${navigation.state === "loading" ? "loading" : ""}`} onFilesDrop={handleDrop}>
             <ChatboxHeader />
-            <ChatLog className="chat-log">
-                {conversation && messages?.map((message, index) => (
-                    <ChatMessage key={index} convId={conversation.id} idx={index} message={message} />
+            <ChatLog className="chat-log" onReachTop={loadOlderMessages}>
+                {conversation && messages?.map((message) => (
+                    <ChatMessage key={message.id} convId={conversation.id} message={message} />
                 ))}
             </ChatLog>
             <div className="input-bottom">
@@ -32,7 +32,7 @@ export async function action({ request }) {
 }
 
 const Root = () => {
-  const { groupedConvs, dispatch: dispatchConv } = useContext(ConversationContext);
+  const { groupedConvs, dispatch: dispatchConv, hasMore, loadMore } = useContext(ConversationContext);
 
   const { theme } = useContext(ThemeContext);
   const { snackbar, setSnackbar } = useContext(SnackbarContext);
@@ -82,12 +82,22 @@ const Root = () => {
               dispatch({ type: "observation-received", message: message });
               break;
             case "stream/start":
+              if (message.additional_kwargs?.tool) {
+                // live output of a running tool, see `stream/text`
+                dispatch({ type: "observation-streamed", message: message });
+                break;
+              }
               dispatch({
                 type: "added",
                 message: { content: message.content || "", ...message },
               });
               break;
             case "stream/text":
+              if (message.additional_kwargs?.tool) {
+                // live output of a running tool, the full output comes later in the "observation" message
+                dispatch({ type: "observation-streamed", message: message });
+                break;
+              }
               dispatch({
                 type: "appended",
                 message: message,
@@ -175,6 +185,11 @@ const Root = () => {
               </div>
             ]
           ))}
+          {hasMore &&
+            <button className="sidemenu-button" onClick={loadMore}>
+              Load more
+            </button>
+          }
           <hr className="sidemenu-bottom" />
           <div className="sidemenu-bottom-group">
             <div className="sidemenu-bottom-group-items">